@@ -27,6 +27,17 @@ API_SERVICE_OPTS = [
                default=1000,
                help='The maximum number of items returned in a single '
                     'response from a collection resource.'),
+    cfg.IntOpt('max_bulk_nodes',
+               default=1000,
+               help='The maximum number of nodes of a single bulk request, '
+                    'e.g. of a bulk power state change.'),
+    cfg.BoolOpt('slave_reads',
+                default=True,
+                help='Read the resources of the GET requests from the slave '
+                     'database, when database.slave_connection is set. The '
+                     'slave may lag behind the master, so disable this if '
+                     'the clients of the API need to read their own writes '
+                     'right away.'),
     ]
 
 CONF = cfg.CONF
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import datetime
 
 import jsonpatch
@@ -50,7 +51,8 @@ class NodePatchType(types.JsonPatchType):
     @staticmethod
     def internal_attrs():
         defaults = types.JsonPatchType.internal_attrs()
-        return defaults + ['/console_enabled', '/last_error',
+        return defaults + ['/console_enabled', '/deploy_progress',
+                           '/last_error',
                            '/power_state', '/provision_state', '/reservation',
                            '/target_power_state', '/target_provision_state',
                            '/provision_updated_at']
@@ -87,11 +89,49 @@ class NodeConsoleController(rest.RestController):
                                               enabled, topic)
 
 
+class NodeDeployPhase(base.APIBase):
+    """API representation of a phase of the deployment of a node."""
+
+    name = wtypes.text
+    "The name of the phase"
+
+    duration = float
+    "The duration of the phase, in seconds"
+
+
+class NodeDeployProgress(base.APIBase):
+    """API representation of the progress of the deployment of a node."""
+
+    phase = wtypes.text
+    "The phase in progress, if any"
+
+    phases = [NodeDeployPhase]
+    "The phases which have ended, in order"
+
+    bytes_copied = int
+    "The number of bytes of the image copied to the node"
+
+    bytes_total = int
+    "The size of the image, in bytes"
+
+    @classmethod
+    def convert(cls, deploy_progress):
+        progress = NodeDeployProgress(
+            phase=deploy_progress.get('phase'),
+            bytes_copied=deploy_progress.get('bytes_copied'),
+            bytes_total=deploy_progress.get('bytes_total'))
+        progress.phases = [NodeDeployPhase(**phase)
+                           for phase in deploy_progress.get('phases', [])]
+        return progress
+
+
 class NodeStates(base.APIBase):
     """API representation of the states of a node."""
 
     console_enabled = types.boolean
 
+    deploy_progress = NodeDeployProgress
+
     power_state = wtypes.text
 
     provision_state = wtypes.text
@@ -112,9 +152,46 @@ class NodeStates(base.APIBase):
         states = NodeStates()
         for attr in attr_list:
             setattr(states, attr, getattr(rpc_node, attr))
+        if rpc_node.deploy_progress:
+            states.deploy_progress = NodeDeployProgress.convert(
+                                                rpc_node.deploy_progress)
         return states
 
 
+class NodePowerResult(base.APIBase):
+    """API representation of the result of a power state request for one
+    node of a bulk request.
+    """
+
+    uuid = types.uuid
+    "The UUID of the node"
+
+    accepted = types.boolean
+    "Whether the power state change of the node was started"
+
+    error = wtypes.text
+    "The reason why the power state change was not started"
+
+    links = [link.Link]
+    "A list containing a self link to the states of the node"
+
+    @classmethod
+    def convert_with_links(cls, node_uuid, error=None):
+        result = NodePowerResult(uuid=node_uuid, accepted=error is None)
+        if error is not None:
+            result.error = error
+        # the progress of the power state change is tracked by polling
+        # the states of the node.
+        url = pecan.request.host_url
+        result.links = [link.Link.make_link('self', url, 'nodes',
+                                            node_uuid + "/states"),
+                        link.Link.make_link('bookmark', url, 'nodes',
+                                            node_uuid + "/states",
+                                            bookmark=True)
+                       ]
+        return result
+
+
 class NodeStatesController(rest.RestController):
 
     _custom_actions = {
@@ -323,11 +400,19 @@ class Node(base.APIBase):
         # NOTE(lucasagomes): chassis_uuid is not part of objects.Node.fields
         #                    because it's an API-only attribute
         self.fields.append('chassis_uuid')
-        setattr(self, 'chassis_uuid', kwargs.get('chassis_id'))
+        if 'chassis_uuid' in kwargs:
+            # NOTE: the UUID was already looked up, e.g. along with the
+            #       UUIDs of the chassis of the other nodes of a collection.
+            self._chassis_uuid = kwargs['chassis_uuid']
+        else:
+            setattr(self, 'chassis_uuid', kwargs.get('chassis_id'))
 
     @classmethod
-    def _convert_with_links(cls, node, url, expand=True):
-        if not expand:
+    def _convert_with_links(cls, node, url, expand=True, fields=None):
+        if fields is not None:
+            # NOTE: the UUID identifies the node, e.g. in the next link.
+            node.unset_fields_except(['uuid'] + fields)
+        elif not expand:
             except_list = ['instance_uuid', 'power_state',
                            'provision_state', 'uuid']
             node.unset_fields_except(except_list)
@@ -351,10 +436,23 @@ class Node(base.APIBase):
         return node
 
     @classmethod
-    def convert_with_links(cls, rpc_node, expand=True):
-        node = Node(**rpc_node.as_dict())
+    def convert_with_links(cls, rpc_node, expand=True, fields=None,
+                           **kwargs):
+        """Convert a node object to its API representation.
+
+        :param rpc_node: a :class:`ironic.objects.Node`, or a row returned
+                         by dbapi.get_nodeinfo_list() if fields is given.
+        :param expand: whether to include all the fields of the node.
+        :param fields: the names of the only fields to include.
+        :param kwargs: the chassis_uuid of the node, if it is already known.
+        """
+        if fields is not None:
+            values = rpc_node._asdict()
+        else:
+            values = rpc_node.as_dict()
+        node = Node(**dict(values, **kwargs))
         return cls._convert_with_links(node, pecan.request.host_url,
-                                       expand)
+                                       expand, fields)
 
     @classmethod
     def sample(cls, expand=True):
@@ -387,9 +485,21 @@ class NodeCollection(collection.Collection):
 
     @classmethod
     def convert_with_links(cls, nodes, limit, url=None,
-                           expand=False, **kwargs):
+                           expand=False, fields=None, **kwargs):
         collection = NodeCollection()
-        collection.nodes = [Node.convert_with_links(n, expand) for n in nodes]
+        if expand or (fields is not None and 'chassis_uuid' in fields):
+            # NOTE: look the UUIDs of the chassis of the whole page up at
+            #       once instead of once per node.
+            chassis_uuids = pecan.request.dbapi.get_chassis_uuids(
+                    list(set(n.chassis_id for n in nodes if n.chassis_id)))
+        else:
+            # NOTE: chassis_uuid is not part of the short representation.
+            chassis_uuids = {}
+        collection.nodes = [Node.convert_with_links(n, expand, fields,
+                                chassis_uuid=chassis_uuids.get(n.chassis_id))
+                            for n in nodes]
+        if fields is not None:
+            kwargs['fields'] = ','.join(fields)
         collection.next = collection.get_next(limit, url=url, **kwargs)
         return collection
 
@@ -446,29 +556,38 @@ class NodesController(rest.RestController):
     _custom_actions = {
         'detail': ['GET'],
         'validate': ['GET'],
+        'power': ['PUT'],
     }
 
+    _list_fields = sorted(set(objects.Node.fields) -
+                          set(['id', 'chassis_id', 'deploy_progress'])
+                          ) + ['chassis_uuid']
+    "The fields which can be selected when listing nodes"
+
     def __init__(self, from_chassis=False):
         self._from_chassis = from_chassis
 
     def _get_nodes_collection(self, chassis_uuid, instance_uuid, associated,
                               maintenance, marker, limit, sort_key, sort_dir,
-                              expand=False, resource_url=None):
+                              expand=False, resource_url=None, fields=None):
         if self._from_chassis and not chassis_uuid:
             raise exception.InvalidParameterValue(_(
                   "Chassis id not specified."))
 
         limit = api_utils.validate_limit(limit)
         sort_dir = api_utils.validate_sort_dir(sort_dir)
+        fields = api_utils.validate_fields(fields, self._list_fields)
 
         marker_obj = None
         if marker:
             marker_obj = objects.Node.get_by_uuid(pecan.request.context,
                                                   marker)
+        filters = {}
         if instance_uuid:
-            nodes = self._get_nodes_by_instance(instance_uuid)
+            # NOTE: an instance is on a single node, the other filters
+            #       are ignored.
+            filters['instance_uuid'] = instance_uuid
         else:
-            filters = {}
             if chassis_uuid:
                 filters['chassis_uuid'] = chassis_uuid
             if associated is not None:
@@ -476,6 +595,19 @@ class NodesController(rest.RestController):
             if maintenance is not None:
                 filters['maintenance'] = maintenance
 
+        if fields is not None:
+            # NOTE: only fetch (and decode) the columns of the requested
+            #       fields, and the ones the links and the chassis UUID
+            #       are made from.
+            columns = set(fields) - set(['chassis_uuid'])
+            columns = list(columns | set(['uuid', 'chassis_id']))
+            nodes = pecan.request.dbapi.get_nodeinfo_list(columns, filters,
+                                                          limit, marker_obj,
+                                                          sort_key=sort_key,
+                                                          sort_dir=sort_dir)
+        elif instance_uuid:
+            nodes = self._get_nodes_by_instance(instance_uuid)
+        else:
             nodes = pecan.request.dbapi.get_node_list(filters, limit,
                                                       marker_obj,
                                                       sort_key=sort_key,
@@ -489,6 +621,7 @@ class NodesController(rest.RestController):
         return NodeCollection.convert_with_links(nodes, limit,
                                                  url=resource_url,
                                                  expand=expand,
+                                                 fields=fields,
                                                  **parameters)
 
     def _get_nodes_by_instance(self, instance_uuid):
@@ -504,10 +637,10 @@ class NodesController(rest.RestController):
 
     @wsme_pecan.wsexpose(NodeCollection, types.uuid, types.uuid,
                types.boolean, types.boolean, types.uuid, int, wtypes.text,
-               wtypes.text)
+               wtypes.text, wtypes.text)
     def get_all(self, chassis_uuid=None, instance_uuid=None, associated=None,
                 maintenance=None, marker=None, limit=None, sort_key='id',
-                sort_dir='asc'):
+                sort_dir='asc', fields=None):
         """Retrieve a list of nodes.
 
         :param chassis_uuid: Optional UUID of a chassis, to get only nodes for
@@ -524,10 +657,14 @@ class NodesController(rest.RestController):
         :param limit: maximum number of resources to return in a single result.
         :param sort_key: column to sort results by. Default: id.
         :param sort_dir: direction to sort. "asc" or "desc". Default: asc.
+        :param fields: Optional comma-separated list of the fields to return,
+                       e.g. "uuid,power_state,driver". Only the columns of
+                       these fields are read from the database.
         """
         return self._get_nodes_collection(chassis_uuid, instance_uuid,
                                           associated, maintenance, marker,
-                                          limit, sort_key, sort_dir)
+                                          limit, sort_key, sort_dir,
+                                          fields=fields)
 
     @wsme_pecan.wsexpose(NodeCollection, types.uuid, types.uuid,
             types.boolean, types.boolean, types.uuid, int, wtypes.text,
@@ -573,6 +710,87 @@ class NodesController(rest.RestController):
         return pecan.request.rpcapi.validate_driver_interfaces(
                 pecan.request.context, rpc_node.uuid, topic)
 
+    @wsme_pecan.wsexpose([NodePowerResult], [types.uuid], wtypes.text,
+                         status_code=202)
+    def power(self, node_uuids, target):
+        """Set the power state of many nodes.
+
+        The nodes are grouped by the conductor service which they are mapped
+        to, and a single request is sent to each of these conductors. This
+        call returns a 202 (Accepted) and the result of each node, telling
+        whether its power state change was started. The client should
+        continue to GET the states of the accepted nodes to observe the
+        status of the requested action.
+
+        :param node_uuids: UUIDs of the nodes.
+        :param target: The desired power state of the nodes.
+        :raises: InvalidStateRequested (HTTP 400) if the requested target
+                 state is not valid.
+        :raises: InvalidParameterValue (HTTP 400) if no node or more than
+                 CONF.api.max_bulk_nodes nodes are specified.
+
+        """
+        if self._from_chassis:
+            raise exception.OperationNotPermitted
+
+        if not node_uuids:
+            raise exception.InvalidParameterValue(_("No nodes specified."))
+        # keep the order of the request, without duplicates
+        node_uuids = utils.unique(node_uuids)
+        if len(node_uuids) > CONF.api.max_bulk_nodes:
+            raise exception.InvalidParameterValue(
+                    _("Too many nodes specified: %(count)d, the maximum is "
+                      "%(max)d.") % {'count': len(node_uuids),
+                                     'max': CONF.api.max_bulk_nodes})
+
+        if target not in [ir_states.POWER_ON,
+                          ir_states.POWER_OFF,
+                          ir_states.REBOOT]:
+            raise exception.InvalidStateRequested(state=target,
+                                                  node=', '.join(node_uuids))
+
+        context = pecan.request.context
+        rpcapi = pecan.request.rpcapi
+        nodes = pecan.request.dbapi.get_nodes(node_uuids)
+
+        errors = {}
+        nodes_by_driver = collections.defaultdict(list)
+        for node in nodes:
+            nodes_by_driver[node.driver].append(node)
+        uuids_by_topic = collections.defaultdict(list)
+        for driver_nodes in nodes_by_driver.values():
+            try:
+                topics = rpcapi.get_topics_for(driver_nodes)
+            except exception.NoValidHost as e:
+                for node in driver_nodes:
+                    errors[node.uuid] = six.text_type(e)
+                continue
+            for node_uuid, topic in topics.items():
+                uuids_by_topic[topic].append(node_uuid)
+
+        # NOTE: the conductors are called one after the other. Each call
+        #       only reserves the nodes and queues their power actions, so
+        #       it returns quickly however many nodes are sent.
+        for topic, topic_uuids in uuids_by_topic.items():
+            try:
+                errors.update(rpcapi.change_nodes_power_state(
+                        context, topic_uuids, target, topic))
+            except Exception as e:
+                LOG.exception(_("Failed to change the power state of nodes "
+                                "on %(topic)s: %(err)s") %
+                              {'topic': topic, 'err': e})
+                # NOTE: the conductor may have queued some of the power
+                #       actions before the call failed.
+                msg = (_("The conductor did not confirm the power state "
+                         "change, check the states of the node: %s")
+                       % six.text_type(e))
+                for node_uuid in topic_uuids:
+                    errors[node_uuid] = msg
+
+        return [NodePowerResult.convert_with_links(node_uuid,
+                                                   errors.get(node_uuid))
+                for node_uuid in node_uuids]
+
     @wsme_pecan.wsexpose(Node, types.uuid)
     def get_one(self, node_uuid):
         """Retrieve information about the given node.
@@ -96,12 +96,33 @@ class Port(base.APIBase):
         # NOTE(lucasagomes): node_uuid is not part of objects.Port.fields
         #                    because it's an API-only attribute
         self.fields.append('node_uuid')
-        setattr(self, 'node_uuid', kwargs.get('node_id'))
+        if 'node_uuid' in kwargs:
+            # NOTE: the UUID was already looked up, e.g. along with the
+            #       UUIDs of the nodes of the other ports of a collection.
+            self._node_uuid = kwargs['node_uuid']
+        else:
+            setattr(self, 'node_uuid', kwargs.get('node_id'))
 
     @classmethod
-    def convert_with_links(cls, rpc_port, expand=True):
-        port = Port(**rpc_port.as_dict())
-        if not expand:
+    def convert_with_links(cls, rpc_port, expand=True, fields=None,
+                           **kwargs):
+        """Convert a port object to its API representation.
+
+        :param rpc_port: a :class:`ironic.objects.Port`, or a row returned
+                         by dbapi.get_portinfo_list() if fields is given.
+        :param expand: whether to include all the fields of the port.
+        :param fields: the names of the only fields to include.
+        :param kwargs: the node_uuid of the port, if it is already known.
+        """
+        if fields is not None:
+            values = rpc_port._asdict()
+        else:
+            values = rpc_port.as_dict()
+        port = Port(**dict(values, **kwargs))
+        if fields is not None:
+            # NOTE: the UUID identifies the port, e.g. in the next link.
+            port.unset_fields_except(['uuid'] + fields)
+        elif not expand:
             port.unset_fields_except(['uuid', 'address'])
 
         # never expose the node_id attribute
@@ -140,10 +161,21 @@ class PortCollection(collection.Collection):
 
     @classmethod
     def convert_with_links(cls, rpc_ports, limit, url=None,
-                           expand=False, **kwargs):
+                           expand=False, fields=None, **kwargs):
         collection = PortCollection()
-        collection.ports = [Port.convert_with_links(p, expand)
+        if expand or (fields is not None and 'node_uuid' in fields):
+            # NOTE: look the UUIDs of the nodes of the whole page up at once
+            #       instead of once per port.
+            node_uuids = pecan.request.dbapi.get_node_uuids(
+                    list(set(p.node_id for p in rpc_ports if p.node_id)))
+        else:
+            # NOTE: node_uuid is not part of the short representation.
+            node_uuids = {}
+        collection.ports = [Port.convert_with_links(p, expand, fields,
+                                node_uuid=node_uuids.get(p.node_id))
                             for p in rpc_ports]
+        if fields is not None:
+            kwargs['fields'] = ','.join(fields)
         collection.next = collection.get_next(limit, url=url, **kwargs)
         return collection
 
@@ -161,24 +193,40 @@ class PortsController(rest.RestController):
         'detail': ['GET'],
     }
 
+    _list_fields = sorted(set(objects.Port.fields) -
+                          set(['id', 'node_id'])) + ['node_uuid']
+    "The fields which can be selected when listing ports"
+
     def __init__(self, from_nodes=False):
         self._from_nodes = from_nodes
 
     def _get_ports_collection(self, node_uuid, marker, limit, sort_key,
-                              sort_dir, expand=False, resource_url=None):
+                              sort_dir, expand=False, resource_url=None,
+                              fields=None):
         if self._from_nodes and not node_uuid:
             raise exception.InvalidParameterValue(_(
                   "Node id not specified."))
 
         limit = api_utils.validate_limit(limit)
         sort_dir = api_utils.validate_sort_dir(sort_dir)
+        fields = api_utils.validate_fields(fields, self._list_fields)
 
         marker_obj = None
         if marker:
             marker_obj = objects.Port.get_by_uuid(pecan.request.context,
                                                   marker)
 
-        if node_uuid:
+        if fields is not None:
+            # NOTE: only fetch (and decode) the columns of the requested
+            #       fields, and the ones the links and the node UUID are
+            #       made from.
+            columns = set(fields) - set(['node_uuid'])
+            columns = list(columns | set(['uuid', 'node_id']))
+            ports = pecan.request.dbapi.get_portinfo_list(columns, node_uuid,
+                                                          limit, marker_obj,
+                                                          sort_key=sort_key,
+                                                          sort_dir=sort_dir)
+        elif node_uuid:
             ports = pecan.request.dbapi.get_ports_by_node(node_uuid, limit,
                                                           marker_obj,
                                                           sort_key=sort_key,
@@ -191,13 +239,14 @@ class PortsController(rest.RestController):
         return PortCollection.convert_with_links(ports, limit,
                                                  url=resource_url,
                                                  expand=expand,
+                                                 fields=fields,
                                                  sort_key=sort_key,
                                                  sort_dir=sort_dir)
 
     @wsme_pecan.wsexpose(PortCollection, types.uuid, types.uuid, int,
-                         wtypes.text, wtypes.text)
+                         wtypes.text, wtypes.text, wtypes.text)
     def get_all(self, node_uuid=None, marker=None, limit=None,
-                sort_key='id', sort_dir='asc'):
+                sort_key='id', sort_dir='asc', fields=None):
         """Retrieve a list of ports.
 
         :param node_uuid: UUID of a node, to get only ports for that node.
@@ -205,9 +254,12 @@ class PortsController(rest.RestController):
         :param limit: maximum number of resources to return in a single result.
         :param sort_key: column to sort results by. Default: id.
         :param sort_dir: direction to sort. "asc" or "desc". Default: asc.
+        :param fields: Optional comma-separated list of the fields to return,
+                       e.g. "uuid,address". Only the columns of these fields
+                       are read from the database.
         """
         return self._get_ports_collection(node_uuid, marker, limit,
-                                          sort_key, sort_dir)
+                                          sort_key, sort_dir, fields=fields)
 
     @wsme_pecan.wsexpose(PortCollection, types.uuid, types.uuid, int,
                          wtypes.text, wtypes.text)
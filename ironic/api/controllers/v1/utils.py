@@ -39,3 +39,23 @@ def validate_sort_dir(sort_dir):
                                          "Acceptable values are "
                                          "'asc' or 'desc'") % sort_dir)
     return sort_dir
+
+
+def validate_fields(fields, allowed_fields):
+    """Parse the comma-separated names of the fields to return.
+
+    :param fields: the value of the fields parameter, or None.
+    :param allowed_fields: the names of the fields which can be returned.
+    :returns: the list of the names of the fields, None if fields is None.
+    """
+    if fields is None:
+        return None
+
+    fields = [f.strip() for f in fields.split(',') if f.strip()]
+    invalid = [f for f in fields if f not in allowed_fields]
+    if invalid:
+        msg = (_("Invalid fields: %(invalid)s. Acceptable values are "
+                 "%(allowed)s") % {'invalid': ', '.join(invalid),
+                                   'allowed': ', '.join(allowed_fields)})
+        raise wsme.exc.ClientSideError(msg)
+    return fields
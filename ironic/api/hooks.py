@@ -39,6 +39,13 @@ class DBHook(hooks.PecanHook):
 
     def before(self, state):
         state.request.dbapi = dbapi.get_instance()
+        # NOTE: the requests which change resources read them from the
+        #       master, so that they do not act on an outdated state.
+        state.request.dbapi.set_slave_reads(cfg.CONF.api.slave_reads and
+                                            state.request.method == 'GET')
+
+    def after(self, state):
+        state.request.dbapi.set_slave_reads(False)
 
 
 class ContextHook(hooks.PecanHook):
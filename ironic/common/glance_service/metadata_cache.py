@@ -0,0 +1,156 @@
+# coding=utf-8
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cache of the metadata of the Glance images.
+
+A deployment looks up the metadata of the same images several times (when
+the node is validated, prepared, deployed and cleaned up), so the metadata
+returned by Glance is kept by the conductor for
+CONF.glance.metadata_cache_ttl seconds, and the images which are not found
+for CONF.glance.metadata_cache_negative_ttl seconds.
+
+The cache is keyed by image UUID only: the images are looked up on behalf
+of the admin requests of the Ironic API, so their metadata is not
+filtered by project.
+"""
+
+import copy
+import time
+
+from oslo.config import cfg
+
+from ironic.common import exception
+from ironic.common.glance_service import service_utils
+from ironic.openstack.common import log as logging
+
+metadata_cache_opts = [
+    cfg.IntOpt('metadata_cache_ttl',
+               default=300,
+               help='Time (in seconds) for which the metadata of an active '
+                    'image is cached by a conductor. 0 - disable the '
+                    'cache.'),
+    cfg.IntOpt('metadata_cache_negative_ttl',
+               default=30,
+               help='Time (in seconds) for which an image which was not '
+                    'found in Glance is cached as missing. 0 - do not '
+                    'cache missing images.'),
+    cfg.IntOpt('metadata_cache_size',
+               default=1000,
+               help='Maximum number of images whose metadata is cached by '
+                    'a conductor.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(metadata_cache_opts, group='glance')
+
+LOG = logging.getLogger(__name__)
+
+
+class ImageMetadataCache(object):
+    """The metadata of the images recently looked up in Glance."""
+
+    def __init__(self):
+        # NOTE: image UUID -> (expiration time, metadata or None if the
+        #       image was not found)
+        self._entries = {}
+
+    def show(self, image_service, image_href):
+        """Get the metadata of an image, from the cache if possible.
+
+        :param image_service: the image service to look the image up with
+                              if it is not cached.
+        :param image_href: href or UUID of the image.
+        :returns: a dict containing the image metadata.
+        :raises: ImageNotFound
+        """
+        image_id = service_utils.parse_image_ref(image_href)[0]
+        now = time.time()
+        entry = self._entries.get(image_id)
+        if entry is not None and entry[0] > now:
+            if entry[1] is None:
+                raise exception.ImageNotFound(image_id=image_id)
+            return copy.deepcopy(entry[1])
+
+        try:
+            image_meta = image_service.show(image_href)
+        except exception.ImageNotFound:
+            ttl = CONF.glance.metadata_cache_negative_ttl
+            if ttl > 0:
+                self._store(image_id, now + ttl, None)
+            raise
+
+        cached_meta = entry and entry[1]
+        if (cached_meta and cached_meta.get('updated_at') and
+                image_meta.get('updated_at') and
+                image_meta['updated_at'] < cached_meta['updated_at']):
+            # NOTE: a Glance server lagging behind the one which returned
+            #       the cached metadata must not make it go back in time.
+            LOG.debug(_("Ignoring outdated metadata of image %s.")
+                      % image_id)
+            image_meta = cached_meta
+
+        ttl = CONF.glance.metadata_cache_ttl
+        # NOTE: images which are not active yet are about to change.
+        if ttl > 0 and image_meta.get('status', 'active') == 'active':
+            self._store(image_id, now + ttl, image_meta)
+        else:
+            self._entries.pop(image_id, None)
+        return copy.deepcopy(image_meta)
+
+    def _store(self, image_id, expiration, image_meta):
+        if (image_id not in self._entries and
+                len(self._entries) >= CONF.glance.metadata_cache_size):
+            self._remove_oldest()
+        self._entries[image_id] = (expiration, image_meta)
+
+    def _remove_oldest(self):
+        now = time.time()
+        for image_id, entry in list(self._entries.items()):
+            if entry[0] <= now:
+                del self._entries[image_id]
+        if len(self._entries) >= CONF.glance.metadata_cache_size:
+            oldest = min(self._entries, key=lambda i: self._entries[i][0])
+            del self._entries[oldest]
+
+    def invalidate(self, image_href=None):
+        """Remove an image, or all the images, from the cache.
+
+        :param image_href: href or UUID of the image, None for all the
+                           images.
+        """
+        if image_href is None:
+            self._entries.clear()
+        else:
+            image_id = service_utils.parse_image_ref(image_href)[0]
+            self._entries.pop(image_id, None)
+
+
+_cache = ImageMetadataCache()
+
+
+def show(image_service, image_href):
+    """Get the metadata of an image, from the cache if possible.
+
+    See :meth:`ImageMetadataCache.show`.
+    """
+    return _cache.show(image_service, image_href)
+
+
+def invalidate(image_href=None):
+    """Remove an image, or all the images, from the cache.
+
+    See :meth:`ImageMetadataCache.invalidate`.
+    """
+    _cache.invalidate(image_href)
@@ -14,12 +14,18 @@
 #    under the License.
 
 import array
+import collections
 import hashlib
 import struct
+import threading
+import time
 
 from oslo.config import cfg
+import six
 
 from ironic.common import exception
+from ironic.db import api as dbapi
+from ironic.openstack.common import log
 
 hash_opts = [
     cfg.IntOpt('hash_partition_exponent',
@@ -36,11 +42,43 @@ hash_opts = [
                     'conductor services to prepare deployment environments '
                     'and potentially allow the Ironic cluster to recover '
                     'more quickly if a conductor instance is terminated.'),
+    cfg.IntOpt('hash_ring_check_interval',
+               default=10,
+               help='Minimum time (in seconds) between checks of the set of '
+                    'active conductors by the shared hash ring registry. '
+                    'The hash rings are only rebuilt when that set has '
+                    'changed.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(hash_opts)
 
+LOG = log.getLogger(__name__)
+
+OwnedPartitions = collections.namedtuple(
+        'OwnedPartitions',
+        ['shift', 'modulus', 'residues', 'tail_start', 'tail'])
+"""The partitions of a `HashRing` which a host is mapped to.
+
+A partition p is mapped to the host if p is in `tail`, or if p is lower than
+`tail_start` and (p % `modulus`) is in `residues`. The partition of a
+partition key k is (k >> `shift`).
+"""
+
+
+def get_partition_key(data):
+    """Get the 32-bit key which determines the partition of some data.
+
+    :param data: A string identifier to be mapped across a ring.
+    :returns: an integer; the partition of the data in a `HashRing` is
+              this key shifted right by the ring's partition_shift.
+    """
+    try:
+        return struct.unpack_from('>I', hashlib.md5(data).digest())[0]
+    except TypeError:
+        raise exception.Invalid(
+                _("Invalid data supplied to HashRing.get_hosts."))
+
 
 class HashRing(object):
 
@@ -62,19 +100,64 @@ class HashRing(object):
         except TypeError:
             raise exception.Invalid(
                     _("Invalid hosts supplied when building HashRing."))
+        if not self.hosts:
+            raise exception.Invalid(
+                    _("Invalid hosts supplied when building HashRing."))
 
         self.partition_shift = 32 - CONF.hash_partition_exponent
-        self.part2host = array.array('H')
-        for p in range(2 ** CONF.hash_partition_exponent):
-            self.part2host.append(p % len(hosts))
+        num_partitions = 2 ** CONF.hash_partition_exponent
+        num_hosts = len(self.hosts)
+
+        # Partition p is mapped onto host (p % num_hosts), so build the
+        # table by repeating one cycle of host ids.
+        cycle = array.array('H', range(num_hosts))
+        self.part2host = cycle * (num_partitions // num_hosts)
+        self.part2host.extend(cycle[:num_partitions % num_hosts])
+
+        # Successor tables: the order in which distinct hosts are found when
+        # walking the ring forward from a partition. Every partition which is
+        # at least num_hosts away from the end of the ring sees all the hosts
+        # before wrapping around, so it shares the successors of its host.
+        # Only the last few partitions need a table of their own.
+        self._host_successors = [
+                tuple(self.hosts[(h + i) % num_hosts]
+                      for i in range(num_hosts))
+                for h in range(num_hosts)]
+        self._tail_start = max(num_partitions - num_hosts + 1, 0)
+        self._tail_successors = [self._walk(p) for p in
+                                 range(self._tail_start, num_partitions)]
+
+    def _walk(self, partition):
+        """Walk the ring from a partition, collecting each host once."""
+        num_partitions = len(self.part2host)
+        host_ids = []
+        for i in six.moves.range(num_partitions):
+            host_id = self.part2host[(partition + i) % num_partitions]
+            if host_id not in host_ids:
+                host_ids.append(host_id)
+                if len(host_ids) == len(self.hosts):
+                    break
+        return tuple(self.hosts[h] for h in host_ids)
+
+    def _get_successors(self, partition):
+        if partition >= self._tail_start:
+            return self._tail_successors[partition - self._tail_start]
+        return self._host_successors[self.part2host[partition]]
 
     def _get_partition(self, data):
-        try:
-            return (struct.unpack_from('>I', hashlib.md5(data).digest())[0]
-                    >> self.partition_shift)
-        except TypeError:
-            raise exception.Invalid(
-                    _("Invalid data supplied to HashRing.get_hosts."))
+        return get_partition_key(data) >> self.partition_shift
+
+    def _select_hosts(self, successors, ignore_hosts):
+        if not ignore_hosts:
+            return list(successors[:self.replicas])
+
+        hosts = []
+        for host in successors:
+            if len(hosts) == self.replicas:
+                break
+            if host not in ignore_hosts:
+                hosts.append(host)
+        return hosts
 
     def get_hosts(self, data, ignore_hosts=None):
         """Get the list of hosts which the supplied data maps onto.
@@ -89,21 +172,130 @@ class HashRing(object):
                   this `HashRing` was created with. It may be less than this
                   if ignore_hosts is not None.
         """
-        host_ids = []
-        if ignore_hosts is None:
-            ignore_host_ids = []
-        else:
-            ignore_host_ids = [self.hosts.index(h)
-                               for h in ignore_hosts if h in self.hosts]
-
-        partition = self._get_partition(data)
-        for replica in range(0, self.replicas):
-            if len(host_ids + ignore_host_ids) == len(self.hosts):
-                # prevent infinite loop
-                break
-            while self.part2host[partition] in host_ids + ignore_host_ids:
-                partition += 1
-                if partition >= len(self.part2host):
-                    partition = 0
-            host_ids.append(self.part2host[partition])
-        return [self.hosts[h] for h in host_ids]
+        ignore_hosts = frozenset(ignore_hosts or [])
+        successors = self._get_successors(self._get_partition(data))
+        return self._select_hosts(successors, ignore_hosts)
+
+    def get_hosts_bulk(self, data_list, ignore_hosts=None):
+        """Get the lists of hosts which many identifiers map onto.
+
+        This is equivalent to calling get_hosts() for each identifier, but
+        is cheaper when routing a large number of nodes at once.
+
+        :param data_list: An iterable of string identifiers to be mapped
+                          across the ring.
+        :param ignore_hosts: A list of hosts to skip when performing the hash.
+                             Default: None.
+        :returns: a dict which maps each identifier to its list of hosts.
+        """
+        ignore_hosts = frozenset(ignore_hosts or [])
+        get_partition = self._get_partition
+        get_successors = self._get_successors
+        select_hosts = self._select_hosts
+        return dict((data, select_hosts(get_successors(get_partition(data)),
+                                        ignore_hosts))
+                    for data in data_list)
+
+    def get_owned_partitions(self, host):
+        """Get the partitions which a host is mapped to.
+
+        This allows to look up the data mapped to a host without hashing
+        every identifier, eg. by filtering on stored partition keys.
+
+        :param host: the host.
+        :returns: an `OwnedPartitions` tuple.
+        """
+        residues = [h for h, successors in enumerate(self._host_successors)
+                    if host in successors[:self.replicas]]
+        tail = [self._tail_start + i
+                for i, successors in enumerate(self._tail_successors)
+                if host in successors[:self.replicas]]
+        return OwnedPartitions(shift=self.partition_shift,
+                               modulus=len(self.hosts),
+                               residues=residues,
+                               tail_start=self._tail_start,
+                               tail=tail)
+
+
+class HashRingManager(object):
+    """Process-wide registry of the hash rings for all active drivers.
+
+    All instances share the same rings. The set of active conductors is
+    checked at most once every CONF.hash_ring_check_interval seconds, and
+    the rings are only rebuilt when that set has changed.
+    """
+
+    _hash_rings = None
+    _fingerprint = None
+    _last_check = None
+    _lock = threading.Lock()
+    _stats = {'checks': 0,
+              'rebuilds': 0,
+              'last_rebuild_time': 0.0,
+              'total_rebuild_time': 0.0}
+
+    def __init__(self):
+        self.dbapi = dbapi.get_instance()
+
+    @property
+    def ring(self):
+        """A dict which maps driver names to their `HashRing`."""
+        cls = self.__class__
+        if (cls._hash_rings is None or
+                time.time() - cls._last_check >=
+                CONF.hash_ring_check_interval):
+            self.refresh()
+        return cls._hash_rings
+
+    def refresh(self):
+        """Check the set of active conductors now, and rebuild the rings
+        if it has changed since the last check.
+        """
+        cls = self.__class__
+        with cls._lock:
+            cls._last_check = time.time()
+            cls._stats['checks'] += 1
+            fingerprint = self.dbapi.get_active_conductor_fingerprint()
+            if (cls._hash_rings is not None and
+                    fingerprint == cls._fingerprint):
+                return
+
+            start = time.time()
+            rings = {}
+            d2c = self.dbapi.get_active_driver_dict()
+            for driver_name, hosts in d2c.items():
+                rings[driver_name] = HashRing(hosts)
+            elapsed = time.time() - start
+
+            cls._hash_rings = rings
+            cls._fingerprint = fingerprint
+            cls._stats['rebuilds'] += 1
+            cls._stats['last_rebuild_time'] = elapsed
+            cls._stats['total_rebuild_time'] += elapsed
+        LOG.debug(_("Rebuilt hash rings for drivers %(drivers)s in "
+                    "%(time).3f seconds.") % {'drivers': rings.keys(),
+                                              'time': elapsed})
+
+    def __getitem__(self, driver_name):
+        """Get the `HashRing` for a driver.
+
+        :param driver_name: the name of a driver.
+        :raises: DriverNotFound if no active conductor supports the driver.
+        """
+        try:
+            return self.ring[driver_name]
+        except KeyError:
+            raise exception.DriverNotFound(driver_name=driver_name)
+
+    @classmethod
+    def reset(cls):
+        """Drop the cached rings so they are rebuilt on next access."""
+        with cls._lock:
+            cls._hash_rings = None
+            cls._fingerprint = None
+            cls._last_check = None
+
+    @classmethod
+    def stats(cls):
+        """Return a copy of the rebuild counters and timings (in seconds)."""
+        return dict(cls._stats)
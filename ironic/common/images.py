@@ -19,12 +19,17 @@
 Handling of VM disk images.
 """
 
+import hashlib
+import io
+import mmap
 import os
 import re
 
 from oslo.config import cfg
+from six.moves import http_client
 
 from ironic.common import exception
+from ironic.common.glance_service import metadata_cache
 from ironic.common import image_service as service
 from ironic.common import utils
 from ironic.openstack.common import fileutils
@@ -37,11 +42,43 @@ image_opts = [
     cfg.BoolOpt('force_raw_images',
                 default=True,
                 help='Force backing images to raw format.'),
+    cfg.BoolOpt('sparse_raw_images',
+                default=True,
+                help='Do not write the blocks of zeros of the raw images '
+                     'which are downloaded, so that the image files are '
+                     'sparse.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(image_opts)
 
+# NOTE: magic numbers of the formats qemu-img detects from the start of
+#       an image. An image with none of them is assumed to be raw until
+#       qemu-img says otherwise.
+_FORMAT_MAGICS = (
+    ('qcow2', 0, 'QFI\xfb'),
+    ('qed', 0, 'QED\x00'),
+    ('vmdk', 0, 'KDMV'),
+    ('vmdk', 0, 'COWD'),
+    ('vmdk', 0, '# Disk DescriptorFile'),
+    ('vpc', 0, 'conectix'),
+    ('vhdx', 0, 'vhdxfile'),
+    ('vdi', 0x40, '\x7f\x10\xda\xbe'),
+    ('parallels', 0, 'WithoutFreeSpace'),
+    ('parallels', 0, 'WithouFreSpacExt'),
+    ('bochs', 0, 'Bochs Virtual HD Image'),
+    ('cloop', 0, '#!/bin/sh\n#V2.0 Format'),
+)
+_HEADER_SIZE = 512
+_SPARSE_BLOCK_SIZE = 64 * 1024
+_ZERO_BLOCK = '\x00' * _SPARSE_BLOCK_SIZE
+
+# NOTE: errors of the connection to the image service, after which the
+#       download of an image is resumed.
+_RESUMABLE_ERRORS = (IOError, http_client.HTTPException,
+                     exception.GlanceConnectionFailed,
+                     exception.CommunicationError)
+
 
 class QemuImgInfo(object):
     BACKING_FILE_RE = re.compile((r"^(.*?)\s*\(actual\s+path\s*:"
@@ -168,6 +205,239 @@ def qemu_img_info(path):
     return QemuImgInfo(out)
 
 
+def detect_format(header):
+    """Guess the format of an image from its first bytes.
+
+    :param header: the first bytes of the image.
+    :returns: the qemu-img name of the format, 'raw' if it is unknown.
+    """
+    for fmt, offset, magic in _FORMAT_MAGICS:
+        if header[offset:offset + len(magic)] == magic:
+            return fmt
+    return 'raw'
+
+
+def _md5_update(md5, fd, offset, count):
+    """Update an MD5 checksum with count bytes of a file from offset.
+
+    The bytes are hashed from a mapping of the file rather than read.
+    """
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    mapping = mmap.mmap(fd, offset - start + count, access=mmap.ACCESS_READ,
+                        offset=start)
+    try:
+        md5.update(buffer(mapping, offset - start, count))
+    finally:
+        mapping.close()
+
+
+class ImageWriter(object):
+    """File-like object writing an image to disk as it is downloaded.
+
+    The image is written to path.part, and the format of the image is
+    guessed from its first bytes. Blocks of zeros of raw images are
+    skipped when sparse is True, leaving holes in the file. The size and
+    the MD5 checksum of the image are computed on the way.
+
+    Once the format is guessed, images which are not written sparse
+    expose their file descriptor, so that the image service can copy
+    local images to it with sendfile() and report the bytes copied with
+    :meth:`copied`.
+    """
+
+    def __init__(self, path, sparse=False):
+        self.path = path
+        self.sparse = sparse
+        self.file_path = "%s.part" % path
+        self.file_format = None
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._header = []
+        self._header_size = 0
+        self._file = None
+
+    @property
+    def checksum(self):
+        return self._md5.hexdigest()
+
+    def write(self, data):
+        self._md5.update(data)
+        self.size += len(data)
+        if self._file is not None:
+            self._write(data)
+            return
+        self._header.append(data)
+        self._header_size += len(data)
+        if self._header_size >= _HEADER_SIZE:
+            self._open()
+
+    def _open(self):
+        header = ''.join(self._header)
+        self._header = None
+        self.file_format = detect_format(header)
+        if self.file_format != 'raw':
+            self.sparse = False
+        self._file = open(self.file_path, 'wb')
+        self._write(header)
+
+    def _write(self, data):
+        if not self.sparse:
+            self._file.write(data)
+            return
+        for offset in xrange(0, len(data), _SPARSE_BLOCK_SIZE):
+            block = data[offset:offset + _SPARSE_BLOCK_SIZE]
+            if block == _ZERO_BLOCK[:len(block)]:
+                self._file.seek(len(block), os.SEEK_CUR)
+            else:
+                self._file.write(block)
+
+    def fileno(self):
+        # NOTE: the zeros of sparse images have to be seen to be skipped.
+        if self._file is None or self.sparse:
+            raise io.UnsupportedOperation('fileno')
+        return self._file.fileno()
+
+    def flush(self):
+        self._file.flush()
+
+    def copied(self, fd, offset, count):
+        """Account for count bytes copied to the image from fd at offset."""
+        _md5_update(self._md5, fd, offset, count)
+        self.size += count
+        self._file.seek(os.lseek(self._file.fileno(), 0, os.SEEK_CUR))
+
+    def close(self):
+        if self._file is None:
+            self._open()
+        if self.sparse:
+            # NOTE: the file may end with a hole.
+            self._file.truncate(self.size)
+        self._file.close()
+
+
+class FileWriter(object):
+    """File-like object writing an image to a file.
+
+    The size and the MD5 checksum of the image are computed on the way.
+    """
+
+    def __init__(self, image_file):
+        self.size = 0
+        self._file = image_file
+        self._md5 = hashlib.md5()
+
+    @property
+    def checksum(self):
+        return self._md5.hexdigest()
+
+    def write(self, data):
+        self._md5.update(data)
+        self.size += len(data)
+        self._file.write(data)
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def flush(self):
+        self._file.flush()
+
+    def copied(self, fd, offset, count):
+        """Account for count bytes copied to the image from fd at offset."""
+        _md5_update(self._md5, fd, offset, count)
+        self.size += count
+        self._file.seek(os.lseek(self._file.fileno(), 0, os.SEEK_CUR))
+
+
+class _ResumedWriter(object):
+    """File-like object resuming the writing of an image.
+
+    The image is downloaded again from its start, the bytes already given
+    to the writer of the image are skipped.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.skip = writer.size
+        self.write_failed = False
+
+    def write(self, data):
+        if self.skip:
+            if len(data) <= self.skip:
+                self.skip -= len(data)
+                return
+            data = data[self.skip:]
+            self.skip = 0
+        try:
+            self.writer.write(data)
+        except Exception:
+            self.write_failed = True
+            raise
+
+    def fileno(self):
+        # NOTE: the bytes to skip have to be read.
+        if self.skip:
+            raise io.UnsupportedOperation('fileno')
+        return self.writer.fileno()
+
+    def flush(self):
+        self.writer.flush()
+
+    def copied(self, fd, offset, count):
+        try:
+            self.writer.copied(fd, offset, count)
+        except Exception:
+            self.write_failed = True
+            raise
+
+
+def _download(image_service, image_href, writer):
+    """Download an image, resuming it after the connection errors.
+
+    The download is attempted 1 + CONF.glance.glance_num_retries times.
+    The bytes already written are not written again: the image service
+    does not support range requests, so the image is downloaded again
+    from its start but only the missing bytes are written.
+
+    :param image_service: the image service to download the image from.
+    :param image_href: href or UUID of the image.
+    :param writer: a :class:`FileWriter` or :class:`ImageWriter`.
+    """
+    num_attempts = 1 + CONF.glance.glance_num_retries
+    for attempt in range(1, num_attempts + 1):
+        resumed_writer = _ResumedWriter(writer)
+        try:
+            image_service.download(image_href, resumed_writer)
+            if resumed_writer.skip:
+                raise exception.ImageDownloadFailed(image_id=image_href,
+                        reason=_("the image is shorter than the bytes "
+                                 "already downloaded"))
+            return
+        except _RESUMABLE_ERRORS as e:
+            if resumed_writer.write_failed or attempt == num_attempts:
+                raise
+            LOG.warning(_("Download of image %(image)s failed after "
+                          "%(size)d bytes, resuming it: %(error)s") %
+                        {'image': image_href, 'size': writer.size,
+                         'error': e})
+
+
+def _verify_checksum(image_service, image_href, writer):
+    """Compare the checksum of a downloaded image to the one of Glance.
+
+    :returns: the checksum of the image.
+    :raises: ImageDownloadFailed if the checksums do not match.
+    """
+    expected = metadata_cache.show(image_service, image_href).get('checksum')
+    if expected is not None and expected != writer.checksum:
+        # NOTE: the image may have changed since its metadata was cached.
+        metadata_cache.invalidate(image_href)
+        raise exception.ImageDownloadFailed(image_id=image_href,
+                reason=_("its checksum %(checksum)s does not match the "
+                         "checksum %(expected)s of the image service") %
+                       {'checksum': writer.checksum, 'expected': expected})
+    return writer.checksum
+
+
 def convert_image(source, dest, out_format, run_as_root=False):
     """Convert image to other format."""
     cmd = ('qemu-img', 'convert', '-O', out_format, source, dest)
@@ -175,6 +445,15 @@ def convert_image(source, dest, out_format, run_as_root=False):
 
 
 def fetch(context, image_href, path, image_service=None):
+    """Download an image to path.
+
+    The download is resumed after connection errors, and the MD5 checksum
+    of the image is compared to the one of Glance.
+
+    :returns: a dictionary with the size and the MD5 checksum of the
+              downloaded image.
+    :raises: ImageDownloadFailed if the checksum does not match.
+    """
     # TODO(vish): Improve context handling and add owner and auth data
     #             when it is added to glance.  Right now there is no
     #             auth checking in glance, so we assume that access was
@@ -184,13 +463,49 @@ def fetch(context, image_href, path, image_service=None):
 
     with fileutils.remove_path_on_error(path):
         with open(path, "wb") as image_file:
-            image_service.download(image_href, image_file)
+            writer = FileWriter(image_file)
+            _download(image_service, image_href, writer)
+        checksum = _verify_checksum(image_service, image_href, writer)
+    return {'size': writer.size, 'checksum': checksum}
 
 
 def fetch_to_raw(context, image_href, path, image_service=None):
-    path_tmp = "%s.part" % path
-    fetch(context, image_href, path_tmp, image_service)
+    """Download an image to path, converting it to raw if needed.
+
+    The image is written as it is downloaded by an :class:`ImageWriter`,
+    so raw images are not converted. The download is resumed after
+    connection errors, and the MD5 checksum of the image is compared to
+    the one of Glance. The image is written to path.part and only renamed
+    to path once it is complete, so that an interrupted download, e.g. by
+    a crash of the conductor, is never taken for the image.
+
+    :returns: a dictionary with the size and the MD5 checksum of the
+              downloaded image.
+    :raises: ImageDownloadFailed if the checksum does not match.
+    """
+    if not image_service:
+        image_service = service.Service(version=1, context=context)
+
+    writer = ImageWriter(path, sparse=CONF.sparse_raw_images)
+    path_tmp = writer.file_path
+    with fileutils.remove_path_on_error(path_tmp):
+        try:
+            _download(image_service, image_href, writer)
+        finally:
+            writer.close()
+        checksum = _verify_checksum(image_service, image_href, writer)
+
+        # NOTE: when the format was not detected from the first bytes of
+        #       the image, it is checked and converted after all.
+        if (writer.file_format == 'raw' and
+                qemu_img_info(path_tmp).file_format == 'raw'):
+            os.rename(path_tmp, path)
+            LOG.debug(_("Downloaded raw image %(image)s to %(path)s.")
+                      % {'image': image_href, 'path': path})
+            return {'size': writer.size, 'checksum': checksum}
+
     image_to_raw(image_href, path, path_tmp)
+    return {'size': writer.size, 'checksum': checksum}
 
 
 def image_to_raw(image_href, path, path_tmp):
@@ -282,6 +282,21 @@ def convert_to_list_dict(lst, label):
     return [{label: x} for x in lst]
 
 
+def unique(items):
+    """Remove the duplicates of a list, keeping the first occurrences.
+
+    :param items: a list of hashable items.
+    :returns: a list of the distinct items, in their original order.
+    """
+    seen = set()
+    result = []
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+
 def sanitize_hostname(hostname):
     """Return a hostname which conforms to RFC-952 and RFC-1123 specs."""
     if isinstance(hostname, six.text_type):
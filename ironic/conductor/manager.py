@@ -41,17 +41,23 @@ building or tearing down the TFTP environment for a node, notifying Neutron of
 a change, etc.
 """
 
+import collections
 import datetime
+import time
 
+import eventlet
 from eventlet import greenpool
+from eventlet import semaphore
 
 from oslo.config import cfg
+import six
 
 from ironic.common import driver_factory
 from ironic.common import exception
 from ironic.common import hash_ring as hash
 from ironic.common import service
 from ironic.common import states
+from ironic.common import utils as ironic_utils
 from ironic.conductor import task_manager
 from ironic.conductor import utils
 from ironic.db import api as dbapi
@@ -98,6 +104,30 @@ conductor_opts = [
                         'state be set to the state recorded in the database '
                         '(True) or should the database be updated based on '
                         'the hardware state (False).'),
+        cfg.IntOpt('sync_power_state_workers',
+                   default=8,
+                   help='Maximum number of nodes whose power state is synced '
+                        'concurrently. The syncs run on the conductor worker '
+                        'pool.'),
+        cfg.IntOpt('sync_power_state_node_timeout',
+                   default=60,
+                   help='Timeout (seconds) for syncing the power state of a '
+                        'single node. 0 - unlimited.'),
+        cfg.IntOpt('sync_power_state_pass_timeout',
+                   default=0,
+                   help='Maximum time (seconds) a power state sync pass may '
+                        'spend starting node syncs. Nodes which were not '
+                        'reached are synced first on the next pass. '
+                        '0 - unlimited.'),
+        cfg.IntOpt('sync_power_state_skip_recent',
+                   default=0,
+                   help='Skip nodes whose power state was synced less than '
+                        'this many seconds ago. 0 - never skip.'),
+        cfg.IntOpt('bulk_power_workers',
+                   default=16,
+                   help='Maximum number of power actions of bulk power state '
+                        'requests which run concurrently. The other nodes '
+                        'of these requests wait for a free worker.'),
 ]
 
 CONF = cfg.CONF
@@ -157,7 +187,7 @@ def _do_sync_power_state(task):
 class ConductorManager(service.PeriodicService):
     """Ironic Conductor service main class."""
 
-    RPC_API_VERSION = '1.11'
+    RPC_API_VERSION = '1.12'
 
     def __init__(self, host, topic):
         serializer = objects_base.IronicObjectSerializer()
@@ -187,12 +217,24 @@ class ConductorManager(service.PeriodicService):
             self.dbapi.register_conductor({'hostname': self.host,
                                            'drivers': self.drivers})
 
-        self.driver_rings = self._get_current_driver_rings()
+        self.ring_manager = hash.HashRingManager()
         """Consistent hash ring which maps drivers to conductors."""
+        # the set of active conductors has just changed, so rebuild the
+        # shared rings now rather than after the next check interval.
+        self.ring_manager.refresh()
 
         self._worker_pool = greenpool.GreenPool(size=CONF.rpc_thread_pool_size)
         """GreenPool of background workers for performing tasks async."""
 
+        self._bulk_power_pool = greenpool.GreenPool(
+                size=max(CONF.conductor.bulk_power_workers, 1))
+        """GreenPool running the power actions of bulk requests."""
+
+        self._power_sync_times = {}
+        """Time of the last power state sync of each node, by node uuid."""
+        self.power_sync_stats = {}
+        """Statistics of the last power state sync pass."""
+
     # TODO(deva): add stop() to call unregister_conductor
 
     def initialize_service_hook(self, service):
@@ -279,6 +321,113 @@ class ConductorManager(service.PeriodicService):
                 # Release node lock if error occurred.
                 task.release_resources()
 
+    def change_nodes_power_state(self, context, node_ids, new_state):
+        """RPC method to change the power state of many nodes.
+
+        The nodes are reserved together, and a node which can not be
+        reserved does not prevent the power actions of the other nodes.
+        The power actions are queued in background (async) on a pool of
+        CONF.conductor.bulk_power_workers workers, so they wait for a free
+        worker instead of being rejected, and each node is released once
+        its own power action is done.
+
+        :param context: an admin context.
+        :param node_ids: a list of ids or uuids of nodes.
+        :param new_state: the desired power state of the nodes.
+        :returns: a dict which maps each node id or uuid to None if its power
+                  action was queued, or to the reason why it was not.
+
+        """
+        LOG.debug(_("RPC change_nodes_power_state called for %(count)d nodes."
+                    " The desired new state is %(state)s.")
+                    % {'count': len(node_ids), 'state': new_state})
+
+        node_ids = ironic_utils.unique(node_ids)
+        results = {}
+        task, reserved_ids = self._reserve_bulk_nodes(context, node_ids,
+                                                      results)
+        if task is None:
+            return results
+
+        tasks = task.split()
+        try:
+            eventlet.spawn(self._run_bulk_power_actions, tasks, new_state)
+        except Exception as e:
+            LOG.exception(_("Failed to queue the power actions of %d nodes.")
+                          % len(tasks))
+            for node_task in tasks:
+                node_task.release_resources()
+            for node_id in reserved_ids:
+                results[node_id] = six.text_type(e)
+        else:
+            for node_id in reserved_ids:
+                results[node_id] = None
+        return results
+
+    def _reserve_bulk_nodes(self, context, node_ids, results):
+        """Reserve the nodes of a bulk request which can be reserved.
+
+        All the nodes are reserved by a single task. When a node is locked
+        or not found, its error is recorded in results and the remaining
+        nodes are reserved again, so that a single transaction is needed
+        when no node is busy.
+
+        :param context: an admin context.
+        :param node_ids: a list of distinct ids or uuids of nodes.
+        :param results: a dict in which the reason why a node could not be
+                        reserved is recorded, by node id or uuid.
+        :returns: a tuple of the TaskManager of the reserved nodes (None if
+                  no node was reserved) and of their ids or uuids, in the
+                  order of the resources of the task.
+        """
+        pending = list(node_ids)
+        while pending:
+            try:
+                task = task_manager.TaskManager(context, pending,
+                                                shared=False)
+                return task, pending
+            except (exception.NodeLocked, exception.NodeNotFound) as e:
+                failed = [node_id for node_id in pending
+                          if six.text_type(node_id) ==
+                          six.text_type(e.kwargs.get('node'))]
+                if not failed:
+                    # NOTE: the error can not be tied to a node, do not try
+                    #       to reserve the nodes forever.
+                    failed = pending
+                for node_id in failed:
+                    results[node_id] = six.text_type(e)
+                    pending.remove(node_id)
+            except Exception as e:
+                LOG.exception(_("Failed to reserve %d nodes.") % len(pending))
+                for node_id in pending:
+                    results[node_id] = six.text_type(e)
+                pending = []
+        return None, []
+
+    def _run_bulk_power_actions(self, tasks, new_state):
+        """Run the power actions of a bulk request on the bulk power pool.
+
+        The nodes wait for a free worker of the pool.
+
+        :param tasks: a list of single-node TaskManagers.
+        :param new_state: the desired power state of the nodes.
+        """
+        for task in tasks:
+            self._bulk_power_pool.spawn(self._do_bulk_power_action, task,
+                                        new_state)
+
+    def _do_bulk_power_action(self, task, new_state):
+        with task:
+            try:
+                utils.node_power_action(task, task.node, new_state)
+            except Exception as e:
+                # NOTE: node_power_action() records the error in the
+                #       last_error of the node.
+                LOG.error(_("Failed to change the power state of node "
+                            "%(node)s to %(state)s: %(err)s") %
+                          {'node': task.node.uuid, 'state': new_state,
+                           'err': e})
+
     # NOTE(deva): There is a race condition in the RPC API for vendor_passthru.
     # Between the validate_vendor_action and do_vendor_action calls, it's
     # possible another conductor instance may acquire a lock, or change the
@@ -434,34 +583,119 @@ class ConductorManager(service.PeriodicService):
             spacing=CONF.conductor.sync_power_state_interval)
     def _sync_power_states(self, context):
         filters = {'reserved': False}
-        columns = ['id', 'uuid', 'driver']
-        node_list = self.dbapi.get_nodeinfo_list(columns=columns,
-                                                 filters=filters)
-        for (node_id, node_uuid, driver) in node_list:
-            # only sync power states for nodes mapped to this conductor
-            mapped_hosts = self.driver_rings[driver].get_hosts(node_uuid)
-            if self.host not in mapped_hosts:
+        columns = ['id', 'uuid', 'driver', 'provision_state']
+        # only sync power states for nodes mapped to this conductor
+        node_list = self._get_mapped_nodeinfo_list(columns, filters)
+
+        start = time.time()
+        skip_recent = CONF.conductor.sync_power_state_skip_recent
+        pass_timeout = CONF.conductor.sync_power_state_pass_timeout
+        deadline = start + pass_timeout if pass_timeout else None
+        stats = {'nodes': len(node_list), 'checked': 0, 'skipped': 0,
+                 'failed': 0, 'deferred': 0}
+
+        # forget the nodes which are no longer mapped to this conductor and
+        # sync the nodes which have waited longest first, so that nodes
+        # deferred by the pass deadline are not starved.
+        sync_times = dict((row[1], self._power_sync_times[row[1]])
+                          for row in node_list
+                          if row[1] in self._power_sync_times)
+        self._power_sync_times = sync_times
+        node_list = sorted(node_list, key=lambda r: sync_times.get(r[1], 0))
+
+        slots = semaphore.Semaphore(
+                max(CONF.conductor.sync_power_state_workers, 1))
+        threads = []
+        for i, (node_id, node_uuid, driver, provision_state) in enumerate(
+                node_list):
+            # prevent nodes in DEPLOYWAIT state from locking
+            if (provision_state == states.DEPLOYWAIT or
+                    (skip_recent and
+                     start - sync_times.get(node_uuid, 0) < skip_recent)):
+                stats['skipped'] += 1
                 continue
 
+            slots.acquire()
+            if deadline is not None and time.time() >= deadline:
+                slots.release()
+                stats['deferred'] = len(node_list) - i
+                break
+
             try:
-                # prevent nodes in DEPLOYWAIT state from locking
-                node = self.dbapi.get_node(node_uuid)
-                if node.provision_state == states.DEPLOYWAIT:
-                    continue
-
-                with task_manager.acquire(context, node_id) as task:
-                    _do_sync_power_state(task)
-
-            except exception.NodeNotFound:
-                LOG.info(_("During sync_power_state, node %(node)s was not "
-                           "found and presumed deleted by another process.") %
-                           {'node': node_uuid})
-                continue
-            except exception.NodeLocked:
-                LOG.info(_("During sync_power_state, node %(node)s was "
-                           "already locked by another process. Skip.") %
-                           {'node': node_uuid})
-                continue
+                thread = self._spawn_worker(self._sync_node_power_state,
+                                            context, node_id, node_uuid)
+            except exception.NoFreeConductorWorker:
+                # the worker pool is busy with other requests, so sync this
+                # node here rather than waiting for a free worker.
+                result = self._sync_node_power_state(context, node_id,
+                                                     node_uuid)
+                slots.release()
+                stats[result] += 1
+            else:
+                thread.link(lambda t: slots.release())
+                threads.append(thread)
+
+        for thread in threads:
+            result = thread.wait()
+            stats[result] += 1
+
+        stats['duration'] = time.time() - start
+        self.power_sync_stats = stats
+
+        LOG.debug(_("Power state sync of %(nodes)d nodes took %(duration).2f "
+                    "seconds: %(checked)d checked, %(skipped)d skipped, "
+                    "%(failed)d failed, %(deferred)d deferred.") % stats)
+        if stats['deferred']:
+            LOG.warning(_("Power state sync reached its deadline of "
+                          "%(timeout)d seconds, %(deferred)d nodes were "
+                          "deferred to the next pass.") %
+                          {'timeout': pass_timeout,
+                           'deferred': stats['deferred']})
+
+    def _sync_node_power_state(self, context, node_id, node_uuid):
+        """Sync the power state of a single node.
+
+        :param context: request context.
+        :param node_id: node id.
+        :param node_uuid: node uuid.
+        :returns: 'checked', 'skipped' or 'failed'.
+
+        """
+        timeout = CONF.conductor.sync_power_state_node_timeout or None
+        timer = eventlet.Timeout(timeout)
+        try:
+            with task_manager.acquire(context, node_id) as task:
+                # the node may have started deploying since it was listed
+                if task.node.provision_state == states.DEPLOYWAIT:
+                    return 'skipped'
+                _do_sync_power_state(task)
+        except exception.NodeNotFound:
+            LOG.info(_("During sync_power_state, node %(node)s was not "
+                       "found and presumed deleted by another process.") %
+                       {'node': node_uuid})
+            return 'skipped'
+        except exception.NodeLocked:
+            LOG.info(_("During sync_power_state, node %(node)s was "
+                       "already locked by another process. Skip.") %
+                       {'node': node_uuid})
+            return 'skipped'
+        except eventlet.Timeout as t:
+            if t is not timer:
+                raise
+            LOG.warning(_("During sync_power_state, syncing node %(node)s "
+                          "timed out after %(timeout)d seconds.") %
+                          {'node': node_uuid, 'timeout': timeout})
+            return 'failed'
+        except Exception as e:
+            LOG.exception(_("During sync_power_state, unexpected error "
+                            "syncing node %(node)s: %(err)s") %
+                            {'node': node_uuid, 'err': e})
+            return 'failed'
+        finally:
+            timer.cancel()
+
+        self._power_sync_times[node_uuid] = time.time()
+        return 'checked'
 
     @periodic_task.periodic_task(
             spacing=CONF.conductor.check_provision_state_interval)
@@ -471,14 +705,9 @@ class ConductorManager(service.PeriodicService):
 
         filters = {'reserved': False, 'maintenance': False}
         columns = ['uuid', 'driver', 'provision_state', 'provision_updated_at']
-        node_list = self.dbapi.get_nodeinfo_list(columns=columns,
-                                                 filters=filters)
+        node_list = self._get_mapped_nodeinfo_list(columns, filters)
 
         for (node_uuid, driver, state, update_time) in node_list:
-            mapped_hosts = self.driver_rings[driver].get_hosts(node_uuid)
-            if self.host not in mapped_hosts:
-                continue
-
             if state == states.DEPLOYWAIT:
                 limit = (timeutils.utcnow() - datetime.timedelta(
                          seconds=CONF.conductor.deploy_callback_timeout))
@@ -505,14 +734,52 @@ class ConductorManager(service.PeriodicService):
                         task.release_resources()
 
     def _get_current_driver_rings(self):
-        """Build the current hash ring for this ConductorManager's drivers."""
+        """Get the current hash ring for this ConductorManager's drivers."""
+
+        rings = self.ring_manager.ring
+        return dict((driver, rings[driver])
+                    for driver in self.drivers if driver in rings)
 
-        ring = {}
-        d2c = self.dbapi.get_active_driver_dict()
+    def _get_mapped_nodeinfo_list(self, columns, filters):
+        """Get the info of the nodes which are mapped to this conductor.
+
+        Only the nodes in the hash ring partitions which are mapped to this
+        conductor are read from the database, so the cost of this call
+        depends on this conductor's share of the nodes rather than on the
+        total number of nodes.
+
+        :param columns: list of node column names to return. Must include
+                        'uuid' and 'driver'.
+        :param filters: additional filters, see dbapi.get_nodeinfo_list().
+        :returns: a list of tuples of the specified columns.
+
+        """
+        driver_rings = self._get_current_driver_rings()
+        if not driver_rings:
+            return []
+
+        filters = dict(filters)
+        filters['partitions'] = dict(
+                (driver, ring.get_owned_partitions(self.host))
+                for driver, ring in driver_rings.items())
+        node_list = self.dbapi.get_nodeinfo_list(columns=columns,
+                                                 filters=filters)
 
-        for driver in self.drivers:
-            ring[driver] = hash.HashRing(d2c[driver])
-        return ring
+        # Nodes without a partition key are returned too, so check the rows
+        # against the rings, which is cheap for this conductor's share.
+        uuid_index = columns.index('uuid')
+        driver_index = columns.index('driver')
+        uuids_by_driver = collections.defaultdict(list)
+        for row in node_list:
+            uuids_by_driver[row[driver_index]].append(row[uuid_index])
+
+        mapped_uuids = set()
+        for driver, node_uuids in uuids_by_driver.items():
+            ring = driver_rings[driver]
+            for node_uuid, hosts in ring.get_hosts_bulk(node_uuids).items():
+                if self.host in hosts:
+                    mapped_uuids.add(node_uuid)
+        return [row for row in node_list if row[uuid_index] in mapped_uuids]
 
     def rebalance_node_ring(self):
         """Perform any actions necessary when rebalancing the consistent hash.
@@ -0,0 +1,167 @@
+# coding=utf-8
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Waits for nodes to reach a power state.
+
+Power drivers request a power state change and then wait for the node to
+reach it. Instead of each wait polling the node in its own loop, the waits
+are registered with a single :class:`PowerStateWaiter`, which polls all the
+pending nodes from one green thread. Each node is polled right away, then
+at intervals growing from CONF.conductor.power_wait_initial_interval to
+CONF.conductor.power_wait_max_interval, and its waiter is woken up as soon
+as the target state is seen.
+"""
+
+import time
+
+import eventlet
+from eventlet import event
+from eventlet import greenpool
+from eventlet import queue
+from oslo.config import cfg
+
+from ironic.openstack.common import log
+
+power_waiter_opts = [
+        cfg.FloatOpt('power_wait_initial_interval',
+                     default=0.5,
+                     help='Time (in seconds) between the first two power '
+                          'state queries of a node which is waited for to '
+                          'reach a power state. The interval is doubled '
+                          'after each query.'),
+        cfg.FloatOpt('power_wait_max_interval',
+                     default=5.0,
+                     help='Maximum time (in seconds) between two power state '
+                          'queries of a node which is waited for to reach a '
+                          'power state.'),
+        cfg.IntOpt('power_wait_workers',
+                   default=16,
+                   help='Maximum number of power state queries which are '
+                        'run at the same time while waiting for nodes to '
+                        'reach a power state.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(power_waiter_opts, 'conductor')
+
+LOG = log.getLogger(__name__)
+
+
+class _Wait(object):
+    """A node waited for to reach a power state."""
+
+    def __init__(self, node_uuid, get_state, target, deadline):
+        self.node_uuid = node_uuid
+        self.get_state = get_state
+        self.target = target
+        self.deadline = deadline
+        self.state = None
+        self.next_poll = 0
+        self.interval = CONF.conductor.power_wait_initial_interval
+        self.polling = False
+        self.done = event.Event()
+
+
+class PowerStateWaiter(object):
+    """Polls the nodes which are waited for to reach a power state."""
+
+    def __init__(self):
+        self._waits = []
+        self._queue = queue.LightQueue()
+        self._thread = None
+        self._pool = None
+
+    def wait(self, node_uuid, get_state, target, timeout):
+        """Wait for a node to reach a power state.
+
+        :param node_uuid: the UUID of the node, for logging.
+        :param get_state: a callable without arguments returning the
+                          current power state of the node.
+        :param target: the power state to wait for.
+        :param timeout: time (in seconds) after which the wait gives up.
+        :returns: the last power state returned by get_state, which is
+                  target unless the wait timed out.
+        :raises: any exception raised by get_state.
+
+        """
+        wait = _Wait(node_uuid, get_state, target, time.time() + timeout)
+        self._queue.put(wait)
+        if self._thread is None:
+            self._pool = greenpool.GreenPool(CONF.conductor.power_wait_workers)
+            self._thread = eventlet.spawn(self._run)
+        return wait.done.wait()
+
+    def _run(self):
+        try:
+            self._add_waits(block=False)
+            while self._waits:
+                now = time.time()
+                for wait in self._waits:
+                    if not wait.polling and wait.next_poll <= now:
+                        wait.polling = True
+                        self._pool.spawn_n(self._poll, wait)
+                # NOTE: _poll() puts None in the queue when it is done, so
+                #       the next poll times are recomputed.
+                pending = [w.next_poll for w in self._waits if not w.polling]
+                delay = max(0, min(pending) - now) if pending else None
+                self._add_waits(block=True, timeout=delay)
+        finally:
+            self._thread = None
+
+    def _add_waits(self, block, timeout=None):
+        try:
+            item = self._queue.get(block=block, timeout=timeout)
+        except queue.Empty:
+            return
+        while True:
+            if item is not None:
+                self._waits.append(item)
+            try:
+                item = self._queue.get(block=False)
+            except queue.Empty:
+                break
+        self._waits = [w for w in self._waits if not w.done.ready()]
+
+    def _poll(self, wait):
+        try:
+            wait.state = wait.get_state()
+        except Exception as e:
+            LOG.debug(_("Failed to get the power state of node %(node)s "
+                        "while waiting for it to become %(target)s: "
+                        "%(error)s") % {'node': wait.node_uuid,
+                                        'target': wait.target, 'error': e})
+            wait.done.send_exception(e)
+        else:
+            now = time.time()
+            if wait.state == wait.target or now >= wait.deadline:
+                wait.done.send(wait.state)
+            else:
+                wait.next_poll = min(now + wait.interval, wait.deadline)
+                wait.interval = min(wait.interval * 2,
+                                    CONF.conductor.power_wait_max_interval)
+        finally:
+            wait.polling = False
+            self._queue.put(None)
+
+
+_waiter = PowerStateWaiter()
+
+
+def wait_for_power_state(node_uuid, get_state, target, timeout):
+    """Wait for a node to reach a power state.
+
+    See :meth:`PowerStateWaiter.wait`.
+    """
+    return _waiter.wait(node_uuid, get_state, target, timeout)
@@ -18,12 +18,13 @@
 Client side of the conductor RPC API.
 """
 
+import collections
+
 from oslo.config import cfg
 
 from ironic.common import exception
 from ironic.common import hash_ring as hash
 from ironic.conductor import manager
-from ironic.db import api as dbapi
 from ironic.objects import base as objects_base
 import ironic.openstack.common.rpc.proxy
 
@@ -57,20 +58,19 @@ class ConductorAPI(ironic.openstack.common.rpc.proxy.RpcProxy):
         1.9 - Added destroy_node.
         1.10 - Remove get_node_power_state
         1.11 - Added get_console_information, set_console_mode.
+        1.12 - Added change_nodes_power_state.
 
     """
 
-    RPC_API_VERSION = '1.11'
+    RPC_API_VERSION = '1.12'
 
     def __init__(self, topic=None):
         if topic is None:
             topic = manager.MANAGER_TOPIC
 
-        # Initialize consistent hash ring
-        self.hash_rings = {}
-        d2c = dbapi.get_instance().get_active_driver_dict()
-        for driver in d2c.keys():
-            self.hash_rings[driver] = hash.HashRing(d2c[driver])
+        # The consistent hash rings are shared by all instances and are
+        # only rebuilt when the set of active conductors changes.
+        self.ring_manager = hash.HashRingManager()
 
         super(ConductorAPI, self).__init__(
                 topic=topic,
@@ -87,14 +87,40 @@ class ConductorAPI(ironic.openstack.common.rpc.proxy.RpcProxy):
 
         """
         try:
-            ring = self.hash_rings[node.driver]
+            ring = self.ring_manager[node.driver]
             dest = ring.get_hosts(node.uuid)
             return self.topic + "." + dest[0]
-        except KeyError:
+        except exception.DriverNotFound:
             reason = (_('No conductor service registered which supports '
                         'driver %s.') % node.driver)
             raise exception.NoValidHost(reason=reason)
 
+    def get_topics_for(self, nodes):
+        """Get the RPC topics for the conductor services which many nodes
+        are mapped to. The nodes are routed with one bulk hash ring lookup
+        per driver.
+
+        :param nodes: an iterable of node objects.
+        :returns: a dict which maps node UUIDs to RPC topic strings.
+        :raises: NoValidHost
+
+        """
+        uuids_by_driver = collections.defaultdict(list)
+        for node in nodes:
+            uuids_by_driver[node.driver].append(node.uuid)
+
+        topics = {}
+        for driver, node_uuids in uuids_by_driver.items():
+            try:
+                ring = self.ring_manager[driver]
+            except exception.DriverNotFound:
+                reason = (_('No conductor service registered which supports '
+                            'driver %s.') % driver)
+                raise exception.NoValidHost(reason=reason)
+            for node_uuid, dest in ring.get_hosts_bulk(node_uuids).items():
+                topics[node_uuid] = self.topic + "." + dest[0]
+        return topics
+
     def update_node(self, context, node_obj, topic=None):
         """Synchronously, have a conductor update the node's information.
 
@@ -136,6 +162,28 @@ class ConductorAPI(ironic.openstack.common.rpc.proxy.RpcProxy):
                                        new_state=new_state),
                          topic=topic or self.topic)
 
+    def change_nodes_power_state(self, context, node_ids, new_state,
+                                 topic=None):
+        """Synchronously, acquire locks and start the conductor background
+        tasks to change the power state of many nodes.
+
+        All the nodes should be mapped to the conductor service of the topic,
+        see get_topics_for().
+
+        :param context: request context.
+        :param node_ids: a list of node ids or uuids.
+        :param new_state: one of ironic.common.states power state values
+        :param topic: RPC topic. Defaults to self.topic.
+        :returns: a dict which maps each node id or uuid to None if its power
+                  action was started, or to the reason why it was not.
+
+        """
+        return self.call(context,
+                         self.make_msg('change_nodes_power_state',
+                                       node_ids=node_ids,
+                                       new_state=new_state),
+                         topic=topic or self.topic)
+
     def vendor_passthru(self, context, node_id, driver_method, info,
                         topic=None):
         """Pass vendor specific info to a node driver.
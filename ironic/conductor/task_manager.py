@@ -76,12 +76,15 @@ The linked callback will be called whenever:
 
 """
 
+import collections
+
 from oslo.config import cfg
 
 from ironic.openstack.common import excutils
 
 from ironic.common import driver_factory
 from ironic.common import exception
+from ironic.common import utils
 from ironic.db import api as dbapi
 
 CONF = cfg.CONF
@@ -134,13 +137,16 @@ class TaskManager(object):
         to what other threads may be doing on the nodes at the same time.
 
         :param context: request context
-        :param node_ids: A list of ids or uuids of nodes to lock.
+        :param node_ids: A list of ids or uuids of nodes to lock. The list
+                         must not mix ids and uuids.
         :param shared: Boolean indicating whether to take a shared or exclusive
                        lock. Default: False.
         :param driver_name: The name of the driver to load, if different
                             from the Node's current driver.
         :raises: DriverNotFound
-        :raises: NodeAlreadyLocked
+        :raises: NodeLocked if any node is reserved by another host; no node
+                 is reserved in that case.
+        :raises: NodeNotFound if any node is not found.
 
         """
 
@@ -152,27 +158,39 @@ class TaskManager(object):
         # instead of generating an exception, DTRT and convert to a list
         if not isinstance(node_ids, list):
             node_ids = [node_ids]
+        # each node is locked only once
+        node_ids = utils.unique(node_ids)
+
+        # NOTE: all the nodes are reserved with a single UPDATE, which either
+        #       reserves every node or none of them, and their ports are
+        #       loaded with a single query.
+        if not self.shared:
+            nodes = self.dbapi.reserve_nodes(CONF.host, list(node_ids))
+        else:
+            nodes = self.dbapi.get_nodes(list(node_ids))
 
-        locked_node_list = []
         try:
+            ports_by_node = collections.defaultdict(list)
+            for port in self.dbapi.get_ports_by_nodes([n.id for n in nodes]):
+                ports_by_node[port.node_id].append(port)
+
+            # keep the resources in the order the nodes were requested
+            nodes_by_ident = {}
+            for node in nodes:
+                nodes_by_ident[str(node.id)] = node
+                nodes_by_ident[node.uuid] = node
             for id in node_ids:
-                if not self.shared:
-                    # NOTE(deva): Only lock one node at a time so we can ensure
-                    #             that only the right nodes are unlocked.
-                    #             However, reserve_nodes takes and returns a
-                    #             list. This should be refactored.
-                    node = self.dbapi.reserve_nodes(CONF.host, [id])[0]
-                    locked_node_list.append(node.id)
-                else:
-                    node = self.dbapi.get_node(id)
-                ports = self.dbapi.get_ports_by_node(id)
+                node = nodes_by_ident[str(id)]
                 driver = driver_factory.get_driver(driver_name or node.driver)
-
-                self.resources.append(NodeResource(node, ports, driver))
+                self.resources.append(NodeResource(node,
+                                                   ports_by_node[node.id],
+                                                   driver))
         except Exception:
             with excutils.save_and_reraise_exception():
-                if locked_node_list:
-                    self.dbapi.release_nodes(CONF.host, locked_node_list)
+                self.resources = []
+                if not self.shared:
+                    self.dbapi.release_nodes(CONF.host,
+                                             [n.id for n in nodes])
 
     def release_resources(self):
         """Release any resources for which this TaskManager
@@ -190,6 +208,27 @@ class TaskManager(object):
                     pass
         self.resources = []
 
+    def split(self):
+        """Split a multi-node task into one task per node.
+
+        The locks are handed over to the new tasks, so that each node can
+        be released as soon as its own work is done. This task is left
+        without resources.
+
+        :returns: a list of single-node TaskManagers, in the order of the
+                  nodes of this task.
+        """
+        tasks = []
+        for resource in self.resources:
+            task = TaskManager.__new__(TaskManager)
+            task.context = self.context
+            task.shared = self.shared
+            task.dbapi = self.dbapi
+            task.resources = [resource]
+            tasks.append(task)
+        self.resources = []
+        return tasks
+
     @property
     def node(self):
         """Special accessor for single-node tasks."""
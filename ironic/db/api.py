@@ -40,6 +40,20 @@ class Connection(object):
     def __init__(self):
         """Constructor."""
 
+    @abc.abstractmethod
+    def set_slave_reads(self, enabled):
+        """Choose whether the reads of the current thread may use a slave.
+
+        When enabled, and a slave database is configured, the reads which
+        do not lock anything (listing and getting nodes, ports, chassis
+        and conductors) are sent to the slave database, which may lag
+        behind the master. The reservations and the updates always use the
+        master database.
+
+        :param enabled: True to allow the reads to use the slave database,
+                        False to read from the master database.
+        """
+
     @abc.abstractmethod
     def get_nodeinfo_list(self, columns=None, filters=None, limit=None,
                           marker=None, sort_key=None, sort_dir=None):
@@ -50,10 +64,16 @@ class Connection(object):
                         Defaults to 'id' column when columns == None.
         :param filters: Filters to apply. Defaults to None.
                         'associated': True | False
+                        'instance_uuid': uuid of instance
                         'reserved': True | False
                         'maintenance': True | False
                         'chassis_uuid': uuid of chassis
                         'driver': driver's name
+                        'partitions': dict which maps driver names to the
+                                      hash_ring.OwnedPartitions of their
+                                      ring; only nodes of these drivers in
+                                      these partitions are returned, and
+                                      nodes without a partition key.
         :param limit: Maximum number of nodes to return.
         :param marker: the last item of the previous page; we return the next
                        result set.
@@ -82,6 +102,15 @@ class Connection(object):
                          (asc, desc)
         """
 
+    @abc.abstractmethod
+    def get_node_uuids(self, node_ids):
+        """Return the UUIDs of a set of nodes in a single query.
+
+        :param node_ids: A list of node ids.
+        :returns: A dict of node id to node UUID. Nodes which are not
+                  found are left out.
+        """
+
     @abc.abstractmethod
     def reserve_nodes(self, tag, nodes):
         """Reserve a set of nodes atomically.
@@ -94,6 +123,9 @@ class Connection(object):
         :returns: A list of the reserved node refs.
         :raises: NodeNotFound if any node is not found.
         :raises: NodeAlreadyReserved if any node is already reserved.
+        :raises: TemporaryFailure if the nodes could not be reserved and
+                 the reason could not be determined, because the nodes
+                 which were reserved have been released since.
         """
 
     @abc.abstractmethod
@@ -136,6 +168,15 @@ class Connection(object):
         :returns: A node.
         """
 
+    @abc.abstractmethod
+    def get_nodes(self, nodes):
+        """Return a set of nodes.
+
+        :param nodes: A list of node id or uuid.
+        :returns: A list of nodes, in no particular order.
+        :raises: NodeNotFound if any node is not found.
+        """
+
     @abc.abstractmethod
     def get_node_by_instance(self, instance):
         """Return a node.
@@ -201,6 +242,24 @@ class Connection(object):
                          (asc, desc)
         """
 
+    @abc.abstractmethod
+    def get_portinfo_list(self, columns=None, node_id=None, limit=None,
+                          marker=None, sort_key=None, sort_dir=None):
+        """Return a list of the specified columns for all ports, or for
+        all the ports of a node.
+
+        :param columns: List of column names to return.
+                        Defaults to 'id' column when columns == None.
+        :param node_id: The id or uuid of a node, to return only its ports.
+        :param limit: Maximum number of ports to return.
+        :param marker: the last item of the previous page; we return the next
+                       result set.
+        :param sort_key: Attribute by which results should be sorted.
+        :param sort_dir: direction in which results should be sorted.
+                         (asc, desc)
+        :returns: A list of tuples of the specified columns.
+        """
+
     @abc.abstractmethod
     def get_ports_by_node(self, node_id, limit=None, marker=None,
                           sort_key=None, sort_dir=None):
@@ -216,6 +275,14 @@ class Connection(object):
         :returns: A list of ports.
         """
 
+    @abc.abstractmethod
+    def get_ports_by_nodes(self, node_ids):
+        """List all the ports for a set of nodes in a single query.
+
+        :param node_ids: A list of node ids.
+        :returns: A list of ports, ordered by their id.
+        """
+
     @abc.abstractmethod
     def create_port(self, values):
         """Create a new port.
@@ -254,6 +321,15 @@ class Connection(object):
         :returns: A chassis.
         """
 
+    @abc.abstractmethod
+    def get_chassis_uuids(self, chassis_ids):
+        """Return the UUIDs of a set of chassis in a single query.
+
+        :param chassis_ids: A list of chassis ids.
+        :returns: A dict of chassis id to chassis UUID. Chassis which are
+                  not found are left out.
+        """
+
     @abc.abstractmethod
     def get_chassis_list(self, limit=None, marker=None,
                          sort_key=None, sort_dir=None):
@@ -332,3 +408,13 @@ class Connection(object):
                     {driverA: set([host1, host2]),
                      driverB: set([host2, host3])}
         """
+
+    @abc.abstractmethod
+    def get_active_conductor_fingerprint(self, interval=None):
+        """Retrieve a cheap fingerprint of the active conductors.
+
+        :param interval: Seconds since last check-in of a conductor.
+        :returns: An opaque, comparable value which changes whenever a
+                  conductor becomes active or inactive, or registers
+                  again (eg. with a different list of drivers).
+        """
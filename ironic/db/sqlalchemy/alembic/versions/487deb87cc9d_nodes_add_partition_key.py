@@ -0,0 +1,57 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Nodes add partition key
+
+Revision ID: 487deb87cc9d
+Revises: 3cb628139ea4
+Create Date: 2026-10-18 09:12:40.214336
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '487deb87cc9d'
+down_revision = '3cb628139ea4'
+
+import hashlib
+import struct
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import sql
+
+
+def _partition_key(uuid):
+    # same as ironic.common.hash_ring.get_partition_key()
+    return struct.unpack_from('>I', hashlib.md5(uuid).digest())[0]
+
+
+def upgrade():
+    op.add_column('nodes', sa.Column('partition_key', sa.BigInteger(),
+                  nullable=True))
+
+    nodes = sql.table('nodes',
+                      sql.column('id', sa.Integer),
+                      sql.column('uuid', sa.String),
+                      sql.column('partition_key', sa.BigInteger))
+    conn = op.get_bind()
+    rows = conn.execute(sql.select([nodes.c.id, nodes.c.uuid])).fetchall()
+    for node_id, uuid in rows:
+        if uuid is None:
+            continue
+        op.execute(nodes.update().
+                   where(nodes.c.id == node_id).
+                   values(partition_key=_partition_key(str(uuid))))
+
+
+def downgrade():
+    op.drop_column('nodes', 'partition_key')
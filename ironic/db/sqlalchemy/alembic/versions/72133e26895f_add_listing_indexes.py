@@ -0,0 +1,42 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add listing indexes
+
+Revision ID: 72133e26895f
+Revises: 99480471eeef
+Create Date: 2026-10-18 17:41:26.318094
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '72133e26895f'
+down_revision = '99480471eeef'
+
+from alembic import op
+
+
+def upgrade():
+    # NOTE: the hash ring partition filter can not seek on partition_key,
+    #       the column only makes the index cover that filter.
+    op.create_index('node_reservation_driver_partition_key', 'nodes',
+                    ['reservation', 'driver', 'partition_key'])
+    op.create_index('node_maintenance_id', 'nodes', ['maintenance', 'id'])
+    op.create_index('node_chassis_id_id', 'nodes', ['chassis_id', 'id'])
+    op.create_index('port_node_id_id', 'ports', ['node_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('port_node_id_id', 'ports')
+    op.drop_index('node_chassis_id_id', 'nodes')
+    op.drop_index('node_maintenance_id', 'nodes')
+    op.drop_index('node_reservation_driver_partition_key', 'nodes')
@@ -0,0 +1,35 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Nodes add deploy progress
+
+Revision ID: 99480471eeef
+Revises: 487deb87cc9d
+Create Date: 2026-10-18 14:05:11.602457
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '99480471eeef'
+down_revision = '487deb87cc9d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('nodes', sa.Column('deploy_progress', sa.Text(),
+                  nullable=True))
+
+
+def downgrade():
+    op.drop_column('nodes', 'deploy_progress')
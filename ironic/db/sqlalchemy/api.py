@@ -18,11 +18,14 @@
 
 import collections
 import datetime
+import threading
 
 from oslo.config import cfg
 from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy import sql
 
 from ironic.common import exception
+from ironic.common import hash_ring
 from ironic.common import states
 from ironic.common import utils
 from ironic.db import api
@@ -38,6 +41,9 @@ CONF = cfg.CONF
 CONF.import_opt('connection',
                 'ironic.openstack.common.db.sqlalchemy.session',
                 group='database')
+CONF.import_opt('slave_connection',
+                'ironic.openstack.common.db.sqlalchemy.session',
+                group='database')
 CONF.import_opt('heartbeat_timeout',
                 'ironic.conductor.manager',
                 group='conductor')
@@ -47,6 +53,15 @@ LOG = log.getLogger(__name__)
 get_engine = db_session.get_engine
 get_session = db_session.get_session
 
+# NOTE: number of times the reservation of nodes is attempted when the
+#       nodes which were reserved are released before the conflict is
+#       diagnosed.
+_RESERVE_ATTEMPTS = 3
+
+# NOTE: whether the reads of the current thread may use the slave database,
+#       see Connection.set_slave_reads().
+_local = threading.local()
+
 
 def get_backend():
     """The backend is this module itself."""
@@ -57,13 +72,23 @@ def model_query(model, *args, **kwargs):
     """Query helper for simpler session usage.
 
     :param session: if present, the session to use
+    :param slave: whether the query is a read which may be run on the slave
+                  database, if the current thread allows it.
     """
 
-    session = kwargs.get('session') or get_session()
+    session = kwargs.get('session')
+    if session is None:
+        use_slave = kwargs.get('slave', False) and _slave_reads_allowed()
+        session = get_session(slave_session=use_slave)
     query = session.query(model, *args)
     return query
 
 
+def _slave_reads_allowed():
+    return (bool(CONF.database.slave_connection) and
+            getattr(_local, 'slave_reads', False))
+
+
 def add_identity_filter(query, value):
     """Adds an identity filter to a query.
 
@@ -138,6 +163,40 @@ def add_node_filter_by_chassis(query, value):
         return query.filter(models.Chassis.uuid == value)
 
 
+def add_node_filter_by_partitions(query, partitions):
+    """Adds a filter on the hash ring partitions of nodes to a query.
+
+    :param query: Initial query to add filter to.
+    :param partitions: A dict which maps driver names to the
+                       hash_ring.OwnedPartitions of their ring.
+    :return: Modified query.
+    """
+    key = models.Node.partition_key
+    clauses = []
+    for driver, owned in partitions.items():
+        divisor = 2 ** owned.shift
+        # NOTE: the divisor is a power of two, so this is an exact integer
+        #       division on every backend, unlike key / divisor on MySQL.
+        #       No index can seek on these expressions, the nodes are
+        #       sought by reservation and driver.
+        partition = (key - key % divisor) / divisor
+        owned_clauses = []
+        if owned.residues:
+            owned_clauses.append(sql.and_(
+                    key < owned.tail_start * divisor,
+                    (partition % owned.modulus).in_(owned.residues)))
+        if owned.tail:
+            owned_clauses.append(partition.in_(owned.tail))
+        # nodes which have no partition key yet can not be filtered here
+        owned_clauses.append(key == None)
+        clauses.append(sql.and_(models.Node.driver == driver,
+                                sql.or_(*owned_clauses)))
+
+    if not clauses:
+        return query.filter(sql.false())
+    return query.filter(sql.or_(*clauses))
+
+
 def _check_port_change_forbidden(port, session):
     node_id = port['node_id']
     if node_id is not None:
@@ -152,15 +211,39 @@ def _check_port_change_forbidden(port, session):
 def _paginate_query(model, limit=None, marker=None, sort_key=None,
                     sort_dir=None, query=None):
     if not query:
-        query = model_query(model)
+        query = model_query(model, slave=True)
     sort_keys = ['id']
     if sort_key and sort_key not in sort_keys:
         sort_keys.insert(0, sort_key)
+        query = _add_seek_filter(query, model, sort_key, marker, sort_dir)
     query = db_utils.paginate_query(query, model, limit, sort_keys,
                                     marker=marker, sort_dir=sort_dir)
     return query.all()
 
 
+def _add_seek_filter(query, model, sort_key, marker, sort_dir):
+    """Bound a query to the rows at or after the marker on sort_key.
+
+    The page after the marker is selected on (sort_key, id) by
+    db_utils.paginate_query() with
+    (sort_key > X) OR (sort_key = X AND id > Y), which an index on
+    sort_key can not seek to. The redundant sort_key >= X lets the
+    database start scanning the index at the marker instead of at the
+    first row.
+    """
+    if marker is None:
+        return query
+    attr = getattr(model, sort_key, None)
+    value = getattr(marker, sort_key, None)
+    # NOTE: NULL values can not be compared, let paginate_query() handle
+    #       them, and invalid sort keys.
+    if attr is None or value is None:
+        return query
+    if sort_dir == 'desc':
+        return query.filter(attr <= value)
+    return query.filter(attr >= value)
+
+
 def _check_node_already_locked(query, query_by):
     no_reserv = None
     locked_ref = query.filter(models.Node.reservation != no_reserv).first()
@@ -176,12 +259,45 @@ def _handle_node_lock_not_found(nodes, query, query_by):
     raise exception.NodeNotFound(node=missing.pop())
 
 
+class _ReservationConflict(Exception):
+    """Some nodes could not be reserved, the transaction is rolled back."""
+
+
+def _reserve_nodes(tag, nodes):
+    """Reserve a set of nodes with a single conditional UPDATE.
+
+    Only the nodes which are not reserved are updated, so the number of
+    updated rows tells whether all the nodes were reserved, without
+    reading or locking them beforehand.
+
+    :returns: the reserved nodes, None if some of the nodes are reserved
+              or do not exist, in which case no node is reserved.
+    """
+    session = get_session()
+    try:
+        with session.begin():
+            query = model_query(models.Node, session=session)
+            query, query_by = add_filter_by_many_identities(query, models.Node,
+                                                            nodes)
+            count = query.filter_by(reservation=None).\
+                        update({'reservation': tag},
+                               synchronize_session=False)
+            if count != len(nodes):
+                raise _ReservationConflict()
+            return query.all()
+    except _ReservationConflict:
+        return None
+
+
 class Connection(api.Connection):
     """SqlAlchemy connection."""
 
     def __init__(self):
         pass
 
+    def set_slave_reads(self, enabled):
+        _local.slave_reads = enabled
+
     def _add_nodes_filters(self, query, filters):
         if filters is None:
             filters = []
@@ -195,6 +311,8 @@ class Connection(api.Connection):
                 query = query.filter(models.Node.instance_uuid != None)
             else:
                 query = query.filter(models.Node.instance_uuid == None)
+        if 'instance_uuid' in filters:
+            query = query.filter_by(instance_uuid=filters['instance_uuid'])
         if 'reserved' in filters:
             if filters['reserved']:
                 query = query.filter(models.Node.reservation != None)
@@ -204,6 +322,9 @@ class Connection(api.Connection):
             query = query.filter_by(maintenance=filters['maintenance'])
         if 'driver' in filters:
             query = query.filter_by(driver=filters['driver'])
+        if 'partitions' in filters:
+            query = add_node_filter_by_partitions(query,
+                                                  filters['partitions'])
 
         return query
 
@@ -216,7 +337,7 @@ class Connection(api.Connection):
         else:
             columns = [getattr(models.Node, c) for c in columns]
 
-        query = model_query(*columns, base_model=models.Node)
+        query = model_query(*columns, base_model=models.Node, slave=True)
         query = self._add_nodes_filters(query, filters)
         return _paginate_query(models.Node, limit, marker,
                                sort_key, sort_dir, query)
@@ -224,31 +345,40 @@ class Connection(api.Connection):
     @objects.objectify(objects.Node)
     def get_node_list(self, filters=None, limit=None, marker=None,
                       sort_key=None, sort_dir=None):
-        query = model_query(models.Node)
+        query = model_query(models.Node, slave=True)
         query = self._add_nodes_filters(query, filters)
         return _paginate_query(models.Node, limit, marker,
                                sort_key, sort_dir, query)
 
+    def get_node_uuids(self, node_ids):
+        if not node_ids:
+            return {}
+        query = model_query(models.Node.id, models.Node.uuid,
+                            base_model=models.Node, slave=True)
+        query = query.filter(models.Node.id.in_(node_ids))
+        return dict(query.all())
+
     @objects.objectify(objects.Node)
     def reserve_nodes(self, tag, nodes):
         # assume nodes does not contain duplicates
         # Ensure consistent sort order so we don't run into deadlocks.
         nodes.sort()
-        session = get_session()
-        with session.begin():
-            query = model_query(models.Node, session=session)
+        for attempt in range(_RESERVE_ATTEMPTS):
+            refs = _reserve_nodes(tag, nodes)
+            if refs is not None:
+                return refs
+
+            # NOTE: the nodes are only read to find out why they could not
+            #       be reserved.
+            query = model_query(models.Node)
             query, query_by = add_filter_by_many_identities(query, models.Node,
                                                             nodes)
-            # Be optimistic and assume we usually get a reservation.
             _check_node_already_locked(query, query_by)
-            count = query.update({'reservation': tag},
-                                 synchronize_session=False)
-
-            if count != len(nodes):
+            if query.count() != len(nodes):
                 # one or more node id not found
                 _handle_node_lock_not_found(nodes, query, query_by)
-
-        return query.all()
+            # NOTE: the nodes were released in the meantime, try again.
+        raise exception.TemporaryFailure()
 
     def release_nodes(self, tag, nodes):
         # assume nodes does not contain duplicates
@@ -278,6 +408,8 @@ class Connection(api.Connection):
             values['power_state'] = states.NOSTATE
         if not values.get('provision_state'):
             values['provision_state'] = states.NOSTATE
+        values['partition_key'] = hash_ring.get_partition_key(
+                                                        str(values['uuid']))
 
         node = models.Node()
         node.update(values)
@@ -286,7 +418,7 @@ class Connection(api.Connection):
 
     @objects.objectify(objects.Node)
     def get_node(self, node_id):
-        query = model_query(models.Node)
+        query = model_query(models.Node, slave=True)
         query = add_identity_filter(query, node_id)
 
         try:
@@ -296,12 +428,25 @@ class Connection(api.Connection):
 
         return result
 
+    @objects.objectify(objects.Node)
+    def get_nodes(self, nodes):
+        query = model_query(models.Node, slave=True)
+        query, query_by = add_filter_by_many_identities(query, models.Node,
+                                                        nodes)
+        refs = query.all()
+        if len(refs) != len(set(nodes)):
+            # one or more node id not found
+            existing = [ref[query_by] for ref in refs]
+            missing = set(nodes) - set(existing)
+            raise exception.NodeNotFound(node=missing.pop())
+        return refs
+
     @objects.objectify(objects.Node)
     def get_node_by_instance(self, instance):
         if not utils.is_uuid_like(instance):
             raise exception.InvalidUUID(uuid=instance)
 
-        query = model_query(models.Node).\
+        query = model_query(models.Node, slave=True).\
                         filter_by(instance_uuid=instance)
 
         try:
@@ -335,29 +480,45 @@ class Connection(api.Connection):
 
     @objects.objectify(objects.Node)
     def update_node(self, node_id, values):
+        if 'provision_state' in values:
+            values['provision_updated_at'] = timeutils.utcnow()
+
+        if values.get('uuid'):
+            values['partition_key'] = hash_ring.get_partition_key(
+                                                    str(values['uuid']))
+
+        # NOTE: the node is not locked: it is changed by a single UPDATE
+        #       statement, conditional on the node having no instance when
+        #       an instance is associated, and read again afterwards.
         session = get_session()
         with session.begin():
             query = model_query(models.Node, session=session)
             query = add_identity_filter(query, node_id)
-            try:
-                ref = query.with_lockmode('update').one()
-            except NoResultFound:
-                raise exception.NodeNotFound(node=node_id)
+            update_query = query
+            if values.get('instance_uuid'):
+                # Prevent instance_uuid overwriting
+                update_query = query.filter_by(instance_uuid=None)
+            count = update_query.update(values, synchronize_session=False)
 
-            # Prevent instance_uuid overwriting
-            if values.get("instance_uuid") and ref.instance_uuid:
-                raise exception.NodeAssociated(node=node_id,
-                                instance=values['instance_uuid'])
-
-            if 'provision_state' in values:
-                values['provision_updated_at'] = timeutils.utcnow()
-
-            ref.update(values)
-        return ref
+            if count != 1:
+                # NOTE: the count is the number of matched rows, also on
+                #       MySQL where SQLAlchemy connects with FOUND_ROWS, so
+                #       the node either does not exist or has an instance.
+                ref = query.first()
+                if ref is None:
+                    raise exception.NodeNotFound(node=node_id)
+                if values.get('instance_uuid') and ref.instance_uuid:
+                    raise exception.NodeAssociated(node=node_id,
+                                    instance=values['instance_uuid'])
+
+            if values.get('uuid') and utils.is_uuid_like(node_id):
+                query = model_query(models.Node, session=session)
+                query = add_identity_filter(query, values['uuid'])
+            return query.one()
 
     @objects.objectify(objects.Port)
     def get_port(self, port_id):
-        query = model_query(models.Port)
+        query = model_query(models.Port, slave=True)
         query = add_port_filter(query, port_id)
 
         try:
@@ -377,16 +538,39 @@ class Connection(api.Connection):
         return _paginate_query(models.Port, limit, marker,
                                sort_key, sort_dir)
 
+    def get_portinfo_list(self, columns=None, node_id=None, limit=None,
+                          marker=None, sort_key=None, sort_dir=None):
+        if columns is None:
+            columns = [models.Port.id]
+        else:
+            columns = [getattr(models.Port, c) for c in columns]
+
+        query = model_query(*columns, base_model=models.Port, slave=True)
+        if node_id is not None:
+            # get_node() to raise an exception if the node is not found
+            node_obj = self.get_node(node_id)
+            query = query.filter_by(node_id=node_obj.id)
+        return _paginate_query(models.Port, limit, marker,
+                               sort_key, sort_dir, query)
+
     @objects.objectify(objects.Port)
     def get_ports_by_node(self, node_id, limit=None, marker=None,
                           sort_key=None, sort_dir=None):
         # get_node() to raise an exception if the node is not found
         node_obj = self.get_node(node_id)
-        query = model_query(models.Port)
+        query = model_query(models.Port, slave=True)
         query = query.filter_by(node_id=node_obj.id)
         return _paginate_query(models.Port, limit, marker,
                                sort_key, sort_dir, query)
 
+    @objects.objectify(objects.Port)
+    def get_ports_by_nodes(self, node_ids):
+        if not node_ids:
+            return []
+        query = model_query(models.Port, slave=True)
+        query = query.filter(models.Port.node_id.in_(node_ids))
+        return query.order_by(models.Port.id).all()
+
     @objects.objectify(objects.Port)
     def create_port(self, values):
         if not values.get('uuid'):
@@ -431,7 +615,7 @@ class Connection(api.Connection):
 
     @objects.objectify(objects.Chassis)
     def get_chassis(self, chassis_id):
-        query = model_query(models.Chassis)
+        query = model_query(models.Chassis, slave=True)
         query = add_identity_filter(query, chassis_id)
 
         try:
@@ -439,6 +623,14 @@ class Connection(api.Connection):
         except NoResultFound:
             raise exception.ChassisNotFound(chassis=chassis_id)
 
+    def get_chassis_uuids(self, chassis_ids):
+        if not chassis_ids:
+            return {}
+        query = model_query(models.Chassis.id, models.Chassis.uuid,
+                            base_model=models.Chassis, slave=True)
+        query = query.filter(models.Chassis.id.in_(chassis_ids))
+        return dict(query.all())
+
     @objects.objectify(objects.Chassis)
     def get_chassis_list(self, limit=None, marker=None,
                          sort_key=None, sort_dir=None):
@@ -530,14 +722,19 @@ class Connection(api.Connection):
             if count == 0:
                 raise exception.ConductorNotFound(conductor=hostname)
 
-    def get_active_driver_dict(self, interval=None):
+    def _get_active_conductors_query(self, interval=None, columns=None):
         if interval is None:
             interval = CONF.conductor.heartbeat_timeout
+        if columns is None:
+            columns = [models.Conductor]
 
         limit = timeutils.utcnow() - datetime.timedelta(seconds=interval)
-        result = model_query(models.Conductor).\
-                    filter(models.Conductor.updated_at >= limit).\
-                    all()
+        return model_query(*columns, base_model=models.Conductor,
+                           slave=True).\
+                    filter(models.Conductor.updated_at >= limit)
+
+    def get_active_driver_dict(self, interval=None):
+        result = self._get_active_conductors_query(interval).all()
 
         # build mapping of drivers to the set of hosts which support them
         d2c = collections.defaultdict(set)
@@ -545,3 +742,10 @@ class Connection(api.Connection):
             for driver in row['drivers']:
                 d2c[driver].add(row['hostname'])
         return d2c
+
+    def get_active_conductor_fingerprint(self, interval=None):
+        # A conductor gets a new id whenever it registers again, so the
+        # (id, hostname) pairs also reflect changes of its list of drivers.
+        columns = [models.Conductor.id, models.Conductor.hostname]
+        query = self._get_active_conductors_query(interval, columns)
+        return tuple(sorted(tuple(row) for row in query.all()))
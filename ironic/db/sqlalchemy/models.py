@@ -23,7 +23,7 @@ import json
 from oslo.config import cfg
 import six.moves.urllib.parse as urlparse
 
-from sqlalchemy import Boolean, Column, DateTime
+from sqlalchemy import BigInteger, Boolean, Column, DateTime
 from sqlalchemy import ForeignKey, Integer, Index
 from sqlalchemy import schema, String, Text
 from sqlalchemy.ext.declarative import declarative_base
@@ -128,7 +128,18 @@ class Node(Base):
     __tablename__ = 'nodes'
     __table_args__ = (
         schema.UniqueConstraint('uuid', name='uniq_nodes0uuid'),
-        Index('node_instance_uuid', 'instance_uuid'))
+        Index('node_instance_uuid', 'instance_uuid'),
+        # NOTE: the indexes below match the filters of the periodic tasks
+        #       of the conductors and of the node listings of the API,
+        #       followed by the id the listings are paginated on. The hash
+        #       ring partitions of a conductor are interleaved, so their
+        #       filter can not seek on partition_key: the periodic tasks
+        #       seek on reservation and driver, and partition_key is only
+        #       indexed for the filter to be checked on the index entries.
+        Index('node_reservation_driver_partition_key',
+              'reservation', 'driver', 'partition_key'),
+        Index('node_maintenance_id', 'maintenance', 'id'),
+        Index('node_chassis_id_id', 'chassis_id', 'id'))
     id = Column(Integer, primary_key=True)
     uuid = Column(String(36))
     # NOTE(deva): we store instance_uuid directly on the node so that we can
@@ -142,6 +153,9 @@ class Node(Base):
     target_provision_state = Column(String(15), nullable=True)
     provision_updated_at = Column(DateTime, nullable=True)
     last_error = Column(Text, nullable=True)
+    # NOTE: the durations of the phases of the last deployment, and the
+    #       progress of the copy of its image.
+    deploy_progress = Column(JSONEncodedDict)
     properties = Column(JSONEncodedDict)
     driver = Column(String(15))
     driver_info = Column(JSONEncodedDict)
@@ -149,6 +163,9 @@ class Node(Base):
     maintenance = Column(Boolean, default=False)
     console_enabled = Column(Boolean, default=False)
     extra = Column(JSONEncodedDict)
+    # NOTE: the hash ring key of the uuid is stored so that a conductor
+    #       can select the nodes mapped to it without reading all nodes.
+    partition_key = Column(BigInteger, nullable=True)
 
 
 class Port(Base):
@@ -157,7 +174,8 @@ class Port(Base):
     __tablename__ = 'ports'
     __table_args__ = (
         schema.UniqueConstraint('address', name='uniq_ports0address'),
-        schema.UniqueConstraint('uuid', name='uniq_ports0uuid'))
+        schema.UniqueConstraint('uuid', name='uniq_ports0uuid'),
+        Index('port_node_id_id', 'node_id', 'id'))
     id = Column(Integer, primary_key=True)
     uuid = Column(String(36))
     address = Column(String(18))
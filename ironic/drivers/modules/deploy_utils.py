@@ -14,12 +14,20 @@
 #    under the License.
 
 
+import contextlib
+import errno
+import fcntl
+import mmap
 import os
 import re
 import socket
 import stat
+import struct
 import time
 
+from eventlet import tpool
+from oslo.config import cfg
+
 from ironic.common import exception
 from ironic.common import utils
 from ironic.openstack.common import excutils
@@ -27,8 +35,38 @@ from ironic.openstack.common import log as logging
 from ironic.openstack.common import processutils
 
 
+deploy_opts = [
+    cfg.BoolOpt('sparse_copy',
+                default=True,
+                help='Copy the instance images to the root partitions with '
+                     'a block copier which zeroes the holes and blocks of '
+                     'zeros of the images instead of writing them, rather '
+                     'than with dd. The conductor needs write access to '
+                     'the iSCSI devices (e.g. as a member of the disk '
+                     'group), else dd is used.'),
+    cfg.IntOpt('copy_block_size',
+               default=4,
+               help='Size (in MiB) of the writes of the block copier.'),
+    cfg.IntOpt('copy_progress_interval',
+               default=30,
+               help='Interval (in seconds) at which the progress of the '
+                    'copy of an image to a root partition is logged.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(deploy_opts, group='deploy')
+
 LOG = logging.getLogger(__name__)
 
+# NOTE: Linux values, os.SEEK_DATA and os.SEEK_HOLE need Python 3.3.
+_SEEK_DATA = getattr(os, 'SEEK_DATA', 3)
+_SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4)
+# NOTE: _IO(0x12, 127) of linux/fs.h, zeroes a range of a block device.
+_BLKZEROOUT = 0x127f
+# NOTE: _IO(0x12, 104) of linux/fs.h, gets the logical block size.
+_BLKSSZGET = 0x1268
+_SECTOR_SIZE = 512
+
 
 # All functions are called from deploy() directly or indirectly.
 # They are split for stub-out.
@@ -116,6 +154,285 @@ def dd(src, dst):
                   check_exit_code=[0])
 
 
+def _data_extents(fd, size):
+    """Get the extents of a file which contain data.
+
+    The holes of the file are found with SEEK_DATA and SEEK_HOLE, the whole
+    file is a single extent if they are not supported.
+
+    :returns: a generator of (offset, length) tuples.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, _SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # NOTE: the rest of the file is a hole.
+                return
+            if e.errno != errno.EINVAL:
+                raise
+            yield offset, size - offset
+            return
+        end = min(os.lseek(fd, start, _SEEK_HOLE), size)
+        yield start, end - start
+        offset = end
+
+
+def _execute(func, *args):
+    """Run a blocking system call in a native thread.
+
+    The other green threads keep running meanwhile. The errors are
+    raised in the calling green thread, tpool would print them.
+    """
+    def call():
+        try:
+            return None, func(*args)
+        except EnvironmentError as e:
+            return e, None
+
+    error, result = tpool.execute(call)
+    if error is not None:
+        raise error
+    return result
+
+
+def _write_at(fd, offset, buf, length):
+    """Write length bytes of a buffer to a file at offset."""
+    os.lseek(fd, offset, os.SEEK_SET)
+    written = 0
+    while written < length:
+        written += os.write(fd, buffer(buf, written, length - written))
+
+
+def _logical_block_size(fd):
+    """Get the logical block size of a block device."""
+    try:
+        value = fcntl.ioctl(fd, _BLKSSZGET, struct.pack('i', 0))
+    except IOError as e:
+        LOG.debug(_("Could not get the logical block size of the device, "
+                    "assuming %(size)d bytes: %(error)s") %
+                  {'size': _SECTOR_SIZE, 'error': e})
+        return _SECTOR_SIZE
+    return struct.unpack('i', value)[0]
+
+
+class _ImageCopier(object):
+    """Copies an image to a device, without writing its zeros.
+
+    The reads, writes and zeroing are run in native threads, so that the
+    copies of concurrent deploys run in parallel and the conductor keeps
+    serving its other green threads.
+    """
+
+    def __init__(self, src_fd, dst_fd, size, callback=None):
+        self.src_fd = src_fd
+        self.dst_fd = dst_fd
+        self.size = size
+        self.callback = callback
+        self.block_size = CONF.deploy.copy_block_size * 1024 * 1024
+        self.stats = {'size': size, 'written': 0, 'zeroed': 0}
+        self.done = 0
+        self.start = self.last_log = time.time()
+        self.zeroout = stat.S_ISBLK(os.fstat(dst_fd).st_mode)
+        # NOTE: direct I/O needs offsets and lengths aligned on the
+        #       logical block size, e.g. 4096 bytes on 4Kn devices.
+        if self.zeroout:
+            self.sector_size = _logical_block_size(dst_fd)
+        else:
+            self.sector_size = _SECTOR_SIZE
+        # NOTE: direct I/O needs aligned buffers, mmap() ones are.
+        self.buf = mmap.mmap(-1, self.block_size)
+        self.zeros = '\x00' * self.block_size
+
+    def copy(self):
+        try:
+            for start, length in _data_extents(self.src_fd, self.size):
+                self._zero(self.done, start - self.done)
+                self._copy_extent(start, length)
+            self._zero(self.done, self.size - self.done)
+            _execute(os.fsync, self.dst_fd)
+        finally:
+            self.buf.close()
+        return self.stats
+
+    def _copy_extent(self, start, length):
+        os.lseek(self.src_fd, start, os.SEEK_SET)
+        end = start + length
+        offset = start
+        while offset < end:
+            data = _execute(os.read, self.src_fd,
+                            min(self.block_size, end - offset))
+            if not data:
+                raise exception.InstanceDeployFailure(
+                    _("Image is shorter than %d bytes.") % self.size)
+            if data == self.zeros[:len(data)]:
+                self._zero(offset, len(data))
+            else:
+                self._write(offset, data)
+                self.stats['written'] += len(data)
+                self._progress(offset + len(data))
+            offset += len(data)
+
+    def _write(self, offset, data):
+        length = len(data)
+        if length % self.sector_size or offset % self.sector_size:
+            # NOTE: direct I/O can not write the unaligned end of an image.
+            flags = fcntl.fcntl(self.dst_fd, fcntl.F_GETFL)
+            fcntl.fcntl(self.dst_fd, fcntl.F_SETFL,
+                        flags & ~getattr(os, 'O_DIRECT', 0))
+        self.buf.seek(0)
+        self.buf.write(data)
+        _execute(_write_at, self.dst_fd, offset, self.buf, length)
+
+    def _zero(self, offset, length):
+        if length <= 0:
+            return
+        aligned = length - length % self.sector_size
+        if self.zeroout and aligned and not offset % self.sector_size:
+            try:
+                _execute(fcntl.ioctl, self.dst_fd, _BLKZEROOUT,
+                         struct.pack('QQ', offset, aligned))
+            except IOError as e:
+                LOG.debug(_("Zeroing ranges of a device is not supported, "
+                            "writing zeros instead: %s") % e)
+                self.zeroout = False
+            else:
+                offset += aligned
+                length -= aligned
+                self.stats['zeroed'] += aligned
+                self._progress(offset)
+        end = offset + length
+        while offset < end:
+            count = min(self.block_size, end - offset)
+            self._write(offset, self.zeros[:count])
+            self.stats['zeroed'] += count
+            offset += count
+            self._progress(offset)
+
+    def _progress(self, done):
+        self.done = done
+        if self.callback is not None:
+            self.callback(done, self.size)
+        now = time.time()
+        if now - self.last_log >= CONF.deploy.copy_progress_interval:
+            self.last_log = now
+            LOG.info(_("Copied %(done)d of %(size)d MiB of the image.") %
+                     {'done': done // (1024 * 1024),
+                      'size': self.size // (1024 * 1024)})
+
+
+def _open_direct(path):
+    """Open a file for writing with direct I/O if it is supported."""
+    try:
+        return os.open(path, os.O_WRONLY | getattr(os, 'O_DIRECT', 0))
+    except OSError as e:
+        if e.errno != errno.EINVAL:
+            raise
+        return os.open(path, os.O_WRONLY)
+
+
+def copy_image(src, dst, callback=None):
+    """Copy an image to a device, without writing its zeros.
+
+    The extents of data of the image are found with SEEK_DATA/SEEK_HOLE,
+    and written with direct I/O in blocks of CONF.deploy.copy_block_size
+    MiB. The holes and the blocks of zeros of the image are zeroed on the
+    device with BLKZEROOUT, which the kernel sends as a single command
+    (e.g. SCSI WRITE SAME) to the devices supporting it. dd is used if
+    CONF.deploy.sparse_copy is False or the device is not writable.
+
+    :param src: path of the image.
+    :param dst: path of the device.
+    :param callback: optional callable, called with the number of bytes of
+                     the image which are copied and the size of the image.
+    :returns: a dictionary with the size of the image and the numbers of
+              bytes written and zeroed.
+    """
+    size = os.path.getsize(src)
+    if not CONF.deploy.sparse_copy or not os.access(dst, os.W_OK):
+        dd(src, dst)
+        if callback is not None:
+            callback(size, size)
+        return {'size': size, 'written': size, 'zeroed': 0}
+
+    start = time.time()
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = _open_direct(dst)
+        try:
+            stats = _ImageCopier(src_fd, dst_fd, size, callback).copy()
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+    elapsed = max(time.time() - start, 1e-6)
+    LOG.info(_("Copied image %(src)s to %(dst)s in %(time).1f seconds "
+               "(%(rate).1f MiB/s): %(written)d bytes written, %(zeroed)d "
+               "bytes zeroed.") %
+             {'src': src, 'dst': dst, 'time': elapsed,
+              'rate': size / elapsed / (1024 * 1024),
+              'written': stats['written'], 'zeroed': stats['zeroed']})
+    return stats
+
+
+class DeployProgress(object):
+    """Records the progress of a deployment.
+
+    The durations of the phases of the deployment are recorded, along with
+    the number of bytes of the image which are copied.
+
+    :param callback: optional callable, called with the DeployProgress at
+                     the end of each phase, and every
+                     CONF.deploy.copy_progress_interval seconds while the
+                     image is copied.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.phase = None
+        self.phases = []
+        self.bytes_copied = 0
+        self.bytes_total = 0
+        self._last_update = time.time()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """Measure the duration of a phase of the deployment."""
+        self.phase = name
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phase = None
+            self.add_phase(name, time.time() - start)
+
+    def add_phase(self, name, duration):
+        """Record a phase of the deployment which has ended."""
+        self.phases.append({'name': name, 'duration': round(duration, 3)})
+        self._update()
+
+    def copy_progress(self, copied, total):
+        """Record the progress of the copy of the image."""
+        self.bytes_copied = copied
+        self.bytes_total = total
+        interval = CONF.deploy.copy_progress_interval
+        if copied == total or time.time() - self._last_update >= interval:
+            self._update()
+
+    def _update(self):
+        self._last_update = time.time()
+        if self.callback is not None:
+            self.callback(self)
+
+    def as_dict(self):
+        return {'phase': self.phase,
+                'phases': [dict(phase) for phase in self.phases],
+                'bytes_copied': self.bytes_copied,
+                'bytes_total': self.bytes_total}
+
+
 def mkswap(dev, label='swap1'):
     """Execute mkswap on a device."""
     utils.mkfs('swap', dev, label)
@@ -174,7 +491,7 @@ def get_image_mb(image_path):
 
 
 def work_on_disk(dev, root_mb, swap_mb, ephemeral_mb, ephemeral_format,
-                 image_path, preserve_ephemeral=False):
+                 image_path, preserve_ephemeral=False, progress=None):
     """Create partitions and copy an image to the root partition.
 
     :param dev: Path for the device to work on.
@@ -188,8 +505,12 @@ def work_on_disk(dev, root_mb, swap_mb, ephemeral_mb, ephemeral_format,
     :param preserve_ephemeral: If True, no filesystem is written to the
         ephemeral block device, preserving whatever content it had (if the
         partition table has not changed).
+    :param progress: optional DeployProgress recording the progress of the
+        deployment.
 
     """
+    if progress is None:
+        progress = DeployProgress()
     # NOTE(lucasagomes): When there's an ephemeral partition we want
     # root to be last because that would allow root to resize and make it
     # safer to do takeovernode with slightly larger images
@@ -204,7 +525,8 @@ def work_on_disk(dev, root_mb, swap_mb, ephemeral_mb, ephemeral_format,
     if not is_block_device(dev):
         raise exception.InstanceDeployFailure(_("Parent device '%s' not found")
                                               % dev)
-    make_partitions(dev, root_mb, swap_mb, ephemeral_mb)
+    with progress.measure('make_partitions'):
+        make_partitions(dev, root_mb, swap_mb, ephemeral_mb)
 
     if not is_block_device(root_part):
         raise exception.InstanceDeployFailure(_("Root device '%s' not found")
@@ -216,14 +538,18 @@ def work_on_disk(dev, root_mb, swap_mb, ephemeral_mb, ephemeral_format,
         raise exception.InstanceDeployFailure(
                          _("Ephemeral device '%s' not found") % ephemeral_part)
 
-    dd(image_path, root_part)
-    mkswap(swap_part)
+    with progress.measure('copy_image'):
+        copy_image(image_path, root_part, progress.copy_progress)
+    with progress.measure('mkswap'):
+        mkswap(swap_part)
 
     if ephemeral_mb and not preserve_ephemeral:
-        mkfs_ephemeral(ephemeral_part, ephemeral_format)
+        with progress.measure('mkfs_ephemeral'):
+            mkfs_ephemeral(ephemeral_part, ephemeral_format)
 
     try:
-        root_uuid = block_uuid(root_part)
+        with progress.measure('block_uuid'):
+            root_uuid = block_uuid(root_part)
     except processutils.ProcessExecutionError:
         with excutils.save_and_reraise_exception():
             LOG.error(_("Failed to detect root device UUID."))
@@ -232,7 +558,7 @@ def work_on_disk(dev, root_mb, swap_mb, ephemeral_mb, ephemeral_format,
 
 def deploy(address, port, iqn, lun, image_path, pxe_config_path,
            root_mb, swap_mb, ephemeral_mb, ephemeral_format,
-           preserve_ephemeral=False):
+           preserve_ephemeral=False, progress=None):
     """All-in-one function to deploy a node.
 
     :param address: The iSCSI IP address.
@@ -250,18 +576,24 @@ def deploy(address, port, iqn, lun, image_path, pxe_config_path,
     :param preserve_ephemeral: If True, no filesystem is written to the
         ephemeral block device, preserving whatever content it had (if the
         partition table has not changed).
+    :param progress: optional DeployProgress recording the progress of the
+        deployment.
 
     """
+    if progress is None:
+        progress = DeployProgress()
     dev = get_dev(address, port, iqn, lun)
     image_mb = get_image_mb(image_path)
     if image_mb > root_mb:
         root_mb = image_mb
-    discovery(address, port)
-    login_iscsi(address, port, iqn)
+    with progress.measure('discovery'):
+        discovery(address, port)
+    with progress.measure('login_iscsi'):
+        login_iscsi(address, port, iqn)
     try:
         root_uuid = work_on_disk(dev, root_mb, swap_mb, ephemeral_mb,
                                  ephemeral_format, image_path,
-                                 preserve_ephemeral)
+                                 preserve_ephemeral, progress)
     except processutils.ProcessExecutionError as err:
         with excutils.save_and_reraise_exception():
             LOG.error(_("Deploy to address %s failed.") % address)
@@ -273,9 +605,12 @@ def deploy(address, port, iqn, lun, image_path, pxe_config_path,
             LOG.error(_("Deploy to address %s failed.") % address)
             LOG.error(e)
     finally:
-        logout_iscsi(address, port, iqn)
-        delete_iscsi(address, port, iqn)
-    switch_pxe_config(pxe_config_path, root_uuid)
-    # Ensure the node started netcat on the port after POST the request.
-    time.sleep(3)
-    notify(address, 10000)
+        with progress.measure('logout_iscsi'):
+            logout_iscsi(address, port, iqn)
+            delete_iscsi(address, port, iqn)
+    with progress.measure('switch_pxe_config'):
+        switch_pxe_config(pxe_config_path, root_uuid)
+    with progress.measure('notify'):
+        # Ensure the node started netcat on the port after POST the request.
+        time.sleep(3)
+        notify(address, 10000)
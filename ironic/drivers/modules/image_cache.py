@@ -0,0 +1,193 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+"""
+Cache of the master images of the nodes.
+
+A master image is downloaded once into a master directory and hard linked
+to the image path of each node which uses it, so a master image with a
+single link is not used by any node. Instead of deleting such a master
+image right away, it is kept for the next deployment of the same image,
+until it is older than CONF.pxe.image_cache_ttl minutes or the master
+images of the directory take more than CONF.pxe.image_cache_size MiB, in
+which case the least recently used unused master images are deleted first.
+
+The MD5 checksum of the Glance image a master image was made from is
+recorded next to it, in a file with the CHECKSUM_SUFFIX suffix.
+"""
+
+import os
+import stat
+import time
+
+from oslo.config import cfg
+
+from ironic.openstack.common import lockutils
+from ironic.openstack.common import log as logging
+
+image_cache_opts = [
+    cfg.IntOpt('image_cache_size',
+               default=20480,
+               help='Maximum size (in MiB) of the master images of each '
+                    'master image directory. Unused master images are kept '
+                    'for the next deployments until this size is reached. '
+                    '0 - delete the master images as soon as they are not '
+                    'used.'),
+    cfg.IntOpt('image_cache_ttl',
+               default=10080,
+               help='Maximum time (in minutes) for which an unused master '
+                    'image is kept. 0 - no limit.'),
+    cfg.IntOpt('image_cache_cleanup_interval',
+               default=600,
+               help='Interval (in seconds) at which unused master images '
+                    'are deleted according to image_cache_size and '
+                    'image_cache_ttl. 0 - only clean up after a download.'),
+    ]
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+CONF.register_opts(image_cache_opts, group='pxe')
+
+TEMP_SUFFIXES = ('.lock', '.part')
+"""Suffixes of the temporary files of a master directory."""
+
+CHECKSUM_SUFFIX = '.md5'
+"""Suffix of the files recording the checksums of the master images."""
+
+
+def write_checksum(master_path, checksum):
+    """Record the checksum of the Glance image of a master image."""
+    with open(master_path + CHECKSUM_SUFFIX, 'w') as f:
+        f.write(checksum)
+
+
+def read_checksum(master_path):
+    """Get the recorded checksum of the Glance image of a master image.
+
+    :returns: the checksum, None if it was not recorded.
+    """
+    try:
+        with open(master_path + CHECKSUM_SUFFIX) as f:
+            return f.read().strip() or None
+    except IOError:
+        return None
+
+
+def remove_checksum(master_path):
+    """Delete the recorded checksum of a master image."""
+    try:
+        os.unlink(master_path + CHECKSUM_SUFFIX)
+    except OSError:
+        pass
+
+
+class ImageCache(object):
+    """The master images of a master directory."""
+
+    def __init__(self, master_dir):
+        self.master_dir = master_dir
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                      'evicted_bytes': 0, 'size': 0}
+
+    def record_hit(self, master_path):
+        """Record that a master image was reused.
+
+        Its modification time is updated, so that the least recently used
+        images are evicted first.
+        """
+        self.stats['hits'] += 1
+        try:
+            os.utime(master_path, None)
+        except OSError:
+            pass
+
+    def record_miss(self):
+        """Record that a master image had to be downloaded."""
+        self.stats['misses'] += 1
+
+    @lockutils.synchronized('master_image', 'ironic-')
+    def clean_up(self):
+        """Delete the unused master images which are too old or too many."""
+        if not os.path.isdir(self.master_dir):
+            return
+
+        now = time.time()
+        total_size = 0
+        unused = []
+        names = os.listdir(self.master_dir)
+        for name in names:
+            if name.endswith(TEMP_SUFFIXES):
+                continue
+            path = os.path.join(self.master_dir, name)
+            if name.endswith(CHECKSUM_SUFFIX):
+                if name[:-len(CHECKSUM_SUFFIX)] not in names:
+                    remove_checksum(path[:-len(CHECKSUM_SUFFIX)])
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            # NOTE: raw images are sparse, so count the allocated size.
+            size = st.st_blocks * 512
+            total_size += size
+            if st.st_nlink == 1:
+                unused.append((st.st_mtime, size, path))
+
+        ttl = CONF.pxe.image_cache_ttl * 60
+        max_size = CONF.pxe.image_cache_size * 1024 * 1024
+        for mtime, size, path in sorted(unused):
+            expired = ttl and mtime <= now - ttl
+            if not expired and total_size <= max_size:
+                continue
+            LOG.debug(_("Deleting unused master image %s.") % path)
+            try:
+                os.unlink(path)
+            except OSError as e:
+                LOG.warning(_("Failed to delete master image %(path)s: "
+                              "%(error)s") % {'path': path, 'error': e})
+                continue
+            remove_checksum(path)
+            total_size -= size
+            self.stats['evictions'] += 1
+            self.stats['evicted_bytes'] += size
+
+        self.stats['size'] = total_size
+        LOG.debug(_("Master image cache %(dir)s: %(stats)s")
+                  % {'dir': self.master_dir, 'stats': self.stats})
+
+
+_caches = {}
+
+
+def get_cache(master_dir):
+    """Get the cache of a master directory.
+
+    :param master_dir: path of the master directory.
+    :returns: an ImageCache.
+    """
+    cache = _caches.get(master_dir)
+    if cache is None:
+        cache = _caches[master_dir] = ImageCache(master_dir)
+    return cache
+
+
+def get_stats():
+    """Get the statistics of the caches.
+
+    :returns: a dictionary of the hits, misses, evictions, evicted_bytes
+              and size (in bytes) of each master directory.
+    """
+    return dict((d, dict(c.stats)) for d, c in _caches.items())
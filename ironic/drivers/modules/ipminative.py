@@ -19,13 +19,20 @@
 Ironic Native IPMI power manager.
 """
 
+import contextlib
+import hashlib
+import time
+
+from eventlet import semaphore
 from oslo.config import cfg
 
 from ironic.common import exception
 from ironic.common import states
+from ironic.conductor import power_waiter
 from ironic.conductor import task_manager
 from ironic.drivers import base
 from ironic.openstack.common import log as logging
+from ironic.openstack.common import loopingcall
 from pyghmi import exceptions as pyghmi_exception
 from pyghmi.ipmi import command as ipmi_command
 
@@ -33,6 +40,17 @@ opts = [
     cfg.IntOpt('retry_timeout',
                default=10,
                help='Maximum time in seconds to retry IPMI operations.'),
+    cfg.IntOpt('session_idle_timeout',
+               default=120,
+               help='Time (in seconds) after which an unused IPMI session '
+                    'to a BMC is logged out. Sessions are kept open and '
+                    'reused by the following operations on the BMC. 0 - '
+                    'log in to the BMC for each operation.'),
+    cfg.IntOpt('session_keepalive_interval',
+               default=25,
+               help='Interval (in seconds) at which a keepalive is sent on '
+                    'the idle IPMI sessions, so that the BMCs do not close '
+                    'them. 0 - do not send keepalives.'),
     ]
 
 CONF = cfg.CONF
@@ -67,34 +85,199 @@ def _parse_driver_info(node):
     return bmc_info
 
 
-def _power_on(driver_info):
-    """Turn the power on for this node.
+class IPMISessionCache(object):
+    """A cache of the authenticated IPMI sessions to the BMCs.
+
+    Logging in to a BMC takes several round trips, so the session of a BMC
+    is kept and reused by the following operations on it. A session is used
+    by one operation at a time, sessions which fail are dropped, idle
+    sessions are kept alive every CONF.ipmi.session_keepalive_interval
+    seconds and are logged out after CONF.ipmi.session_idle_timeout seconds.
+
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        """[ipmicmd, last use time, last activity time] by key."""
+        self._locks = {}
+        """Semaphores serializing the use of the sessions, by key."""
+        self._keepalive_timer = None
+
+    @staticmethod
+    def _get_key(driver_info):
+        # NOTE: the password is part of the key, so a change of the
+        #       credentials never reuses an old session, but only a digest
+        #       of it is kept.
+        secret = driver_info.get('password') or ''
+        fingerprint = hashlib.sha1(secret.encode('utf-8')).hexdigest()
+        return (driver_info['address'], driver_info.get('username'),
+                fingerprint)
+
+    @staticmethod
+    def _login(driver_info):
+        return ipmi_command.Command(bmc=driver_info['address'],
+                                    userid=driver_info['username'],
+                                    password=driver_info['password'])
+
+    @staticmethod
+    def _logout(key, ipmicmd):
+        try:
+            ipmicmd.ipmi_session.logout()
+        except Exception as e:
+            LOG.debug(_("Failed to log out of the IPMI session to %(bmc)s: "
+                        "%(error)s") % {'bmc': key[0], 'error': e})
+
+    @contextlib.contextmanager
+    def session(self, driver_info):
+        """Get a session to the BMC of a node.
+
+        Waits for the operation which uses the session of the BMC, if any,
+        to finish. The session is dropped if an IpmiException is raised
+        while it is used.
+
+        :param driver_info: the bmc access info for a node.
+        :returns: a context manager returning a pyghmi ipmi Command.
+        :raises: IpmiException if the login fails.
+
+        """
+        if CONF.ipmi.session_idle_timeout <= 0:
+            yield self._login(driver_info)
+            return
+
+        self._start_keepalive()
+        key = self._get_key(driver_info)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = semaphore.Semaphore()
+        with lock:
+            self.expire()
+            entry = self._sessions.get(key)
+            if entry is None:
+                now = time.time()
+                entry = [self._login(driver_info), now, now]
+                self._sessions[key] = entry
+            try:
+                yield entry[0]
+            except pyghmi_exception.IpmiException:
+                self._sessions.pop(key, None)
+                self._logout(key, entry[0])
+                raise
+            finally:
+                entry[1] = entry[2] = time.time()
+
+    def expire(self):
+        """Log out of the sessions which have been idle for too long."""
+        limit = time.time() - CONF.ipmi.session_idle_timeout
+        for key, entry in list(self._sessions.items()):
+            if entry[1] <= limit and not self._locks[key].locked():
+                del self._sessions[key]
+                self._logout(key, entry[0])
+
+    def keepalive(self):
+        """Send a keepalive on the idle sessions.
+
+        The sessions on which the keepalive fails are dropped.
+        """
+        self.expire()
+        limit = time.time() - CONF.ipmi.session_keepalive_interval
+        for key, entry in list(self._sessions.items()):
+            lock = self._locks[key]
+            if entry[2] > limit:
+                continue
+            if not lock.acquire(blocking=False):
+                # in use, so it does not need a keepalive
+                continue
+            try:
+                # NOTE: Get Device ID, the keepalive pyghmi itself uses.
+                ret = entry[0].raw_command(netfn=6, command=1)
+                if 'error' in ret:
+                    raise pyghmi_exception.IpmiException(ret['error'])
+                entry[2] = time.time()
+            except Exception as e:
+                LOG.debug(_("IPMI keepalive to %(bmc)s failed, dropping the "
+                            "session: %(error)s")
+                          % {'bmc': key[0], 'error': e})
+                if self._sessions.get(key) is entry:
+                    del self._sessions[key]
+                self._logout(key, entry[0])
+            finally:
+                lock.release()
+
+    def _start_keepalive(self):
+        interval = CONF.ipmi.session_keepalive_interval
+        if self._keepalive_timer is not None or interval <= 0:
+            return
+
+        def _keepalive():
+            try:
+                self.keepalive()
+            except Exception:
+                LOG.exception(_("Failed to keep the IPMI sessions alive."))
+
+        self._keepalive_timer = loopingcall.FixedIntervalLoopingCall(
+                                                                _keepalive)
+        self._keepalive_timer.start(interval=interval, initial_delay=interval)
+
+    def clear(self):
+        """Log out of all the sessions."""
+        if self._keepalive_timer is not None:
+            self._keepalive_timer.stop()
+            self._keepalive_timer = None
+        for key, entry in list(self._sessions.items()):
+            self._logout(key, entry[0])
+        self._sessions.clear()
+        self._locks.clear()
+
+
+_session_cache = IPMISessionCache()
+
+
+def _set_power(driver_info, command, target, msg):
+    """Request a power state change and wait for the node to reach it.
 
     :param driver_info: the bmc access info for a node.
-    :returns: power state POWER_ON, one of :class:`ironic.common.states`.
+    :param command: the pyghmi power state to request: on, off or boot.
+    :param target: the power state to reach, POWER_ON or POWER_OFF.
+    :param msg: the message logged on failure.
+    :returns: target.
     :raises: IPMIFailure when the native ipmi call fails.
-    :raises: PowerStateFailure when invalid power state is returned
-             from ipmi.
+    :raises: PowerStateFailure when the node does not reach target in
+             CONF.ipmi.retry_timeout seconds.
     """
-
-    msg = _("IPMI power on failed for node %(node_id)s with the "
-            "following error: %(error)s")
     try:
-        ipmicmd = ipmi_command.Command(bmc=driver_info['address'],
-                           userid=driver_info['username'],
-                           password=driver_info['password'])
-        wait = CONF.ipmi.retry_timeout
-        ret = ipmicmd.set_power('on', wait)
+        with _session_cache.session(driver_info) as ipmicmd:
+            ret = ipmicmd.set_power(command)
     except pyghmi_exception.IpmiException as e:
         LOG.warning(msg % {'node_id': driver_info['uuid'], 'error': str(e)})
         raise exception.IPMIFailure(cmd=str(e))
 
-    state = ret.get('powerstate')
-    if state == 'on':
-        return states.POWER_ON
-    else:
+    # NOTE: pyghmi returns the power state when it is already the requested
+    #       one, and the pending power state otherwise.
+    if ret.get('powerstate') == command:
+        return target
+
+    state = power_waiter.wait_for_power_state(
+                driver_info['uuid'], lambda: _power_status(driver_info),
+                target, CONF.ipmi.retry_timeout)
+    if state != target:
         LOG.warning(msg % {'node_id': driver_info['uuid'], 'error': ret})
-        raise exception.PowerStateFailure(pstate=state)
+        raise exception.PowerStateFailure(pstate=target)
+    return state
+
+
+def _power_on(driver_info):
+    """Turn the power on for this node.
+
+    :param driver_info: the bmc access info for a node.
+    :returns: power state POWER_ON, one of :class:`ironic.common.states`.
+    :raises: IPMIFailure when the native ipmi call fails.
+    :raises: PowerStateFailure when the power state is not reached
+             in time.
+    """
+
+    msg = _("IPMI power on failed for node %(node_id)s with the "
+            "following error: %(error)s")
+    return _set_power(driver_info, 'on', states.POWER_ON, msg)
 
 
 def _power_off(driver_info):
@@ -103,28 +286,13 @@ def _power_off(driver_info):
     :param driver_info: the bmc access info for a node.
     :returns: power state POWER_OFF, one of :class:`ironic.common.states`.
     :raises: IPMIFailure when the native ipmi call fails.
-    :raises: PowerStateFailure when invalid power state is returned
-             from ipmi.
+    :raises: PowerStateFailure when the power state is not reached
+             in time.
     """
 
     msg = _("IPMI power off failed for node %(node_id)s with the "
             "following error: %(error)s")
-    try:
-        ipmicmd = ipmi_command.Command(bmc=driver_info['address'],
-                           userid=driver_info['username'],
-                           password=driver_info['password'])
-        wait = CONF.ipmi.retry_timeout
-        ret = ipmicmd.set_power('off', wait)
-    except pyghmi_exception.IpmiException as e:
-        LOG.warning(msg % {'node_id': driver_info['uuid'], 'error': str(e)})
-        raise exception.IPMIFailure(cmd=str(e))
-
-    state = ret.get('powerstate')
-    if state == 'off':
-        return states.POWER_OFF
-    else:
-        LOG.warning(msg % {'node_id': driver_info['uuid'], 'error': ret})
-        raise exception.PowerStateFailure(pstate=state)
+    return _set_power(driver_info, 'off', states.POWER_OFF, msg)
 
 
 def _reboot(driver_info):
@@ -135,28 +303,13 @@ def _reboot(driver_info):
     :param driver_info: the bmc access info for a node.
     :returns: power state POWER_ON, one of :class:`ironic.common.states`.
     :raises: IPMIFailure when the native ipmi call fails.
-    :raises: PowerStateFailure when invalid power state is returned
-             from ipmi.
+    :raises: PowerStateFailure when the power state is not reached
+             in time.
     """
 
     msg = _("IPMI power reboot failed for node %(node_id)s with the "
             "following error: %(error)s")
-    try:
-        ipmicmd = ipmi_command.Command(bmc=driver_info['address'],
-                           userid=driver_info['username'],
-                           password=driver_info['password'])
-        wait = CONF.ipmi.retry_timeout
-        ret = ipmicmd.set_power('boot', wait)
-    except pyghmi_exception.IpmiException as e:
-        LOG.warning(msg % {'node_id': driver_info['uuid'], 'error': str(e)})
-        raise exception.IPMIFailure(cmd=str(e))
-
-    state = ret.get('powerstate')
-    if state == 'on':
-        return states.POWER_ON
-    else:
-        LOG.warning(msg % {'node_id': driver_info['uuid'], 'error': ret})
-        raise exception.PowerStateFailure(pstate=state)
+    return _set_power(driver_info, 'boot', states.POWER_ON, msg)
 
 
 def _power_status(driver_info):
@@ -169,10 +322,8 @@ def _power_status(driver_info):
     """
 
     try:
-        ipmicmd = ipmi_command.Command(bmc=driver_info['address'],
-                           userid=driver_info['username'],
-                           password=driver_info['password'])
-        ret = ipmicmd.get_power()
+        with _session_cache.session(driver_info) as ipmicmd:
+            ret = ipmicmd.get_power()
     except pyghmi_exception.IpmiException as e:
         LOG.warning(_("IPMI get power state failed for node %(node_id)s "
                       "with the following error: %(error)s")
@@ -285,10 +436,8 @@ class VendorPassthru(base.VendorInterface):
                 "Invalid boot device %s specified.") % device)
         driver_info = _parse_driver_info(node)
         try:
-            ipmicmd = ipmi_command.Command(bmc=driver_info['address'],
-                               userid=driver_info['username'],
-                               password=driver_info['password'])
-            ipmicmd.set_bootdev(device)
+            with _session_cache.session(driver_info) as ipmicmd:
+                ipmicmd.set_bootdev(device)
         except pyghmi_exception.IpmiException as e:
             LOG.warning(_("IPMI set boot device failed for node %(node_id)s "
                           "with the following error: %(error)s")
@@ -30,13 +30,25 @@ from oslo.config import cfg
 from ironic.common import exception
 from ironic.common import states
 from ironic.common import utils
+from ironic.conductor import power_waiter
 from ironic.conductor import task_manager
 from ironic.drivers import base
+from ironic.drivers.modules import ipminative
 from ironic.openstack.common import excutils
 from ironic.openstack.common import log as logging
-from ironic.openstack.common import loopingcall
+
+opts = [
+    cfg.BoolOpt('native_power',
+                default=False,
+                help='Run the power operations of the nodes of the ipmitool '
+                     'drivers in-process, over the cached IPMI sessions of '
+                     'the ipminative driver, instead of running ipmitool for '
+                     'each command. Only used for the nodes with a username, '
+                     'a password and the ADMINISTRATOR privilege level.'),
+    ]
 
 CONF = cfg.CONF
+CONF.register_opts(opts, group='ipmi')
 
 LOG = logging.getLogger(__name__)
 
@@ -101,6 +113,18 @@ def _parse_driver_info(node):
            }
 
 
+def _use_native_power(driver_info):
+    """Whether the power of a node is managed over a cached IPMI session.
+
+    :param driver_info: the ipmitool parameters for accessing a node.
+
+    """
+    # NOTE: pyghmi always logs in with the ADMINISTRATOR privilege level.
+    return (CONF.ipmi.native_power and driver_info['username'] and
+            driver_info['password'] and
+            driver_info['priv_level'] == 'ADMINISTRATOR')
+
+
 def _exec_ipmitool(driver_info, command):
     """Execute the ipmitool command.
 
@@ -138,6 +162,39 @@ def _exec_ipmitool(driver_info, command):
         return out, err
 
 
+def _set_power(driver_info, target, command):
+    """Run an ipmitool power command and wait for the node to reach a state.
+
+    :param driver_info: the ipmitool parameters for accessing a node.
+    :param target: the power state to reach, POWER_ON or POWER_OFF.
+    :param command: the ipmitool command which changes the power state.
+    :returns: target, or ironic.common.states ERROR if the node did not
+        reach it in CONF.ipmi.retry_timeout seconds.
+    :raises: IPMIFailure on an error from ipmitool (from _power_status call).
+
+    """
+    if _power_status(driver_info) == target:
+        return target
+
+    try:
+        _exec_ipmitool(driver_info, command)
+    except Exception:
+        # Log failures but keep waiting
+        LOG.warning(_("IPMI %(cmd)s failed for node %(node)s.")
+                    % {'cmd': command, 'node': driver_info['uuid']})
+
+    state = power_waiter.wait_for_power_state(
+                driver_info['uuid'], lambda: _power_status(driver_info),
+                target, CONF.ipmi.retry_timeout)
+    if state != target:
+        LOG.error(_('IPMI %(cmd)s timed out after %(timeout)s seconds for '
+                    'node %(node)s.'),
+                  {'cmd': command, 'timeout': CONF.ipmi.retry_timeout,
+                   'node': driver_info['uuid']})
+        return states.ERROR
+    return state
+
+
 def _power_on(driver_info):
     """Turn the power ON for this node.
 
@@ -146,36 +203,9 @@ def _power_on(driver_info):
     :raises: IPMIFailure on an error from ipmitool (from _power_status call).
 
     """
-    # use mutable objects so the looped method can change them
-    state = [None]
-    retries = [0]
-
-    def _wait_for_power_on(state, retries):
-        """Called at an interval until the node's power is on."""
-
-        state[0] = _power_status(driver_info)
-        if state[0] == states.POWER_ON:
-            raise loopingcall.LoopingCallDone()
-
-        if retries[0] > CONF.ipmi.retry_timeout:
-            LOG.error(_('IPMI power on timed out after %(tries)s retries.'),
-                        {'tries': retries[0]})
-            state[0] = states.ERROR
-            raise loopingcall.LoopingCallDone()
-        try:
-            # only issue "power on" once
-            if retries[0] == 0:
-                _exec_ipmitool(driver_info, "power on")
-            retries[0] += 1
-        except Exception:
-            # Log failures but keep trying
-            LOG.warning(_("IPMI power on failed for node %s.")
-                    % driver_info['uuid'])
-
-    timer = loopingcall.FixedIntervalLoopingCall(_wait_for_power_on,
-                                                 state, retries)
-    timer.start(interval=1.0).wait()
-    return state[0]
+    if _use_native_power(driver_info):
+        return _native_power(ipminative._power_on, driver_info)
+    return _set_power(driver_info, states.POWER_ON, "power on")
 
 
 def _power_off(driver_info):
@@ -186,36 +216,25 @@ def _power_off(driver_info):
     :raises: IPMIFailure on an error from ipmitool (from _power_status call).
 
     """
-    # use mutable objects so the looped method can change them
-    state = [None]
-    retries = [0]
-
-    def _wait_for_power_off(state, retries):
-        """Called at an interval until the node's power is off."""
-
-        state[0] = _power_status(driver_info)
-        if state[0] == states.POWER_OFF:
-            raise loopingcall.LoopingCallDone()
-
-        if retries[0] > CONF.ipmi.retry_timeout:
-            LOG.error(_('IPMI power off timed out after %(tries)s retries.'),
-                        {'tries': retries[0]})
-            state[0] = states.ERROR
-            raise loopingcall.LoopingCallDone()
-        try:
-            # only issue "power off" once
-            if retries[0] == 0:
-                _exec_ipmitool(driver_info, "power off")
-            retries[0] += 1
-        except Exception:
-            # Log failures but keep trying
-            LOG.warning(_("IPMI power off failed for node %s.")
-                    % driver_info['uuid'])
+    if _use_native_power(driver_info):
+        return _native_power(ipminative._power_off, driver_info)
+    return _set_power(driver_info, states.POWER_OFF, "power off")
 
-    timer = loopingcall.FixedIntervalLoopingCall(_wait_for_power_off,
-                                                 state=state, retries=retries)
-    timer.start(interval=1.0).wait()
-    return state[0]
+
+def _native_power(power_func, driver_info):
+    """Change the power of a node over a cached IPMI session.
+
+    :param power_func: ipminative._power_on or ipminative._power_off.
+    :param driver_info: the ipmitool parameters for accessing a node.
+    :returns: one of ironic.common.states POWER_ON, POWER_OFF or ERROR.
+    :raises: IPMIFailure on an error from the IPMI call.
+
+    """
+    try:
+        return power_func(driver_info)
+    except exception.PowerStateFailure:
+        # the power state was not reached in CONF.ipmi.retry_timeout
+        return states.ERROR
 
 
 def _power_status(driver_info):
@@ -226,6 +245,9 @@ def _power_status(driver_info):
     :raises: IPMIFailure on an error from ipmitool.
 
     """
+    if _use_native_power(driver_info):
+        return ipminative._power_status(driver_info)
+
     cmd = "power status"
     try:
         out_err = _exec_ipmitool(driver_info, cmd)
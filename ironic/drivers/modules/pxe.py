@@ -18,12 +18,19 @@ PXE Driver and supporting meta-classes.
 """
 
 import os
+import sys
 import tempfile
+import time
 
+import eventlet
+from eventlet import event
+from eventlet import greenpool
 import jinja2
 from oslo.config import cfg
+import six
 
 from ironic.common import exception
+from ironic.common.glance_service import metadata_cache
 from ironic.common.glance_service import service_utils
 from ironic.common import image_service as service
 from ironic.common import images
@@ -36,11 +43,14 @@ from ironic.conductor import task_manager
 from ironic.conductor import utils as manager_utils
 from ironic.drivers import base
 from ironic.drivers.modules import deploy_utils
+from ironic.drivers.modules import image_cache
+from ironic.openstack.common import excutils
 from ironic.openstack.common import fileutils
 from ironic.openstack.common import lockutils
 from ironic.openstack.common import log as logging
 from ironic.openstack.common import loopingcall
 from ironic.openstack.common import strutils
+from ironic.openstack.common import timeutils
 
 pxe_opts = [
     cfg.StrOpt('pxe_append_params',
@@ -71,6 +81,20 @@ pxe_opts = [
     cfg.StrOpt('pxe_bootfile_name',
                default='pxelinux.0',
                help='Neutron bootfile DHCP parameter.'),
+    cfg.IntOpt('image_download_timeout',
+               default=3600,
+               help='Maximum time (in seconds) to wait for an image which '
+                    'is being downloaded for another node. 0 - unlimited.'),
+    cfg.IntOpt('image_download_concurrency',
+               default=5,
+               help='Maximum number of images of a node (deploy kernel and '
+                    'ramdisk, kernel, ramdisk and instance image) which are '
+                    'downloaded at the same time.'),
+    cfg.IntOpt('api_url_cache_ttl',
+               default=600,
+               help='Time (in seconds) for which the Ironic API URL looked '
+                    'up in the Keystone catalog is cached, when '
+                    'CONF.conductor.api_url is not set.'),
     ]
 
 LOG = logging.getLogger(__name__)
@@ -79,6 +103,12 @@ CONF = cfg.CONF
 CONF.register_opts(pxe_opts, group='pxe')
 CONF.import_opt('use_ipv6', 'ironic.netconf')
 
+# NOTE: template path -> (modification time, compiled template)
+_templates = {}
+
+# NOTE: (expiration time, URL) of the Ironic API URL found in Keystone
+_api_url = (0, None)
+
 
 def _parse_driver_info(node):
     """Gets the driver-specific Node deployment info.
@@ -141,6 +171,47 @@ def _parse_driver_info(node):
     return d_info
 
 
+def _get_template(path):
+    """Get a compiled template.
+
+    The template is compiled once, and compiled again only when the
+    modification time of its file changes.
+
+    :param path: path of the template file.
+    :returns: a jinja2.Template.
+    """
+    mtime = os.stat(path).st_mtime
+    cached = _templates.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    tmpl_path, tmpl_file = os.path.split(path)
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(tmpl_path))
+    template = env.get_template(tmpl_file)
+    _templates[path] = (mtime, template)
+    return template
+
+
+def _get_ironic_api_url():
+    """Get the URL of the Ironic API.
+
+    The URL is CONF.conductor.api_url if it is set. Otherwise it is looked
+    up in the Keystone catalog, and cached for CONF.pxe.api_url_cache_ttl
+    seconds.
+    """
+    global _api_url
+
+    if CONF.conductor.api_url:
+        return CONF.conductor.api_url
+
+    now = time.time()
+    expiration, url = _api_url
+    if url is None or expiration <= now:
+        url = keystone.get_service_url()
+        _api_url = (now + CONF.pxe.api_url_cache_ttl, url)
+    return url
+
+
 def _build_pxe_config(node, pxe_info, ctx):
     """Build the PXE config file for a node
 
@@ -157,8 +228,7 @@ def _build_pxe_config(node, pxe_info, ctx):
 
     # NOTE: we should strip '/' from the end because this is intended for
     # hardcoded ramdisk script
-    ironic_api = (CONF.conductor.api_url or
-                  keystone.get_service_url()).rstrip('/')
+    ironic_api = _get_ironic_api_url().rstrip('/')
 
     deploy_key = utils.random_alnum(32)
     driver_info = node['driver_info']
@@ -178,9 +248,7 @@ def _build_pxe_config(node, pxe_info, ctx):
             'pxe_append_params': CONF.pxe.pxe_append_params,
         }
 
-    tmpl_path, tmpl_file = os.path.split(CONF.pxe.pxe_config_template)
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(tmpl_path))
-    template = env.get_template(tmpl_file)
+    template = _get_template(CONF.pxe.pxe_config_template)
     return template.render({'pxe_options': pxe_options,
                             'ROOT': '{{ ROOT }}'})
 
@@ -262,50 +330,60 @@ def _link_master_image(path, dest_path):
 
 @lockutils.synchronized('master_image', 'ironic-')
 def _unlink_master_image(path):
-    #TODO(ghe): keep images for a while (kind of local cache)
-    # If an image has been used, it-s likely to be used again
-    # With no space problems, we can keep it, so next time
-    # only a new link needs to be created.
-    # Replace algorithm to look: disk space (trigger)
-    # lru, aged...
-    # os.statvfs
-    # heapq.nlargest(1, [(f, os.stat('./' + f).st_ctime) for f in
-    # os.listdir('.') if os.stat('./' + f).st_nlink == 1], key=lambda s: s[1])
+    """Delete a master image if it is not used and not cached.
+
+    When the image cache is enabled, unused master images are kept for the
+    next deployments and deleted by the image cache clean up.
+    """
+    if CONF.pxe.image_cache_size > 0:
+        return
     if os.path.exists(path) and os.stat(path).st_nlink == 1:
         utils.unlink_without_raise(path)
+        image_cache.remove_checksum(path)
 
 
 @lockutils.synchronized('master_image', 'ironic-')
-def _create_master_image(tmp_path, master_uuid, path):
+def _remove_master_image(path):
+    """Remove an outdated master image from the master directory.
+
+    The nodes using it keep their links to it.
+    """
+    utils.unlink_without_raise(path)
+    image_cache.remove_checksum(path)
+
+
+@lockutils.synchronized('master_image', 'ironic-')
+def _create_master_image(tmp_path, master_uuid, path, checksum=None):
     """With recently download image, use it as master image, and link to
     instances uuid. Uses file locking to avoid image maniputalion
     during the process.
     """
     if not os.path.exists(master_uuid):
         os.link(tmp_path, master_uuid)
+        if checksum:
+            image_cache.write_checksum(master_uuid, checksum)
     os.link(master_uuid, path)
     os.unlink(tmp_path)
 
 
-@lockutils.synchronized('get_image', 'ironic-')
-def _download_in_progress(lock_file):
-    """Get image file lock to avoid downloading the same image
-    simultaneously.
-    """
-    if not os.path.exists(lock_file):
-        open(lock_file, 'w')
-        return False
+def _master_image_is_current(ctx, uuid, master_uuid, image_service=None):
+    """Check that a master image was made from the current Glance image.
 
-    else:
+    The checksum of the Glance image is recorded with the master image when
+    it is downloaded, so the master image does not have to be verified
+    again. Master images without a recorded checksum are assumed current.
+    """
+    checksum = image_cache.read_checksum(master_uuid)
+    if checksum is None:
         return True
+    if not image_service:
+        image_service = service.Service(version=1, context=ctx)
+    expected = metadata_cache.show(image_service, uuid).get('checksum')
+    return expected is None or expected == checksum
 
 
-@lockutils.synchronized('get_image', 'ironic-')
-def _remove_download_in_progress_lock(lock_file):
-    """Removes image file lock to indicate that image download has finished
-     and we can start to use it.
-     """
-    fileutils.delete_if_exists(lock_file)
+_downloads = {}
+"""Events of the master images being downloaded, by master image path."""
 
 
 def _get_image(ctx, path, uuid, master_path=None, image_service=None):
@@ -316,53 +394,180 @@ def _get_image(ctx, path, uuid, master_path=None, image_service=None):
     # equal to 1, can be deleted.
     #TODO(ghe): have hard links and count links the same behaviour in all fs
 
-    #TODO(ghe): timeout and retry for downloads
-    def _wait_for_download():
-        if not os.path.exists(lock_file):
-            raise loopingcall.LoopingCallDone()
-    # If the download of the image needed is in progress (lock file present)
-    # we wait until the locks disappears and create the link.
-
     if master_path is None:
         #NOTE(ghe): We don't share images between instances/hosts
-        images.fetch_to_raw(ctx, uuid, path, image_service)
+        with fileutils.remove_path_on_error(path):
+            images.fetch_to_raw(ctx, uuid, path, image_service)
+        return
 
-    else:
-        master_uuid = os.path.join(master_path,
-                                   service_utils.parse_image_ref(uuid)[0])
-        lock_file = os.path.join(master_path, master_uuid + '.lock')
+    master_uuid = os.path.join(master_path,
+                               service_utils.parse_image_ref(uuid)[0])
+    cache = image_cache.get_cache(master_path)
+    _link_master_image(master_uuid, path)
+    if os.path.exists(path):
+        if _master_image_is_current(ctx, uuid, master_uuid, image_service):
+            cache.record_hit(master_uuid)
+            return
+        LOG.info(_("Master image %s is outdated, downloading it again.")
+                 % master_uuid)
+        utils.unlink_without_raise(path)
+        _remove_master_image(master_uuid)
+
+    # If the master image is being downloaded, wait for the download to
+    # finish and link to it, instead of downloading it again.
+    download = _downloads.get(master_uuid)
+    if download is not None:
+        _wait_for_download(download, uuid)
         _link_master_image(master_uuid, path)
-        if not os.path.exists(path):
-            fileutils.ensure_tree(master_path)
-            if not _download_in_progress(lock_file):
-                with fileutils.remove_path_on_error(lock_file):
-                    #TODO(ghe): logging when image cannot be created
-                    fd, tmp_path = tempfile.mkstemp(dir=master_path)
-                    os.close(fd)
-                    images.fetch_to_raw(ctx, uuid, tmp_path, image_service)
-                    _create_master_image(tmp_path, master_uuid, path)
-                _remove_download_in_progress_lock(lock_file)
+        cache.record_hit(master_uuid)
+        return
+
+    download = _downloads[master_uuid] = event.Event()
+    try:
+        cache.record_miss()
+        fileutils.ensure_tree(master_path)
+        #TODO(ghe): logging when image cannot be created
+        fd, tmp_path = tempfile.mkstemp(dir=master_path, suffix='.part')
+        os.close(fd)
+        with fileutils.remove_path_on_error(tmp_path):
+            info = images.fetch_to_raw(ctx, uuid, tmp_path, image_service)
+            _create_master_image(tmp_path, master_uuid, path,
+                                 info['checksum'])
+    except Exception as e:
+        with excutils.save_and_reraise_exception():
+            download.send_exception(e)
+    else:
+        download.send(None)
+    finally:
+        del _downloads[master_uuid]
+    # make room for the new image
+    cache.clean_up()
+
+
+def _wait_for_download(download, uuid):
+    """Wait for the download of a master image by another deployment.
+
+    :param download: the Event of the download.
+    :param uuid: the image being downloaded.
+    :raises: ImageDownloadFailed if the download does not finish in
+             CONF.pxe.image_download_timeout seconds.
+    :raises: the exception of the download if it failed.
+    """
+    LOG.debug(_("Waiting for the download of image %s.") % uuid)
+    timeout = CONF.pxe.image_download_timeout or None
+    timer = eventlet.Timeout(timeout)
+    try:
+        download.wait()
+    except eventlet.Timeout as t:
+        if t is not timer:
+            raise
+        raise exception.ImageDownloadFailed(image_id=uuid,
+                reason=_("timed out after %s seconds waiting for another "
+                         "download of the image") % timeout)
+    finally:
+        timer.cancel()
+
+
+def _remove_stale_downloads():
+    """Delete the leftovers of the downloads of a previous conductor run.
+
+    Lock files, which were used to signal downloads in progress, and
+    partially downloaded images are removed from the master directories.
+    """
+    for master_path in (CONF.pxe.tftp_master_path,
+                        CONF.pxe.instance_master_path):
+        if not master_path or not os.path.isdir(master_path):
+            continue
+        for name in os.listdir(master_path):
+            if name.endswith(image_cache.TEMP_SUFFIXES):
+                LOG.info(_("Removing stale download %(file)s from "
+                           "%(dir)s.") % {'file': name, 'dir': master_path})
+                utils.unlink_without_raise(os.path.join(master_path, name))
+
+
+def _clean_up_image_caches():
+    """Delete the unused master images which are too old or too many."""
+    for master_path in (CONF.pxe.tftp_master_path,
+                        CONF.pxe.instance_master_path):
+        if not master_path:
+            continue
+        try:
+            image_cache.get_cache(master_path).clean_up()
+        except Exception:
+            LOG.exception(_("Failed to clean up the master images in %s.")
+                          % master_path)
+
+
+_image_cache_cleanup_timer = None
+_stale_downloads_removed = False
+
+
+def _start_image_cache_cleanup():
+    """Periodically clean up the master image caches, once per process."""
+    global _image_cache_cleanup_timer
+    interval = CONF.pxe.image_cache_cleanup_interval
+    if _image_cache_cleanup_timer is not None or interval <= 0:
+        return
+    _image_cache_cleanup_timer = loopingcall.FixedIntervalLoopingCall(
+                                                    _clean_up_image_caches)
+    _image_cache_cleanup_timer.start(interval=interval,
+                                     initial_delay=interval)
+
+
+def _wait_for_all(threads):
+    """Wait for green threads to finish.
+
+    :param threads: a list of GreenThreads.
+    :raises: the exception of the first thread which failed, once all
+             of them are finished.
+    """
+    exc_info = None
+    for thread in threads:
+        try:
+            thread.wait()
+        except Exception:
+            if exc_info is None:
+                exc_info = sys.exc_info()
             else:
-                #TODO(ghe): expiration time
-                timer = loopingcall.FixedIntervalLoopingCall(
-                    _wait_for_download)
-                timer.start(interval=1).wait()
-                _link_master_image(master_uuid, path)
+                LOG.exception(_("Failed to fetch an image."))
+    if exc_info is not None:
+        six.reraise(*exc_info)
+
 
+def _fetch_images(ctx, fetches, pool=None):
+    """Fetch images in parallel with _get_image.
+
+    :param ctx: context.
+    :param fetches: a list of (path, uuid, master_path) of the images.
+    :param pool: the GreenPool which runs the downloads. By default a pool
+                 of CONF.pxe.image_download_concurrency threads is used.
+    :raises: the exception of the first download which failed, once all
+             the downloads are finished.
+    """
+    if pool is None:
+        pool = greenpool.GreenPool(CONF.pxe.image_download_concurrency)
+    _wait_for_all([pool.spawn(_get_image, ctx, path, uuid, master_path)
+                   for path, uuid, master_path in fetches])
 
-def _cache_tftp_images(ctx, node, pxe_info):
-    """Fetch the necessary kernels and ramdisks for the instance."""
+
+def _cache_tftp_images(ctx, node, pxe_info, pool=None):
+    """Fetch the necessary kernels and ramdisks for the instance.
+
+    The images are fetched in parallel, see :func:`_fetch_images`.
+    """
     fileutils.ensure_tree(
         os.path.join(CONF.pxe.tftp_root, node.uuid))
     LOG.debug(_("Fetching kernel and ramdisk for node %s") %
               node.uuid)
+    fetches = []
     for label in pxe_info:
         (uuid, path) = pxe_info[label]
         if not os.path.exists(path):
-            _get_image(ctx, path, uuid, CONF.pxe.tftp_master_path, None)
+            fetches.append((path, uuid, CONF.pxe.tftp_master_path))
+    _fetch_images(ctx, fetches, pool)
 
 
-def _cache_instance_image(ctx, node):
+def _cache_instance_image(ctx, node, pool=None):
     """Fetch the instance's image from Glance
 
     This method pulls the relevant AMI and associated kernel and ramdisk,
@@ -388,7 +593,8 @@ def _cache_instance_image(ctx, node):
               {'ami': uuid, 'uuid': node.uuid})
 
     if not os.path.exists(image_path):
-        _get_image(ctx, image_path, uuid, CONF.pxe.instance_master_path)
+        _fetch_images(ctx, [(image_path, uuid, CONF.pxe.instance_master_path)],
+                      pool)
 
     return (uuid, image_path)
 
@@ -402,7 +608,6 @@ def _get_tftp_image_info(node, ctx):
       driver_info and defaults are not set
 
     """
-    #TODO(ghe): Called multiples times. Should we store image_info?
     d_info = _parse_driver_info(node)
     image_info = {
             'deploy_kernel': [None, None],
@@ -414,8 +619,11 @@ def _get_tftp_image_info(node, ctx):
         image_info[label][1] = os.path.join(CONF.pxe.tftp_root,
                                             node.uuid, label)
 
+    # NOTE: this is called several times for each deployment, the image
+    #       metadata is cached.
     glance_service = service.Service(version=1, context=ctx)
-    iproperties = glance_service.show(d_info['image_source'])['properties']
+    iproperties = metadata_cache.show(glance_service,
+                                      d_info['image_source'])['properties']
     for label in ('kernel', 'ramdisk'):
         image_info[label] = [None, None]
         image_info[label][0] = str(iproperties[label + '_id']).split('/')[-1]
@@ -426,15 +634,21 @@ def _get_tftp_image_info(node, ctx):
 
 
 def _cache_images(node, pxe_info, ctx):
-    """Prepare all the images for this instance."""
-    #TODO(ghe):parallized downloads
+    """Prepare all the images for this instance.
 
+    The images are downloaded in parallel, at most
+    CONF.pxe.image_download_concurrency at the same time.
+    """
     #TODO(ghe): Embedded image client in ramdisk
     # - Get rid of iscsi, image location in baremetal service node and
     # image service, no master image, no image outdated...
     # - security concerns
-    _cache_tftp_images(ctx, node, pxe_info)
-    _cache_instance_image(ctx, node)
+    pool = greenpool.GreenPool(CONF.pxe.image_download_concurrency)
+    # NOTE: the two functions only wait for their downloads, so they do
+    #       not take threads from the pool themselves.
+    _wait_for_all([eventlet.spawn(_cache_tftp_images, ctx, node, pxe_info,
+                                  pool),
+                   eventlet.spawn(_cache_instance_image, ctx, node, pool)])
     #TODO(ghe): file injection
     # http://lists.openstack.org/pipermail/openstack-dev/2013-May/008728.html
     # http://lists.openstack.org/pipermail/openstack-dev/2013-July/011769.html
@@ -532,6 +746,13 @@ def _create_pxe_config(task, node, pxe_info):
 class PXEDeploy(base.DeployInterface):
     """PXE Deploy Interface: just a stub until the real driver is ported."""
 
+    def __init__(self):
+        global _stale_downloads_removed
+        if not _stale_downloads_removed:
+            _remove_stale_downloads()
+            _stale_downloads_removed = True
+        _start_image_cache_cleanup()
+
     def validate(self, task, node):
         """Validate the driver-specific Node deployment info.
 
@@ -630,6 +851,7 @@ class PXEDeploy(base.DeployInterface):
 
         _destroy_images(d_info, node.uuid)
         _destroy_token_file(node)
+        metadata_cache.invalidate(d_info['image_source'])
 
     def take_over(self, task, node):
         _update_neutron(task, node)
@@ -724,7 +946,22 @@ class VendorPassthru(base.VendorInterface):
             LOG.error(_('Node %s is not waiting to be deployed.') %
                       node.uuid)
             return
+
+        def _save_progress(progress):
+            node.deploy_progress = progress.as_dict()
+            node.save(task.context)
+
+        progress = deploy_utils.DeployProgress()
+        # NOTE: the time since the node entered DEPLOYWAIT is the time the
+        #       node took to boot the deploy ramdisk.
+        if node.provision_updated_at is not None:
+            boot_time = timeutils.delta_seconds(
+                    timeutils.normalize_time(node.provision_updated_at),
+                    timeutils.utcnow())
+            progress.add_phase('boot_deploy_ramdisk', boot_time)
+        progress.callback = _save_progress
         node.provision_state = states.DEPLOYING
+        node.deploy_progress = progress.as_dict()
         node.save(task.context)
         # remove cached keystone token immediately
         _destroy_token_file(node)
@@ -742,7 +979,7 @@ class VendorPassthru(base.VendorInterface):
                    '%(params)s') % {'node': node.uuid, 'params': params})
 
         try:
-            deploy_utils.deploy(**params)
+            deploy_utils.deploy(progress=progress, **params)
         except Exception as e:
             LOG.error(_('PXE deploy failed for instance %(instance)s. '
                         'Error: %(error)s') % {'instance': node.instance_uuid,
@@ -25,13 +25,21 @@ Currently supported environments are:
     Virsh       (virsh)
 """
 
+import collections
+import hashlib
 import os
+import socket
+import time
 
+import eventlet
+from eventlet import semaphore
 from oslo.config import cfg
+import paramiko
 
 from ironic.common import exception
 from ironic.common import states
 from ironic.common import utils
+from ironic.conductor import power_waiter
 from ironic.conductor import task_manager
 from ironic.drivers import base
 from ironic.openstack.common import log as logging
@@ -43,11 +51,264 @@ libvirt_opts = [
                help='libvirt uri')
 ]
 
+ssh_opts = [
+    cfg.IntOpt('connection_pool_size',
+               default=4,
+               help='Maximum number of SSH connections which are open to '
+                    'each host at the same time. Connections are kept open '
+                    'and reused by the nodes of the same host. 0 - connect '
+                    'for each operation and do not limit the number of '
+                    'connections.'),
+    cfg.IntOpt('connection_idle_timeout',
+               default=60,
+               help='Time (in seconds) after which an unused SSH connection '
+                    'is closed.'),
+    cfg.IntOpt('connection_check_timeout',
+               default=5,
+               help='Maximum time (in seconds) to wait for the host to '
+                    'answer when an idle SSH connection is checked before '
+                    'it is reused.'),
+    cfg.IntOpt('inventory_cache_ttl',
+               default=15,
+               help='Time (in seconds) for which the list of the VMs of a '
+                    'host, with their MAC addresses and power states, is '
+                    'reused by the nodes of the host. The list is refreshed '
+                    'after a power state change. 0 - do not cache.'),
+    cfg.IntOpt('power_wait_timeout',
+               default=10,
+               help='Maximum time (in seconds) to wait for a VM to reach '
+                    'the requested power state after it is started or '
+                    'stopped.'),
+]
+
 CONF = cfg.CONF
 CONF.register_opts(libvirt_opts, group='ssh')
+CONF.register_opts(ssh_opts, group='ssh')
 
 LOG = logging.getLogger(__name__)
 
+# NOTE: time (in seconds) during which a released SSH connection is reused
+#       without checking that the host still answers.
+_CHECK_IDLE_TIME = 3
+
+
+def _is_transport_active(ssh_obj):
+    """Check that the local end of an SSH connection is still open.
+
+    :param ssh_obj: paramiko.SSHClient.
+    :returns: True if the transport of the connection is active.
+
+    """
+    transport = ssh_obj.get_transport()
+    return transport is not None and transport.is_active()
+
+
+def _is_connection_alive(ssh_obj):
+    """Check that an SSH connection can still be used.
+
+    Waits for the host to answer a request, for at most
+    CONF.ssh.connection_check_timeout seconds.
+
+    :param ssh_obj: paramiko.SSHClient.
+    :returns: True if the connection is alive, False otherwise.
+
+    """
+    if not _is_transport_active(ssh_obj):
+        return False
+    transport = ssh_obj.get_transport()
+    timeout = CONF.ssh.connection_check_timeout
+    timer = eventlet.Timeout(timeout)
+    try:
+        # NOTE: the host answers a global request even when it does not
+        #       support it, so waiting for the answer checks that the host
+        #       is still there, not only the local end of the socket.
+        transport.global_request('keepalive@openssh.com', wait=True)
+    except eventlet.Timeout as t:
+        if t is not timer:
+            raise
+        LOG.debug(_("SSH host did not answer within %d seconds.") % timeout)
+        return False
+    except (paramiko.SSHException, socket.error, EOFError):
+        return False
+    finally:
+        timer.cancel()
+    # global_request() also returns when the transport is closed meanwhile
+    return transport.is_active()
+
+
+class SSHConnectionPool(object):
+    """A pool of SSH connections.
+
+    Connections are shared by the nodes which are reached with the same host,
+    port, username and credentials. A connection is checked before it is
+    reused, idle connections are closed after
+    CONF.ssh.connection_idle_timeout seconds by a timer, and at most
+    CONF.ssh.connection_pool_size connections are open to each host at the
+    same time.
+
+    """
+
+    def __init__(self):
+        self._idle = collections.defaultdict(list)
+        """Idle connections, as lists of (client, release time) by key."""
+        self._slots = {}
+        """Semaphores limiting the number of connections, by key."""
+        self._expiry = None
+        """Green thread closing the idle connections when they expire."""
+
+    @staticmethod
+    def _get_key(driver_info):
+        # NOTE: the credentials are part of the key, so a change of the
+        #       password or key file never reuses an old connection, but
+        #       only a digest of them is kept.
+        secret = (driver_info.get('password') or
+                  driver_info.get('key_filename') or '')
+        fingerprint = hashlib.sha1(secret.encode('utf-8')).hexdigest()
+        return (driver_info.get('host'), driver_info.get('port', 22),
+                driver_info.get('username'), fingerprint)
+
+    def get(self, driver_info):
+        """Get a connection to the host of a node.
+
+        Waits for a connection to be released if the maximum number of
+        connections to the host are in use.
+
+        :param driver_info: information for accessing the node.
+        :returns: a PooledSSHConnection, which must be closed to return it
+                  to the pool.
+        :raises: SSHConnectFailed
+
+        """
+        if CONF.ssh.connection_pool_size <= 0:
+            return PooledSSHConnection(self, None, driver_info,
+                                       utils.ssh_connect(driver_info))
+
+        key = self._get_key(driver_info)
+        slots = self._slots.get(key)
+        if slots is None:
+            slots = self._slots[key] = semaphore.Semaphore(
+                                            CONF.ssh.connection_pool_size)
+        slots.acquire()
+        try:
+            ssh_obj = self._get_idle(key)
+            if ssh_obj is None:
+                ssh_obj = utils.ssh_connect(driver_info)
+        except Exception:
+            slots.release()
+            raise
+        return PooledSSHConnection(self, key, driver_info, ssh_obj)
+
+    def _get_idle(self, key):
+        self.expire()
+        idle = self._idle.get(key)
+        while idle:
+            ssh_obj, released_at = idle.pop()
+            # NOTE: a connection released a moment ago is reused without a
+            #       round trip to the host.
+            if time.time() - released_at < _CHECK_IDLE_TIME:
+                alive = _is_transport_active(ssh_obj)
+            else:
+                alive = _is_connection_alive(ssh_obj)
+            if alive:
+                return ssh_obj
+            LOG.debug(_("Closing broken SSH connection to %s.") % key[0])
+            ssh_obj.close()
+        return None
+
+    def release(self, key, ssh_obj):
+        """Return a connection to the pool.
+
+        :param key: the key of the connection, None if it is not pooled.
+        :param ssh_obj: paramiko.SSHClient.
+
+        """
+        if key is None:
+            ssh_obj.close()
+            return
+
+        # NOTE: the host is only checked when the connection is reused.
+        if _is_transport_active(ssh_obj):
+            self._idle[key].append((ssh_obj, time.time()))
+            self._schedule_expiry()
+        else:
+            ssh_obj.close()
+        slots = self._slots.get(key)
+        if slots is not None:
+            slots.release()
+
+    def _schedule_expiry(self):
+        if self._expiry is not None or not self._idle:
+            return
+        oldest = min(t for idle in self._idle.values() for c, t in idle)
+        delay = oldest + CONF.ssh.connection_idle_timeout - time.time()
+        self._expiry = eventlet.spawn_after(max(delay, 0), self._run_expiry)
+
+    def _run_expiry(self):
+        self._expiry = None
+        self.expire()
+        self._schedule_expiry()
+
+    def expire(self):
+        """Close the connections which have been idle for too long."""
+        limit = time.time() - CONF.ssh.connection_idle_timeout
+        for key, idle in list(self._idle.items()):
+            for ssh_obj, released_at in idle:
+                if released_at <= limit:
+                    ssh_obj.close()
+            idle[:] = [(c, t) for c, t in idle if t > limit]
+            if not idle:
+                del self._idle[key]
+
+    def clear(self):
+        """Close all the idle connections and reset the pool."""
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+        for idle in self._idle.values():
+            for ssh_obj, released_at in idle:
+                ssh_obj.close()
+        self._idle.clear()
+        self._slots.clear()
+
+
+class PooledSSHConnection(object):
+    """An SSH connection checked out of a :class:`SSHConnectionPool`.
+
+    It can be used in place of a paramiko.SSHClient by
+    processutils.ssh_execute. If the host has closed the connection, a new
+    one is opened transparently.
+
+    """
+
+    def __init__(self, pool, key, driver_info, ssh_obj):
+        self._pool = pool
+        self._key = key
+        self._driver_info = driver_info
+        self._ssh_obj = ssh_obj
+
+    def exec_command(self, command):
+        try:
+            return self._ssh_obj.exec_command(command)
+        except (paramiko.SSHException, socket.error, EOFError):
+            if _is_connection_alive(self._ssh_obj):
+                raise
+            # The session could not be opened on the dead connection, so
+            # the command did not run; run it on a new connection.
+            LOG.debug(_("SSH connection to %s was lost, reconnecting.") %
+                      self._driver_info.get('host'))
+            self._ssh_obj.close()
+            self._ssh_obj = utils.ssh_connect(self._driver_info)
+            return self._ssh_obj.exec_command(command)
+
+    def close(self):
+        """Return the connection to its pool."""
+        if self._ssh_obj is not None:
+            self._pool.release(self._key, self._ssh_obj)
+            self._ssh_obj = None
+
+
+_connection_pool = SSHConnectionPool()
+
 
 def _get_command_sets(virt_type):
     if virt_type == 'vbox':
@@ -140,6 +401,159 @@ def _ssh_execute(ssh_obj, cmd_to_exec):
     return output_list
 
 
+def _get_inventory_cmd(cmd_set):
+    """Get the command which lists all the VMs of a host at once.
+
+    The command prints a line 'M <mac> <name>' for each MAC address of
+    each VM, and a line 'R <entry>' for each running VM.
+
+    :param cmd_set: the command set of the virt_type of the host.
+    :returns: the command, as a string.
+
+    """
+    base_cmd = cmd_set['base_cmd']
+
+    def vm_cmd(cmd):
+        # the commands run for each VM must not read the list of VMs
+        return '(%s %s) </dev/null' % (base_cmd,
+                                      cmd.replace('{_NodeName_}', '"$vm"'))
+
+    running_cmd = cmd_set['list_running']
+    cmd = []
+    if '{_NodeName_}' not in running_cmd:
+        cmd.append("%s %s | while read -r line; do "
+                   "printf 'R %%s\\n' \"$line\"; done;" %
+                   (base_cmd, running_cmd))
+    cmd.append("%s %s | while read -r vm; do "
+               "[ -n \"$vm\" ] || continue; "
+               "%s | while read -r mac; do "
+               "printf 'M %%s %%s\\n' \"$mac\" \"$vm\"; done;" %
+               (base_cmd, cmd_set['list_all'],
+                vm_cmd(cmd_set['get_node_macs'])))
+    if '{_NodeName_}' in running_cmd:
+        # the command prints something only if the VM is running
+        cmd.append("if [ -n \"$( %s)\" ]; then printf 'R %%s\\n' \"$vm\"; "
+                   "fi;" % vm_cmd(running_cmd))
+    cmd.append("done")
+    return ' '.join(cmd)
+
+
+class _HostInventory(object):
+    """A snapshot of the VMs of a host, with their MAC addresses and
+    power states.
+    """
+
+    def __init__(self, names_by_mac, running):
+        self._names_by_mac = names_by_mac
+        self._running = running
+
+    @classmethod
+    def parse(cls, output_list):
+        """Build an inventory from the output of the inventory command.
+
+        :param output_list: list of the lines of output of the command
+                            returned by _get_inventory_cmd().
+        :returns: a _HostInventory.
+
+        """
+        names_by_mac = {}
+        running = set()
+        for line in output_list:
+            if line.startswith('M '):
+                fields = line.split(' ', 2)
+                if len(fields) == 3 and fields[1] and fields[2]:
+                    names_by_mac.setdefault(_normalize_mac(fields[1]),
+                                            fields[2])
+            elif line.startswith('R '):
+                entry = line[2:].strip()
+                # running VMs are listed with their names quoted
+                if entry.startswith('"'):
+                    entry = entry.split('"')[1]
+                if entry:
+                    running.add(entry)
+        return cls(names_by_mac, running)
+
+    def get_name(self, macs):
+        """Get the name of the VM which has any of the MAC addresses.
+
+        :param macs: a list of MAC addresses.
+        :returns: the name or None if not found.
+
+        """
+        for mac in macs or []:
+            if not mac:
+                continue
+            name = self._names_by_mac.get(_normalize_mac(mac))
+            if name:
+                return name
+        return None
+
+    def is_running(self, name):
+        return name in self._running
+
+
+_inventory_cache = {}
+"""Inventories of the hosts, as (time of the read, inventory) tuples."""
+_inventory_locks = {}
+
+
+def _get_inventory_key(driver_info):
+    return (driver_info['host'], driver_info.get('port', 22),
+            driver_info.get('username'), driver_info['cmd_set']['base_cmd'])
+
+
+def _get_inventory(ssh_obj, driver_info):
+    """Get the inventory of the VMs of the host of a node.
+
+    The inventory is read with a single command and reused by all the
+    nodes of the host for CONF.ssh.inventory_cache_ttl seconds, but not
+    for the nodes which need an inventory read after
+    driver_info['inventory_after'], see :func:`_require_fresh_inventory`.
+
+    :param ssh_obj: paramiko.SSHClient, an active ssh connection.
+    :param driver_info: information for accessing the node.
+    :returns: a _HostInventory.
+    :raises: SSHCommandFailed on an error from ssh.
+
+    """
+    key = _get_inventory_key(driver_info)
+    lock = _inventory_locks.get(key)
+    if lock is None:
+        lock = _inventory_locks[key] = semaphore.Semaphore()
+
+    # only one thread reads the inventory of a host, the others wait
+    # for it and use the same inventory.
+    lock.acquire()
+    try:
+        cached = _inventory_cache.get(key)
+        if (cached is not None and
+                time.time() - cached[0] < CONF.ssh.inventory_cache_ttl and
+                cached[0] > driver_info.get('inventory_after', 0)):
+            return cached[1]
+
+        read_at = time.time()
+        cmd_to_exec = _get_inventory_cmd(driver_info['cmd_set'])
+        inventory = _HostInventory.parse(_ssh_execute(ssh_obj, cmd_to_exec))
+        LOG.debug(_("Retrieved inventory of %(count)d MAC addresses from "
+                    "host %(host)s.") %
+                  {'count': len(inventory._names_by_mac),
+                   'host': driver_info['host']})
+        if CONF.ssh.inventory_cache_ttl > 0:
+            _inventory_cache[key] = (read_at, inventory)
+        return inventory
+    finally:
+        lock.release()
+
+
+def _require_fresh_inventory(driver_info):
+    """Ignore the inventories read until now for a node.
+
+    The cached inventory of the host is not forgotten: an inventory read
+    from now on, e.g. for another node of the host, is reused.
+    """
+    driver_info['inventory_after'] = time.time()
+
+
 def _parse_driver_info(node):
     """Gets the information needed for accessing the node.
 
@@ -204,40 +618,34 @@ def _get_power_status(ssh_obj, driver_info):
     :raises: NodeNotFound
 
     """
-    power_state = None
-    cmd_to_exec = "%s %s" % (driver_info['cmd_set']['base_cmd'],
-                             driver_info['cmd_set']['list_running'])
-    running_list = _ssh_execute(ssh_obj, cmd_to_exec)
-    # Command should return a list of running vms. If the current node is
-    # not listed then we can assume it is not powered on.
-    node_name = _get_hosts_name_for_node(ssh_obj, driver_info)
-    if node_name:
-        for node in running_list:
-            if not node:
-                continue
-            if node_name in node:
-                power_state = states.POWER_ON
-                break
-        if not power_state:
-            power_state = states.POWER_OFF
-    else:
+    inventory = _get_inventory(ssh_obj, driver_info)
+    node_name = inventory.get_name(driver_info['macs'])
+    if not node_name:
         err_msg = _('Node "%(host)s" with MAC address %(mac)s not found.')
         LOG.error(err_msg, {'host': driver_info['host'],
                             'mac': driver_info['macs']})
 
         raise exception.NodeNotFound(node=driver_info['host'])
 
-    return power_state
+    # If the current node is not listed as running then we can assume it
+    # is not powered on.
+    if inventory.is_running(node_name):
+        return states.POWER_ON
+    return states.POWER_OFF
 
 
 def _get_connection(node):
     """Returns an SSH client connected to a node.
 
+    The connection is taken from the connection pool and must be closed
+    to return it there.
+
     :param node: the Node.
-    :returns: paramiko.SSHClient, an active ssh connection.
+    :returns: PooledSSHConnection, an active ssh connection.
+    :raises: SSHConnectFailed
 
     """
-    return utils.ssh_connect(_parse_driver_info(node))
+    return _connection_pool.get(_parse_driver_info(node))
 
 
 def _get_hosts_name_for_node(ssh_obj, driver_info):
@@ -248,40 +656,38 @@ def _get_hosts_name_for_node(ssh_obj, driver_info):
     :returns: the name or None if not found.
 
     """
-    matched_name = None
-    cmd_to_exec = "%s %s" % (driver_info['cmd_set']['base_cmd'],
-                             driver_info['cmd_set']['list_all'])
-    full_node_list = _ssh_execute(ssh_obj, cmd_to_exec)
-    LOG.debug(_("Retrieved Node List: %s") % repr(full_node_list))
-    # for each node check Mac Addresses
-    for node in full_node_list:
-        if not node:
-            continue
-        LOG.debug(_("Checking Node: %s's Mac address.") % node)
-        cmd_to_exec = "%s %s" % (driver_info['cmd_set']['base_cmd'],
-                                 driver_info['cmd_set']['get_node_macs'])
-        cmd_to_exec = cmd_to_exec.replace('{_NodeName_}', node)
-        hosts_node_mac_list = _ssh_execute(ssh_obj, cmd_to_exec)
-
-        for host_mac in hosts_node_mac_list:
-            if not host_mac:
-                continue
-            for node_mac in driver_info['macs']:
-                if not node_mac:
-                    continue
-                if _normalize_mac(host_mac) in _normalize_mac(node_mac):
-                    LOG.debug(_("Found Mac address: %s") % node_mac)
-                    matched_name = node
-                    break
-
-            if matched_name:
-                break
-        if matched_name:
-            break
-
+    matched_name = _get_inventory(ssh_obj, driver_info).get_name(
+                                                        driver_info['macs'])
+    if matched_name:
+        LOG.debug(_("Found Node %(name)s for Mac addresses %(macs)s") %
+                  {'name': matched_name, 'macs': driver_info['macs']})
     return matched_name
 
 
+def _wait_for_power_state(ssh_obj, driver_info, target):
+    """Wait for a node to reach a power state.
+
+    :param ssh_obj: paramiko.SSHClient, an active ssh connection.
+    :param driver_info: information for accessing the node.
+    :param target: the power state to wait for.
+    :returns: target, or ironic.common.states ERROR if the node did not
+              reach it in CONF.ssh.power_wait_timeout seconds.
+
+    """
+    def _get_state():
+        # NOTE: each poll needs an inventory read since the previous poll,
+        #       or since the power command for the first one. The waits
+        #       for the nodes of a host share the inventories read.
+        state = _get_power_status(ssh_obj, driver_info)
+        _require_fresh_inventory(driver_info)
+        return state
+
+    state = power_waiter.wait_for_power_state(driver_info['uuid'],
+                                              _get_state, target,
+                                              CONF.ssh.power_wait_timeout)
+    return state if state == target else states.ERROR
+
+
 def _power_on(ssh_obj, driver_info):
     """Power ON this node.
 
@@ -300,12 +706,9 @@ def _power_on(ssh_obj, driver_info):
     cmd_to_power_on = cmd_to_power_on.replace('{_NodeName_}', node_name)
 
     _ssh_execute(ssh_obj, cmd_to_power_on)
+    _require_fresh_inventory(driver_info)
 
-    current_pstate = _get_power_status(ssh_obj, driver_info)
-    if current_pstate == states.POWER_ON:
-        return current_pstate
-    else:
-        return states.ERROR
+    return _wait_for_power_state(ssh_obj, driver_info, states.POWER_ON)
 
 
 def _power_off(ssh_obj, driver_info):
@@ -326,12 +729,9 @@ def _power_off(ssh_obj, driver_info):
     cmd_to_power_off = cmd_to_power_off.replace('{_NodeName_}', node_name)
 
     _ssh_execute(ssh_obj, cmd_to_power_off)
+    _require_fresh_inventory(driver_info)
 
-    current_pstate = _get_power_status(ssh_obj, driver_info)
-    if current_pstate == states.POWER_OFF:
-        return current_pstate
-    else:
-        return states.ERROR
+    return _wait_for_power_state(ssh_obj, driver_info, states.POWER_OFF)
 
 
 def _get_nodes_mac_addresses(task, node):
@@ -372,7 +772,7 @@ class SSHPower(base.PowerInterface):
             raise exception.InvalidParameterValue(_("Node %s does not have "
                                 "any port associated with it.") % node.uuid)
         try:
-            _get_connection(node)
+            _get_connection(node).close()
         except exception.SSHConnectFailed as e:
             raise exception.InvalidParameterValue(_("SSH connection cannot"
                                                     " be established: %s") % e)
@@ -395,7 +795,10 @@ class SSHPower(base.PowerInterface):
         driver_info = _parse_driver_info(node)
         driver_info['macs'] = _get_nodes_mac_addresses(task, node)
         ssh_obj = _get_connection(node)
-        return _get_power_status(ssh_obj, driver_info)
+        try:
+            return _get_power_status(ssh_obj, driver_info)
+        finally:
+            ssh_obj.close()
 
     @task_manager.require_exclusive_lock
     def set_power_state(self, task, node, pstate):
@@ -417,15 +820,20 @@ class SSHPower(base.PowerInterface):
         """
         driver_info = _parse_driver_info(node)
         driver_info['macs'] = _get_nodes_mac_addresses(task, node)
+        # do not act upon a cached power state
+        _require_fresh_inventory(driver_info)
         ssh_obj = _get_connection(node)
 
-        if pstate == states.POWER_ON:
-            state = _power_on(ssh_obj, driver_info)
-        elif pstate == states.POWER_OFF:
-            state = _power_off(ssh_obj, driver_info)
-        else:
-            raise exception.InvalidParameterValue(_("set_power_state called "
-                    "with invalid power state %s.") % pstate)
+        try:
+            if pstate == states.POWER_ON:
+                state = _power_on(ssh_obj, driver_info)
+            elif pstate == states.POWER_OFF:
+                state = _power_off(ssh_obj, driver_info)
+            else:
+                raise exception.InvalidParameterValue(_("set_power_state "
+                        "called with invalid power state %s.") % pstate)
+        finally:
+            ssh_obj.close()
 
         if state != pstate:
             raise exception.PowerStateFailure(pstate=pstate)
@@ -448,12 +856,17 @@ class SSHPower(base.PowerInterface):
         """
         driver_info = _parse_driver_info(node)
         driver_info['macs'] = _get_nodes_mac_addresses(task, node)
+        # do not act upon a cached power state
+        _require_fresh_inventory(driver_info)
         ssh_obj = _get_connection(node)
-        current_pstate = _get_power_status(ssh_obj, driver_info)
-        if current_pstate == states.POWER_ON:
-            _power_off(ssh_obj, driver_info)
+        try:
+            current_pstate = _get_power_status(ssh_obj, driver_info)
+            if current_pstate == states.POWER_ON:
+                _power_off(ssh_obj, driver_info)
 
-        state = _power_on(ssh_obj, driver_info)
+            state = _power_on(ssh_obj, driver_info)
+        finally:
+            ssh_obj.close()
 
         if state != states.POWER_ON:
             raise exception.PowerStateFailure(pstate=states.POWER_ON)
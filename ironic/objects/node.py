@@ -54,6 +54,10 @@ class Node(base.IronicObject):
             # that started but failed to finish.
             'last_error': utils.str_or_none,
 
+            # The durations of the phases of the last deployment, and the
+            # progress of the copy of its image.
+            'deploy_progress': utils.dict_or_none,
+
             'extra': utils.dict_or_none,
             }
 
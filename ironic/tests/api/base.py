@@ -212,6 +212,15 @@ class FunctionalTest(base.DbTestCase):
         print('GOT:%s' % response)
         return response
 
+    def count_queries(self, func, *args, **kwargs):
+        """Count the SQL statements run by a call.
+
+        :returns: a tuple of the result of the call and the number of SQL
+                  statements it ran.
+        """
+        result, statements = self.record_statements(func, *args, **kwargs)
+        return result, len(statements)
+
     def validate_link(self, link):
         """Checks if the given link can get correct data."""
 
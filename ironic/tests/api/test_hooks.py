@@ -19,8 +19,10 @@ import mock
 from oslo.config import cfg
 
 from ironic.api.controllers import root
+from ironic.db.sqlalchemy import api as sqla_api
 from ironic.openstack.common.rpc import common as rpc_common
 from ironic.tests.api import base
+from ironic.tests.db import utils as dbutils
 
 
 class TestNoExceptionTracebackHook(base.FunctionalTest):
@@ -83,3 +85,27 @@ class TestNoExceptionTracebackHook(base.FunctionalTest):
         actual_msg = json.loads(
             response.json['error_message'])['faultstring']
         self.assertEqual(self.MSG_WITH_TRACE, actual_msg)
+
+
+@mock.patch.object(sqla_api.Connection, 'set_slave_reads')
+class TestDBHook(base.FunctionalTest):
+
+    def test_get_slave_reads(self, slave_reads_mock):
+        self.get_json('/nodes')
+        self.assertEqual([mock.call(True), mock.call(False)],
+                         slave_reads_mock.call_args_list)
+
+    def test_get_slave_reads_disabled(self, slave_reads_mock):
+        cfg.CONF.set_override('slave_reads', False, 'api')
+
+        self.get_json('/nodes')
+        self.assertEqual([mock.call(False), mock.call(False)],
+                         slave_reads_mock.call_args_list)
+
+    def test_patch_master_reads(self, slave_reads_mock):
+        node = self.dbapi.create_node(dbutils.get_test_node())
+
+        self.patch_json('/nodes/%s' % node.uuid,
+                        [{'path': '/extra/foo', 'value': 'bar',
+                          'op': 'add'}], expect_errors=True)
+        self.assertEqual(mock.call(False), slave_reads_mock.call_args_list[0])
@@ -97,6 +97,25 @@ class TestListNodes(base.FunctionalTest):
         # never expose the chassis_id
         self.assertNotIn('chassis_id', data['nodes'][0])
 
+    def test_detail_query_count(self):
+        chassis1 = self.chassis
+        chassis2 = self.dbapi.create_chassis(dbutils.get_test_chassis(
+                                    id=43, uuid=utils.generate_uuid()))
+        self.dbapi.create_node(dbutils.get_test_node())
+        data, one_node = self.count_queries(self.get_json, '/nodes/detail')
+        self.assertEqual(1, len(data['nodes']))
+
+        for i in range(2, 6):
+            chassis_id = chassis1.id if i % 2 else chassis2.id
+            self.dbapi.create_node(dbutils.get_test_node(
+                                       id=i, chassis_id=chassis_id,
+                                       uuid=utils.generate_uuid()))
+        data, five_nodes = self.count_queries(self.get_json, '/nodes/detail')
+        self.assertEqual(5, len(data['nodes']))
+        self.assertEqual(one_node, five_nodes)
+        self.assertEqual(set([chassis1.uuid, chassis2.uuid]),
+                         set(n['chassis_uuid'] for n in data['nodes']))
+
     def test_detail(self):
         ndict = dbutils.get_test_node()
         node = self.dbapi.create_node(ndict)
@@ -174,6 +193,53 @@ class TestListNodes(base.FunctionalTest):
         next_marker = data['nodes'][-1]['uuid']
         self.assertIn(next_marker, data['next'])
 
+    def test_fields(self):
+        node = self.dbapi.create_node(dbutils.get_test_node())
+        data, statements = self.record_statements(
+                self.get_json, '/nodes?fields=power_state,chassis_uuid')
+        self.assertEqual(set(['uuid', 'power_state', 'chassis_uuid',
+                              'links']),
+                         set(data['nodes'][0]))
+        self.assertEqual(node.uuid, data['nodes'][0]['uuid'])
+        self.assertEqual(self.chassis.uuid, data['nodes'][0]['chassis_uuid'])
+        # the other columns, e.g. the JSON ones, are not fetched
+        self.assertFalse([s for s, p in statements
+                          if 'driver_info' in s or 'properties' in s])
+
+    def test_fields_instance_uuid(self):
+        node = self.dbapi.create_node(dbutils.get_test_node(
+                                instance_uuid=utils.generate_uuid()))
+        data = self.get_json('/nodes?instance_uuid=%s&fields=driver'
+                             % node.instance_uuid)
+        self.assertThat(data['nodes'], HasLength(1))
+        self.assertEqual('fake', data['nodes'][0]['driver'])
+
+        data = self.get_json('/nodes?instance_uuid=%s&fields=driver'
+                             % utils.generate_uuid())
+        self.assertThat(data['nodes'], HasLength(0))
+
+    def test_fields_next_link(self):
+        for id in range(5):
+            self.dbapi.create_node(dbutils.get_test_node(
+                                        id=id, uuid=utils.generate_uuid()))
+        data = self.get_json('/nodes?limit=3&fields=driver')
+        self.assertEqual(3, len(data['nodes']))
+        self.assertIn('fields=driver', data['next'])
+        self.assertIn(data['nodes'][-1]['uuid'], data['next'])
+
+        data = self.get_json(data['next'].split('localhost', 1)[1],
+                             path_prefix='')
+        self.assertEqual(2, len(data['nodes']))
+        self.assertEqual(set(['uuid', 'driver', 'links']),
+                         set(data['nodes'][0]))
+
+    def test_fields_invalid(self):
+        for fields in ('id', 'chassis_id', 'uuid,foo'):
+            response = self.get_json('/nodes?fields=%s' % fields,
+                                     expect_errors=True)
+            self.assertEqual('application/json', response.content_type)
+            self.assertEqual(400, response.status_int)
+
     def test_ports_subresource_link(self):
         ndict = dbutils.get_test_node()
         self.dbapi.create_node(ndict)
@@ -238,6 +304,16 @@ class TestListNodes(base.FunctionalTest):
         self.assertEqual(test_time, prov_up_at)
         self.assertEqual(fake_error, data['last_error'])
         self.assertFalse(data['console_enabled'])
+        self.assertNotIn('deploy_progress', data)
+
+    def test_node_states_deploy_progress(self):
+        progress = {'phase': 'copy_image',
+                    'phases': [{'name': 'discovery', 'duration': 0.5}],
+                    'bytes_copied': 1024, 'bytes_total': 4096}
+        ndict = dbutils.get_test_node(deploy_progress=progress)
+        self.dbapi.create_node(ndict)
+        data = self.get_json('/nodes/%s/states' % ndict['uuid'])
+        self.assertEqual(progress, data['deploy_progress'])
 
     def test_node_by_instance_uuid(self):
         ndict = dbutils.get_test_node(uuid=utils.generate_uuid(),
@@ -590,6 +666,14 @@ class TestPatch(base.FunctionalTest):
         self.assertEqual(400, response.status_code)
         self.assertTrue(response.json['error_message'])
 
+    def test_replace_deploy_progress(self):
+        response = self.patch_json('/nodes/%s' % self.node['uuid'],
+                                   [{'path': '/deploy_progress',
+                                     'op': 'replace', 'value': {}}],
+                                   expect_errors=True)
+        self.assertEqual(400, response.status_code)
+        self.assertTrue(response.json['error_message'])
+
     def test_replace_internal_field(self):
         response = self.patch_json('/nodes/%s' % self.node['uuid'],
                                    [{'path': '/power_state', 'op': 'replace',
@@ -847,6 +931,117 @@ class TestPut(base.FunctionalTest):
                             {'target': 'not-supported'}, expect_errors=True)
         self.assertEqual(400, ret.status_code)
 
+    def _create_bulk_nodes(self):
+        nodes = [self.node]
+        for i in range(1, 3):
+            ndict = dbutils.get_test_node(id=i, uuid=utils.generate_uuid())
+            nodes.append(self.dbapi.create_node(ndict))
+        return [n.uuid for n in nodes]
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'change_nodes_power_state')
+    @mock.patch.object(rpcapi.ConductorAPI, 'get_topics_for')
+    def test_bulk_power_state(self, mock_gtsf, mock_cnsps):
+        uuids = self._create_bulk_nodes()
+        mock_gtsf.return_value = {uuids[0]: 'topic-a', uuids[1]: 'topic-b',
+                                  uuids[2]: 'topic-a'}
+
+        def change_nodes_power_state(context, node_ids, new_state, topic):
+            return dict((node_id, 'locked' if node_id == uuids[2] else None)
+                        for node_id in node_ids)
+
+        mock_cnsps.side_effect = change_nodes_power_state
+        ret = self.put_json('/nodes/power', {'node_uuids': uuids,
+                                             'target': states.POWER_ON})
+        self.assertEqual(202, ret.status_code)
+        self.assertEqual(uuids, [r['uuid'] for r in ret.json])
+        self.assertEqual([True, True, False],
+                         [r['accepted'] for r in ret.json])
+        self.assertEqual('locked', ret.json[2]['error'])
+        self.assertNotIn('error', ret.json[0])
+        self.assertIn('nodes/%s/states' % uuids[0],
+                      ret.json[0]['links'][0]['href'])
+
+        # one request per conductor
+        self.assertEqual(1, mock_gtsf.call_count)
+        self.assertEqual(2, mock_cnsps.call_count)
+        calls = sorted((c[0][3], sorted(c[0][1]), c[0][2])
+                       for c in mock_cnsps.call_args_list)
+        self.assertEqual([('topic-a', sorted([uuids[0], uuids[2]]),
+                           states.POWER_ON),
+                          ('topic-b', [uuids[1]], states.POWER_ON)], calls)
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'change_nodes_power_state')
+    @mock.patch.object(rpcapi.ConductorAPI, 'get_topics_for')
+    def test_bulk_power_state_no_valid_host(self, mock_gtsf, mock_cnsps):
+        uuids = self._create_bulk_nodes()
+        mock_gtsf.side_effect = exception.NoValidHost(reason='no conductor')
+        ret = self.put_json('/nodes/power', {'node_uuids': uuids,
+                                             'target': states.POWER_OFF})
+        self.assertEqual(202, ret.status_code)
+        self.assertEqual([False] * 3, [r['accepted'] for r in ret.json])
+        self.assertIn('no conductor', ret.json[0]['error'])
+        self.assertFalse(mock_cnsps.called)
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'change_nodes_power_state')
+    def test_bulk_power_state_node_not_found(self, mock_cnsps):
+        ret = self.put_json('/nodes/power',
+                            {'node_uuids': [self.node.uuid,
+                                    '12345678-9999-0000-aaaa-123456789012'],
+                             'target': states.POWER_ON}, expect_errors=True)
+        self.assertEqual(404, ret.status_code)
+        self.assertFalse(mock_cnsps.called)
+
+    def test_bulk_power_invalid_state_request(self):
+        ret = self.put_json('/nodes/power', {'node_uuids': [self.node.uuid],
+                                             'target': 'not-supported'},
+                            expect_errors=True)
+        self.assertEqual(400, ret.status_code)
+
+    def test_bulk_power_no_nodes(self):
+        ret = self.put_json('/nodes/power', {'node_uuids': [],
+                                             'target': states.POWER_ON},
+                            expect_errors=True)
+        self.assertEqual(400, ret.status_code)
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'change_nodes_power_state')
+    def test_bulk_power_too_many_nodes(self, mock_cnsps):
+        cfg.CONF.set_override('max_bulk_nodes', 2, 'api')
+        uuids = self._create_bulk_nodes()
+        ret = self.put_json('/nodes/power', {'node_uuids': uuids,
+                                             'target': states.POWER_ON},
+                            expect_errors=True)
+        self.assertEqual(400, ret.status_code)
+        self.assertFalse(mock_cnsps.called)
+
+        # duplicates are not counted
+        mock_cnsps.return_value = {}
+        ret = self.put_json('/nodes/power',
+                            {'node_uuids': uuids[:2] + uuids[:2],
+                             'target': states.POWER_ON})
+        self.assertEqual(202, ret.status_code)
+        self.assertEqual(uuids[:2], [r['uuid'] for r in ret.json])
+
+    @mock.patch.object(rpcapi.ConductorAPI, 'change_nodes_power_state')
+    @mock.patch.object(rpcapi.ConductorAPI, 'get_topics_for')
+    def test_bulk_power_state_rpc_error(self, mock_gtsf, mock_cnsps):
+        uuids = self._create_bulk_nodes()
+        mock_gtsf.return_value = {uuids[0]: 'topic-a', uuids[1]: 'topic-b',
+                                  uuids[2]: 'topic-a'}
+
+        def change_nodes_power_state(context, node_ids, new_state, topic):
+            if topic == 'topic-a':
+                raise Exception('timed out')
+            return dict((node_id, None) for node_id in node_ids)
+
+        mock_cnsps.side_effect = change_nodes_power_state
+        ret = self.put_json('/nodes/power', {'node_uuids': uuids,
+                                             'target': states.POWER_ON})
+        self.assertEqual(202, ret.status_code)
+        self.assertEqual([False, True, False],
+                         [r['accepted'] for r in ret.json])
+        self.assertIn('timed out', ret.json[0]['error'])
+        self.assertIn('did not confirm', ret.json[0]['error'])
+
     def test_provision_with_deploy(self):
         ret = self.put_json('/nodes/%s/states/provision' % self.node.uuid,
                             {'target': states.ACTIVE})
@@ -68,6 +68,25 @@ class TestListPorts(base.FunctionalTest):
         # never expose the node_id
         self.assertNotIn('node_id', data['ports'][0])
 
+    def test_detail_query_count(self):
+        node2 = self.dbapi.create_node(dbutils.get_test_node(
+                                            id=2, uuid=utils.generate_uuid()))
+        self.dbapi.create_port(dbutils.get_test_port())
+        data, one_port = self.count_queries(self.get_json, '/ports/detail')
+        self.assertEqual(1, len(data['ports']))
+
+        for i in range(2, 6):
+            node_id = self.node.id if i % 2 else node2.id
+            self.dbapi.create_port(dbutils.get_test_port(
+                                       id=i, node_id=node_id,
+                                       uuid=utils.generate_uuid(),
+                                       address='52:54:00:cf:2d:3%s' % i))
+        data, five_ports = self.count_queries(self.get_json, '/ports/detail')
+        self.assertEqual(5, len(data['ports']))
+        self.assertEqual(one_port, five_ports)
+        self.assertEqual(set([self.node.uuid, node2.uuid]),
+                         set(p['node_uuid'] for p in data['ports']))
+
     def test_detail_against_single(self):
         pdict = dbutils.get_test_port()
         port = self.dbapi.create_port(pdict)
@@ -129,6 +148,49 @@ class TestListPorts(base.FunctionalTest):
         next_marker = data['ports'][-1]['uuid']
         self.assertIn(next_marker, data['next'])
 
+    def test_fields(self):
+        port = self.dbapi.create_port(dbutils.get_test_port())
+        data, statements = self.record_statements(
+                self.get_json, '/ports?fields=node_uuid')
+        self.assertEqual(set(['uuid', 'node_uuid', 'links']),
+                         set(data['ports'][0]))
+        self.assertEqual(port.uuid, data['ports'][0]['uuid'])
+        self.assertEqual(self.node.uuid, data['ports'][0]['node_uuid'])
+        # the other columns are not fetched
+        self.assertFalse([s for s, p in statements if 'extra' in s])
+
+    def test_fields_by_node(self):
+        node2 = self.dbapi.create_node(dbutils.get_test_node(
+                                            id=2, uuid=utils.generate_uuid()))
+        port = self.dbapi.create_port(dbutils.get_test_port())
+        self.dbapi.create_port(dbutils.get_test_port(
+                                    id=2, node_id=node2.id,
+                                    uuid=utils.generate_uuid(),
+                                    address='52:54:00:cf:2d:32'))
+        data = self.get_json('/nodes/%s/ports?fields=address,extra'
+                             % self.node.uuid)
+        self.assertEqual([port.uuid], [p['uuid'] for p in data['ports']])
+        self.assertEqual(port.extra, data['ports'][0]['extra'])
+
+        response = self.get_json('/nodes/%s/ports?fields=address'
+                                 % utils.generate_uuid(), expect_errors=True)
+        self.assertEqual(404, response.status_int)
+
+    def test_fields_next_link(self):
+        for id in range(5):
+            self.dbapi.create_port(dbutils.get_test_port(
+                                        id=id, uuid=utils.generate_uuid(),
+                                        address='52:54:00:cf:2d:3%s' % id))
+        data = self.get_json('/ports?limit=3&fields=address')
+        self.assertEqual(3, len(data['ports']))
+        self.assertIn('fields=address', data['next'])
+        self.assertIn(data['ports'][-1]['uuid'], data['next'])
+
+    def test_fields_invalid(self):
+        response = self.get_json('/ports?fields=node_id', expect_errors=True)
+        self.assertEqual('application/json', response.content_type)
+        self.assertEqual(400, response.status_int)
+
 
 class TestPatch(base.FunctionalTest):
 
@@ -30,6 +30,7 @@ import shutil
 import sys
 
 import fixtures
+from sqlalchemy import event
 import testtools
 
 from oslo.config import cfg
@@ -37,6 +38,7 @@ from oslo.config import cfg
 from ironic.db.sqlalchemy import migration
 from ironic.db.sqlalchemy import models
 
+from ironic.common import hash_ring
 from ironic.common import paths
 from ironic.objects import base as objects_base
 from ironic.openstack.common.db.sqlalchemy import session
@@ -63,6 +65,14 @@ logging.setup('ironic')
 
 _DB_CACHE = None
 
+_recorded_engines = set()
+_recordings = []
+
+
+def _record_statement(conn, cursor, statement, parameters, *args):
+    if _recordings:
+        _recordings[-1].append((statement, parameters))
+
 
 class Database(fixtures.Fixture):
 
@@ -173,6 +183,10 @@ class TestCase(testtools.TestCase):
                                     sqlite_clean_db=CONF.sqlite_clean_db)
         self.useFixture(_DB_CACHE)
 
+        # The hash rings are shared by the whole process, make sure they
+        # are never reused between tests.
+        hash_ring.HashRingManager.reset()
+
         # NOTE(danms): Make sure to reset us back to non-remote objects
         # for each test to avoid interactions. Also, backup the object
         # registry
@@ -202,6 +216,25 @@ class TestCase(testtools.TestCase):
         for k, v in kw.iteritems():
             CONF.set_override(k, v, group)
 
+    def record_statements(self, func, *args, **kwargs):
+        """Record the SQL statements run by a call.
+
+        :returns: a tuple of the result of the call and a list of the
+                  (statement, parameters) tuples it ran.
+        """
+        engine = session.get_engine()
+        # NOTE: listeners can not be removed with SQLAlchemy 0.8, so a
+        #       single listener is added to each engine.
+        if engine not in _recorded_engines:
+            event.listen(engine, 'before_cursor_execute', _record_statement)
+            _recorded_engines.add(engine)
+        _recordings.append([])
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            statements = _recordings.pop()
+        return result, statements
+
     def path_get(self, project_file=None):
         """Get the absolute path to a file. Used for testing the API.
 
@@ -21,6 +21,7 @@
 import datetime
 import time
 
+import eventlet
 import mock
 from oslo.config import cfg
 from testtools.matchers import HasLength
@@ -195,7 +196,7 @@ class ManagerTestCase(base.DbTestCase):
                     driver='fake', power_state=states.POWER_OFF)
             self.dbapi.create_node(n)
             nodes.append(n['uuid'])
-            nodeinfo.append([i, n['uuid'], 'fake'])
+            nodeinfo.append([i, n['uuid'], 'fake', states.NOSTATE])
 
         # lock the first node
         self.dbapi.reserve_nodes('fake-reserve', [nodes[0]])
@@ -260,6 +261,130 @@ class ManagerTestCase(base.DbTestCase):
                                'get_power_state') as get_power_mock:
             self.service._sync_power_states(self.context)
             self.assertFalse(get_power_mock.called)
+        self.assertEqual(1, self.service.power_sync_stats['skipped'])
+
+    def _create_test_nodes(self, count):
+        nodes = []
+        for i in range(count):
+            n = utils.get_test_node(id=i, uuid=ironic_utils.generate_uuid(),
+                    driver='fake', power_state=states.POWER_ON)
+            self.dbapi.create_node(n)
+            nodes.append(n['uuid'])
+        return nodes
+
+    def test__sync_power_state_stats(self):
+        self.service.start()
+        self._create_test_nodes(3)
+        with mock.patch.object(self.driver.power,
+                               'get_power_state') as get_power_mock:
+            get_power_mock.return_value = states.POWER_ON
+            self.service._sync_power_states(self.context)
+        stats = self.service.power_sync_stats
+        self.assertEqual(3, stats['nodes'])
+        self.assertEqual(3, stats['checked'])
+        self.assertEqual(0, stats['skipped'])
+        self.assertEqual(0, stats['deferred'])
+        self.assertIn('duration', stats)
+
+    def test__sync_power_state_concurrency_limit(self):
+        self.service.start()
+        self.config(sync_power_state_workers=2, group='conductor')
+        self._create_test_nodes(5)
+        running = []
+        peak = []
+
+        def get_power_state(task, node):
+            running.append(node.uuid)
+            peak.append(len(running))
+            eventlet.sleep(0)
+            running.remove(node.uuid)
+            return states.POWER_ON
+
+        with mock.patch.object(self.driver.power,
+                               'get_power_state') as get_power_mock:
+            get_power_mock.side_effect = get_power_state
+            self.service._sync_power_states(self.context)
+            self.assertEqual(5, get_power_mock.call_count)
+        self.assertEqual(2, max(peak))
+        self.assertEqual(5, self.service.power_sync_stats['checked'])
+
+    def test__sync_power_state_worker_pool_full(self):
+        self.service.start()
+        self._create_test_nodes(2)
+        with mock.patch.object(self.service, '_spawn_worker') as spawn_mock:
+            spawn_mock.side_effect = exception.NoFreeConductorWorker()
+            with mock.patch.object(self.driver.power,
+                                   'get_power_state') as get_power_mock:
+                get_power_mock.return_value = states.POWER_ON
+                self.service._sync_power_states(self.context)
+                self.assertEqual(2, get_power_mock.call_count)
+        self.assertEqual(2, self.service.power_sync_stats['checked'])
+
+    def test__sync_power_state_skip_recent(self):
+        self.service.start()
+        self.config(sync_power_state_skip_recent=60, group='conductor')
+        nodes = self._create_test_nodes(2)
+        with mock.patch.object(self.driver.power,
+                               'get_power_state') as get_power_mock:
+            get_power_mock.return_value = states.POWER_ON
+            self.service._sync_power_states(self.context)
+            self.assertEqual(2, get_power_mock.call_count)
+
+            # the first node was synced long enough ago
+            self.service._power_sync_times[nodes[0]] -= 120
+            get_power_mock.reset_mock()
+            self.service._sync_power_states(self.context)
+            get_power_mock.assert_called_once_with(mock.ANY, mock.ANY)
+            self.assertEqual(nodes[0], get_power_mock.call_args[0][1].uuid)
+        self.assertEqual(1, self.service.power_sync_stats['skipped'])
+
+    def test__sync_power_state_node_timeout(self):
+        self.service.start()
+        self.config(sync_power_state_node_timeout=1, group='conductor')
+        nodes = self._create_test_nodes(1)
+
+        def get_power_state(task, node):
+            eventlet.sleep(5)
+
+        with mock.patch.object(self.driver.power,
+                               'get_power_state') as get_power_mock:
+            get_power_mock.side_effect = get_power_state
+            self.service._sync_power_states(self.context)
+        self.assertEqual(1, self.service.power_sync_stats['failed'])
+        self.assertNotIn(nodes[0], self.service._power_sync_times)
+        # the lock was released
+        node = self.dbapi.get_node(nodes[0])
+        self.assertIsNone(node.reservation)
+
+    @mock.patch.object(manager, 'time')
+    def test__sync_power_state_pass_deadline(self, time_mock):
+        self.service.start()
+        self.config(sync_power_state_pass_timeout=10, group='conductor')
+        self.config(sync_power_state_workers=1, group='conductor')
+        nodes = self._create_test_nodes(3)
+        # the deadline is reached once the first node was synced
+        times = [100, 100, 105]
+        time_mock.time.side_effect = lambda: times.pop(0) if times else 110
+        with mock.patch.object(self.driver.power,
+                               'get_power_state') as get_power_mock:
+            get_power_mock.return_value = states.POWER_ON
+            self.service._sync_power_states(self.context)
+            self.assertEqual(1, get_power_mock.call_count)
+            synced = get_power_mock.call_args[0][1].uuid
+        stats = self.service.power_sync_stats
+        self.assertEqual(1, stats['checked'])
+        self.assertEqual(2, stats['deferred'])
+
+        # the deferred nodes go first on the next pass
+        time_mock.time.side_effect = None
+        time_mock.time.return_value = 200
+        with mock.patch.object(self.driver.power,
+                               'get_power_state') as get_power_mock:
+            get_power_mock.return_value = states.POWER_ON
+            self.service._sync_power_states(self.context)
+            order = [c[0][1].uuid for c in get_power_mock.call_args_list]
+        self.assertEqual(synced, order[-1])
+        self.assertEqual(sorted(nodes), sorted(order))
 
     def test_change_node_power_state_power_on(self):
         # Test change_node_power_state including integration with
@@ -379,6 +504,116 @@ class ManagerTestCase(base.DbTestCase):
                 # link callback despite exception in background task.
                 self.assertIsNone(db_node.reservation)
 
+    def test_change_nodes_power_state(self):
+        nodes = []
+        for i in range(3):
+            n = utils.get_test_node(id=i, uuid=ironic_utils.generate_uuid(),
+                                    driver='fake',
+                                    power_state=states.POWER_OFF)
+            nodes.append(self.dbapi.create_node(n))
+        # the last node is locked by another conductor
+        self.dbapi.reserve_nodes('fake-reserve', [nodes[2].uuid])
+        missing_uuid = '12345678-9999-0000-aaaa-123456789012'
+        node_uuids = [n.uuid for n in nodes] + [missing_uuid]
+        self.service.start()
+
+        with mock.patch.object(self.driver.power, 'get_power_state') \
+                as get_power_mock:
+            get_power_mock.return_value = states.POWER_OFF
+
+            results = self._change_nodes_power_state(node_uuids,
+                                                     states.POWER_ON)
+
+        self.assertEqual(set(node_uuids), set(results))
+        self.assertIsNone(results[nodes[0].uuid])
+        self.assertIsNone(results[nodes[1].uuid])
+        self.assertIn('fake-reserve', results[nodes[2].uuid])
+        self.assertIn(missing_uuid, results[missing_uuid])
+        for node, power_state in zip(nodes, [states.POWER_ON, states.POWER_ON,
+                                             states.POWER_OFF]):
+            node.refresh(self.context)
+            self.assertEqual(power_state, node.power_state)
+            self.assertIsNone(node.target_power_state)
+        self.assertIsNone(nodes[0].reservation)
+        self.assertIsNone(nodes[1].reservation)
+
+    def _change_nodes_power_state(self, node_uuids, new_state):
+        # run the queueing of the power actions right away, then wait for
+        # the power actions
+        with mock.patch.object(eventlet, 'spawn',
+                               side_effect=lambda f, *args: f(*args)):
+            results = self.service.change_nodes_power_state(self.context,
+                                                            node_uuids,
+                                                            new_state)
+        self.service._bulk_power_pool.waitall()
+        return results
+
+    def test_change_nodes_power_state_queued(self):
+        self.config(bulk_power_workers=2, group='conductor')
+        nodes = []
+        for i in range(1, 6):
+            n = utils.get_test_node(id=i, uuid=ironic_utils.generate_uuid(),
+                                    driver='fake',
+                                    power_state=states.POWER_OFF)
+            nodes.append(self.dbapi.create_node(n))
+        node_uuids = [n.uuid for n in nodes]
+        self.service.start()
+
+        with mock.patch.object(self.dbapi, 'reserve_nodes',
+                               wraps=self.dbapi.reserve_nodes) as reserve_mock:
+            with mock.patch.object(self.driver.power, 'get_power_state') \
+                    as get_power_mock:
+                get_power_mock.return_value = states.POWER_OFF
+                results = self._change_nodes_power_state(node_uuids,
+                                                         states.POWER_ON)
+
+        # all the nodes are reserved at once, and none is rejected although
+        # there are less workers than nodes
+        self.assertEqual(1, reserve_mock.call_count)
+        self.assertEqual(sorted(node_uuids),
+                         sorted(reserve_mock.call_args[0][1]))
+        self.assertEqual(dict((u, None) for u in node_uuids), results)
+        for node in nodes:
+            node.refresh(self.context)
+            self.assertEqual(states.POWER_ON, node.power_state)
+            self.assertIsNone(node.reservation)
+
+    def test_change_nodes_power_state_unexpected_error(self):
+        n = utils.get_test_node(driver='fake', power_state=states.POWER_OFF)
+        db_node = self.dbapi.create_node(n)
+        self.service.start()
+
+        with mock.patch.object(task_manager, 'TaskManager') as task_mock:
+            task_mock.side_effect = ValueError('boom')
+            results = self.service.change_nodes_power_state(self.context,
+                                                            [db_node.uuid],
+                                                            states.POWER_ON)
+        self.assertEqual({db_node.uuid: 'boom'}, results)
+
+    def test_change_nodes_power_state_action_fails(self):
+        nodes = []
+        for i in range(1, 3):
+            n = utils.get_test_node(id=i, uuid=ironic_utils.generate_uuid(),
+                                    driver='fake',
+                                    power_state=states.POWER_OFF)
+            nodes.append(self.dbapi.create_node(n))
+        self.service.start()
+
+        with mock.patch.object(self.driver.power, 'get_power_state') \
+                as get_power_mock:
+            get_power_mock.side_effect = [exception.IPMIFailure(cmd='fake'),
+                                          states.POWER_OFF]
+            results = self._change_nodes_power_state([n.uuid for n in nodes],
+                                                     states.POWER_ON)
+
+        # the nodes were accepted, the failure is reported in last_error
+        self.assertEqual([None, None], [results[n.uuid] for n in nodes])
+        for node in nodes:
+            node.refresh(self.context)
+            self.assertIsNone(node.reservation)
+        self.assertIsNotNone(nodes[0].last_error)
+        self.assertEqual(states.POWER_ON, nodes[1].power_state)
+
     def test_update_node(self):
         ndict = utils.get_test_node(driver='fake', extra={'test': 'one'})
         node = self.dbapi.create_node(ndict)
@@ -790,6 +1025,34 @@ class ManagerTestCase(base.DbTestCase):
         node.refresh(self.context)
         self.assertIsNone(node.reservation)
 
+    def test__get_mapped_nodeinfo_list(self):
+        self.config(hash_distribution_replicas=1)
+        self.service.start()
+        self.dbapi.register_conductor({'hostname': 'other-host',
+                                       'drivers': ['fake']})
+        self.service.ring_manager.refresh()
+        uuids = []
+        for i in range(1, 21):
+            n = utils.get_test_node(id=i, uuid=ironic_utils.generate_uuid())
+            self.dbapi.create_node(n)
+            uuids.append(n['uuid'])
+        n = utils.get_test_node(id=21, uuid=ironic_utils.generate_uuid(),
+                                driver='unsupported')
+        self.dbapi.create_node(n)
+
+        ring = self.service.ring_manager['fake']
+        expected = [u for u in uuids if 'test-host' in ring.get_hosts(u)]
+        get_list = self.dbapi.get_nodeinfo_list
+        with mock.patch.object(self.dbapi, 'get_nodeinfo_list',
+                               wraps=get_list) as list_mock:
+            res = self.service._get_mapped_nodeinfo_list(['uuid', 'driver'],
+                                                         {'reserved': False})
+            filters = list_mock.call_args[1]['filters']
+            self.assertEqual(['fake'], filters['partitions'].keys())
+            self.assertFalse(filters['reserved'])
+        self.assertEqual(sorted(expected), sorted(r[0] for r in res))
+        self.assertTrue(0 < len(res) < 20)
+
     @mock.patch.object(timeutils, 'utcnow')
     def test__check_deploy_timeouts_timeout(self, mock_utcnow):
         self.config(deploy_callback_timeout=60, group='conductor')
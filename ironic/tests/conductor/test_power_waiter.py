@@ -0,0 +1,92 @@
+# coding=utf-8
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for :class:`ironic.conductor.power_waiter.PowerStateWaiter`."""
+
+import eventlet
+import mock
+
+from ironic.common import exception
+from ironic.common import states
+from ironic.conductor import power_waiter
+from ironic.tests import base
+
+
+class PowerStateWaiterTestCase(base.TestCase):
+
+    def setUp(self):
+        super(PowerStateWaiterTestCase, self).setUp()
+        self.config(power_wait_initial_interval=0.01,
+                    power_wait_max_interval=0.04, group='conductor')
+        self.waiter = power_waiter.PowerStateWaiter()
+
+    def test_wait_target_reached(self):
+        get_state = mock.Mock(return_value=states.POWER_ON)
+
+        state = self.waiter.wait('fake-uuid', get_state, states.POWER_ON, 10)
+        self.assertEqual(states.POWER_ON, state)
+        get_state.assert_called_once_with()
+
+    @mock.patch.object(power_waiter.time, 'time')
+    def test_poll_backoff(self, time_mock):
+        time_mock.return_value = 1000.0
+        wait = power_waiter._Wait('fake-uuid', lambda: states.POWER_OFF,
+                                  states.POWER_ON, 1000.05)
+        next_polls = []
+        for i in range(4):
+            self.waiter._poll(wait)
+            next_polls.append(wait.next_poll)
+
+        self.assertEqual([1000.01, 1000.02, 1000.04, 1000.04], next_polls)
+        self.assertFalse(wait.done.ready())
+
+        time_mock.return_value = 1000.05
+        self.waiter._poll(wait)
+        self.assertEqual(states.POWER_OFF, wait.done.wait())
+
+    def test_wait_timeout(self):
+        get_state = mock.Mock(return_value=states.POWER_OFF)
+
+        state = self.waiter.wait('fake-uuid', get_state, states.POWER_ON,
+                                 0.05)
+        self.assertEqual(states.POWER_OFF, state)
+        self.assertTrue(get_state.call_count > 1)
+
+    def test_wait_exception(self):
+        get_state = mock.Mock(side_effect=exception.IPMIFailure(cmd='fake'))
+
+        self.assertRaises(exception.IPMIFailure, self.waiter.wait,
+                          'fake-uuid', get_state, states.POWER_ON, 10)
+
+    def test_wait_multiple(self):
+        slow = mock.Mock(side_effect=[states.POWER_OFF] * 3 +
+                                     [states.POWER_ON])
+        fast = mock.Mock(return_value=states.POWER_OFF)
+        results = {}
+
+        def _wait(name, get_state, target):
+            results[name] = self.waiter.wait(name, get_state, target, 10)
+
+        threads = [eventlet.spawn(_wait, 'slow', slow, states.POWER_ON),
+                   eventlet.spawn(_wait, 'fast', fast, states.POWER_OFF)]
+        for thread in threads:
+            thread.wait()
+
+        self.assertEqual({'slow': states.POWER_ON, 'fast': states.POWER_OFF},
+                         results)
+        self.assertEqual(4, slow.call_count)
+        fast.assert_called_once_with()
+        # the polling thread stops when there is nothing to wait for
+        eventlet.sleep(0)
+        self.assertIsNone(self.waiter._thread)
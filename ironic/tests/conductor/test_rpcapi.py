@@ -70,6 +70,34 @@ class RPCAPITestCase(base.DbTestCase):
                          rpcapi.get_topic_for,
                          self.fake_node_obj)
 
+    def test_get_topics_for(self):
+        CONF.set_override('host', 'fake-host')
+        self.dbapi.register_conductor({'hostname': 'fake-host',
+                                       'drivers': ['fake-driver',
+                                                   'other-driver']})
+        other_node = objects.Node._from_db_object(
+                objects.Node(),
+                json.to_primitive(dbutils.get_test_node(
+                    id=2, uuid='1be26c0b-03f2-4d2e-ae87-c02d7f33c781',
+                    driver='other-driver')))
+
+        rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
+        expected = {self.fake_node_obj.uuid: 'fake-topic.fake-host',
+                    other_node.uuid: 'fake-topic.fake-host'}
+        self.assertEqual(expected,
+                         rpcapi.get_topics_for([self.fake_node_obj,
+                                                other_node]))
+
+    def test_get_topics_for_unknown_driver(self):
+        CONF.set_override('host', 'fake-host')
+        self.dbapi.register_conductor({'hostname': 'fake-host',
+                                       'drivers': ['other-driver']})
+
+        rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
+        self.assertRaises(exception.NoValidHost,
+                          rpcapi.get_topics_for,
+                          [self.fake_node_obj])
+
     def _test_rpcapi(self, method, rpc_method, **kwargs):
         ctxt = context.get_admin_context()
         rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
@@ -116,6 +144,12 @@ class RPCAPITestCase(base.DbTestCase):
                           node_id=self.fake_node['uuid'],
                           new_state=states.POWER_ON)
 
+    def test_change_nodes_power_state(self):
+        self._test_rpcapi('change_nodes_power_state',
+                          'call',
+                          node_ids=[self.fake_node['uuid']],
+                          new_state=states.POWER_ON)
+
     def test_pass_vendor_info(self):
         ctxt = context.get_admin_context()
         rpcapi = conductor_rpcapi.ConductorAPI(topic='fake-topic')
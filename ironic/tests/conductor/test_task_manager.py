@@ -17,6 +17,7 @@
 
 """Tests for :class:`ironic.conductor.task_manager`."""
 
+import mock
 from testtools import matchers
 
 from ironic.common import driver_factory
@@ -163,6 +164,65 @@ class TaskManagerTestCase(TaskManagerSetup):
         node = self.dbapi.get_node(node_uuid)
         self.assertIsNone(node.reservation)
 
+    def test_get_many_nodes_driver_load_exception(self):
+        self.assertRaises(exception.DriverNotFound,
+                          task_manager.TaskManager,
+                          self.context, self.uuids,
+                          driver_name='no-such-driver')
+
+        # Check that no db node reservation is left.
+        for uuid in self.uuids:
+            node = self.dbapi.get_node(uuid)
+            self.assertIsNone(node.reservation)
+
+    def test_get_many_nodes_some_not_found(self):
+        uuids = self.uuids[0:2] + ['12345678-9999-0000-aaaa-123456789012']
+        for shared in (False, True):
+            self.assertRaises(exception.NodeNotFound,
+                              task_manager.TaskManager,
+                              self.context, uuids, shared=shared)
+
+        for uuid in self.uuids:
+            node = self.dbapi.get_node(uuid)
+            self.assertIsNone(node.reservation)
+
+    def test_get_many_nodes_batched(self):
+        with mock.patch.object(self.dbapi, 'reserve_nodes',
+                               wraps=self.dbapi.reserve_nodes) as reserve_mock:
+            with mock.patch.object(self.dbapi, 'get_ports_by_nodes',
+                    wraps=self.dbapi.get_ports_by_nodes) as ports_mock:
+                with task_manager.acquire(self.context, self.uuids) as task:
+                    self.assertThat(task, ContainsUUIDs(self.uuids))
+        reserve_mock.assert_called_once_with('test-host', self.uuids)
+        self.assertEqual(1, ports_mock.call_count)
+
+    def test_get_many_nodes_keeps_order_and_ports(self):
+        node = self.dbapi.get_node(self.uuids[1])
+        port = self.dbapi.create_port(utils.get_test_port(node_id=node.id))
+        uuids = [self.uuids[3], self.uuids[1], self.uuids[3]]
+
+        with task_manager.acquire(self.context, uuids) as task:
+            self.assertEqual(self.uuids[3:4] + self.uuids[1:2],
+                             [r.node.uuid for r in task.resources])
+            self.assertEqual([], task.resources[0].ports)
+            self.assertEqual([port.uuid],
+                             [p.uuid for p in task.resources[1].ports])
+
+    def test_split(self):
+        task = task_manager.acquire(self.context, self.uuids[:2])
+        first, second = task.split()
+        self.assertEqual([], task.resources)
+        self.assertEqual(self.uuids[0], first.node.uuid)
+        self.assertEqual(self.uuids[1], second.node.uuid)
+
+        with first:
+            pass
+        self.assertIsNone(self.dbapi.get_node(self.uuids[0]).reservation)
+        self.assertEqual('test-host',
+                         self.dbapi.get_node(self.uuids[1]).reservation)
+        second.release_resources()
+        self.assertIsNone(self.dbapi.get_node(self.uuids[1]).reservation)
+
 
 class ExclusiveLockDecoratorTestCase(TaskManagerSetup):
 
@@ -50,6 +50,7 @@ import six.moves.urllib.parse as urlparse
 import sqlalchemy
 import sqlalchemy.exc
 
+from ironic.common import hash_ring
 from ironic.db.sqlalchemy import migration
 from ironic.openstack.common.db.sqlalchemy import session
 from ironic.openstack.common.db.sqlalchemy import utils as db_utils
@@ -516,3 +517,41 @@ class TestMigrations(BaseMigrationTestCase, WalkVersionsMixin):
                                    sqlalchemy.types.Boolean) or
                         isinstance(nodes.c.console_enabled.type,
                                    sqlalchemy.types.Integer))
+
+    def _pre_upgrade_487deb87cc9d(self, engine):
+        nodes = db_utils.get_table(engine, 'nodes')
+        data = {'uuid': '1be26c0b-03f2-4d2e-ae87-c02d7f33c123'}
+        nodes.insert().values(data).execute()
+        return data
+
+    def _check_487deb87cc9d(self, engine, data):
+        nodes = db_utils.get_table(engine, 'nodes')
+        col_names = [column.name for column in nodes.c]
+        self.assertIn('partition_key', col_names)
+        self.assertIsInstance(nodes.c.partition_key.type,
+                              sqlalchemy.types.BigInteger)
+
+        node = nodes.select(nodes.c.uuid == data['uuid']).execute().first()
+        self.assertEqual(hash_ring.get_partition_key(data['uuid']),
+                         node['partition_key'])
+
+    def _check_99480471eeef(self, engine, data):
+        nodes = db_utils.get_table(engine, 'nodes')
+        col_names = [column.name for column in nodes.c]
+        self.assertIn('deploy_progress', col_names)
+        self.assertIsInstance(nodes.c.deploy_progress.type,
+                              sqlalchemy.types.Text)
+
+    def _check_72133e26895f(self, engine, data):
+        inspector = sqlalchemy.inspect(engine)
+        node_indexes = dict((i['name'], i['column_names'])
+                            for i in inspector.get_indexes('nodes'))
+        self.assertEqual(['reservation', 'driver', 'partition_key'],
+                         node_indexes['node_reservation_driver_partition_key'])
+        self.assertEqual(['maintenance', 'id'],
+                         node_indexes['node_maintenance_id'])
+        self.assertEqual(['chassis_id', 'id'],
+                         node_indexes['node_chassis_id_id'])
+        port_indexes = dict((i['name'], i['column_names'])
+                            for i in inspector.get_indexes('ports'))
+        self.assertEqual(['node_id', 'id'], port_indexes['port_node_id_id'])
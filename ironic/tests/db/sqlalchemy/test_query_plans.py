@@ -0,0 +1,107 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests that the listings of the DB API are resolved with indexes."""
+
+from ironic.common import hash_ring
+from ironic.common import utils as ironic_utils
+from ironic.db import api as dbapi
+from ironic.openstack.common.db.sqlalchemy import session as db_session
+
+from ironic.tests.db import base
+from ironic.tests.db import utils
+
+
+class QueryPlanTestCase(base.DbTestCase):
+
+    def setUp(self):
+        super(QueryPlanTestCase, self).setUp()
+        self.engine = db_session.get_engine()
+        if self.engine.name != 'sqlite':
+            self.skipTest('query plans are only checked on SQLite')
+        self.dbapi = dbapi.get_instance()
+        self.chassis = self.dbapi.create_chassis(utils.get_test_chassis())
+        for i in range(1, 6):
+            node = self.dbapi.create_node(utils.get_test_node(
+                                    id=i, uuid=ironic_utils.generate_uuid()))
+            self.dbapi.create_port(utils.get_test_port(
+                                    id=i, node_id=node.id,
+                                    uuid=ironic_utils.generate_uuid(),
+                                    address='52:54:00:cf:2d:3%s' % i))
+        self.marker = self.dbapi.get_node(3)
+
+    def _explain(self, statement, parameters):
+        conn = self.engine.raw_connection()
+        try:
+            return [row[-1] for row in
+                    conn.execute('EXPLAIN QUERY PLAN ' + statement,
+                                 parameters).fetchall()]
+        finally:
+            conn.close()
+
+    def assertSearches(self, func, *args, **kwargs):
+        """Check that the SELECTs of a call do not scan whole tables.
+
+        :returns: the steps of the query plans of the SELECTs.
+        """
+        result, statements = self.record_statements(func, *args, **kwargs)
+        selects = [(s, p) for s, p in statements if s.startswith('SELECT')]
+        self.assertTrue(selects)
+        steps = []
+        for statement, parameters in selects:
+            for step in self._explain(statement, parameters):
+                if step.startswith('SCAN'):
+                    self.fail('%s\nscans a table: %s' % (statement, step))
+                steps.append(step)
+        return steps
+
+    def test_node_list_after_marker(self):
+        self.assertSearches(self.dbapi.get_node_list, limit=2,
+                            marker=self.marker)
+
+    def test_node_list_after_marker_sort_key(self):
+        self.assertSearches(self.dbapi.get_node_list, limit=2,
+                            marker=self.marker, sort_key='uuid')
+        self.assertSearches(self.dbapi.get_node_list, limit=2,
+                            marker=self.marker, sort_key='uuid',
+                            sort_dir='desc')
+
+    def test_node_list_maintenance(self):
+        self.assertSearches(self.dbapi.get_node_list,
+                            {'maintenance': True}, limit=2)
+
+    def test_node_list_chassis(self):
+        self.assertSearches(self.dbapi.get_node_list,
+                            {'chassis_uuid': self.chassis.uuid}, limit=2)
+
+    def test_node_list_not_associated(self):
+        self.assertSearches(self.dbapi.get_node_list,
+                            {'associated': False}, limit=2)
+
+    def test_nodeinfo_list_partitions(self):
+        owned = hash_ring.OwnedPartitions(24, 3, [1], 200, [201, 203])
+        filters = {'reserved': False, 'partitions': {'fake': owned}}
+        steps = self.assertSearches(self.dbapi.get_nodeinfo_list,
+                                    columns=['id', 'uuid'], filters=filters)
+        # the partitions are interleaved, they are filtered on the entries
+        # of the index and not sought
+        self.assertIn('SEARCH nodes USING INDEX '
+                      'node_reservation_driver_partition_key '
+                      '(reservation=? AND driver=?)', steps)
+
+        filters['maintenance'] = False
+        self.assertSearches(self.dbapi.get_nodeinfo_list,
+                            columns=['id', 'uuid'], filters=filters)
+
+    def test_ports_by_node(self):
+        self.assertSearches(self.dbapi.get_ports_by_node, 1, limit=2)
+        self.assertSearches(self.dbapi.get_ports_by_nodes, [1, 2])
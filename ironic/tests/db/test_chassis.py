@@ -50,6 +50,17 @@ class DbChassisTestCase(base.DbTestCase):
         res_uuids = [r.uuid for r in res]
         self.assertEqual(uuids.sort(), res_uuids.sort())
 
+    def test_get_chassis_uuids(self):
+        ch1 = self._create_test_chassis(id=1,
+                                        uuid=ironic_utils.generate_uuid())
+        ch2 = self._create_test_chassis(id=2,
+                                        uuid=ironic_utils.generate_uuid())
+        self._create_test_chassis(id=3, uuid=ironic_utils.generate_uuid())
+
+        res = self.dbapi.get_chassis_uuids([1, 2, 666])
+        self.assertEqual({1: ch1['uuid'], 2: ch2['uuid']}, res)
+        self.assertEqual({}, self.dbapi.get_chassis_uuids([]))
+
     def test_get_chassis_by_id(self):
         ch = self._create_test_chassis()
         chassis = self.dbapi.get_chassis(ch['id'])
@@ -173,3 +173,42 @@ class DbConductorTestCase(base.DbTestCase):
         expected = {d: set([h1, h2]), d1: set([h1]), d2: set([h2])}
         result = self.dbapi.get_active_driver_dict(interval=two_minute)
         self.assertEqual(expected, result)
+
+    @mock.patch.object(timeutils, 'utcnow')
+    def test_get_active_conductor_fingerprint(self, mock_utcnow):
+        mock_utcnow.return_value = datetime.datetime.utcnow()
+        self._create_test_cdr(id=1, hostname='host1', drivers=['d1'])
+        fp1 = self.dbapi.get_active_conductor_fingerprint()
+
+        # a heartbeat does not change the fingerprint
+        self.dbapi.touch_conductor('host1')
+        self.assertEqual(fp1, self.dbapi.get_active_conductor_fingerprint())
+
+        # registering again with other drivers does
+        self.dbapi.unregister_conductor('host1')
+        self._create_test_cdr(id=2, hostname='host1', drivers=['d2'])
+        fp2 = self.dbapi.get_active_conductor_fingerprint()
+        self.assertNotEqual(fp1, fp2)
+
+        # and so does a new conductor
+        self._create_test_cdr(id=3, hostname='host2', drivers=['d2'])
+        self.assertNotEqual(fp2,
+                            self.dbapi.get_active_conductor_fingerprint())
+
+    @mock.patch.object(timeutils, 'utcnow')
+    def test_get_active_conductor_fingerprint_with_old_conductor(self,
+                                                                 mock_utcnow):
+        past = datetime.datetime(2000, 1, 1, 0, 0)
+        present = past + datetime.timedelta(minutes=2)
+
+        mock_utcnow.return_value = past
+        self._create_test_cdr(id=1, hostname='old-host')
+        mock_utcnow.return_value = present
+        self._create_test_cdr(id=2, hostname='new-host')
+
+        self.assertEqual(((2, 'new-host'),),
+                         self.dbapi.get_active_conductor_fingerprint(
+                             interval=60))
+        self.assertEqual(((1, 'old-host'), (2, 'new-host')),
+                         self.dbapi.get_active_conductor_fingerprint(
+                             interval=120))
@@ -21,8 +21,10 @@ import mock
 import six
 
 from ironic.common import exception
+from ironic.common import hash_ring
 from ironic.common import utils as ironic_utils
 from ironic.db import api as dbapi
+from ironic.db.sqlalchemy import api as sqla_api
 from ironic.openstack.common import timeutils
 from ironic.tests.db import base
 from ironic.tests.db import utils
@@ -96,6 +98,25 @@ class DbNodeTestCase(base.DbTestCase):
         self.assertRaises(exception.InvalidIdentity,
                           self.dbapi.get_node, 'not-a-uuid')
 
+    def test_get_nodes(self):
+        uuids = []
+        for i in range(1, 4):
+            n = self._create_test_node(id=i,
+                                       uuid=ironic_utils.generate_uuid())
+            uuids.append(n['uuid'])
+        res = self.dbapi.get_nodes(uuids[:2])
+        self.assertEqual(sorted(uuids[:2]), sorted([r.uuid for r in res]))
+        res = self.dbapi.get_nodes([1, 3])
+        self.assertEqual([1, 3], sorted([r.id for r in res]))
+
+    def test_get_nodes_that_do_not_exist(self):
+        n = self._create_test_node()
+        self.assertRaises(exception.NodeNotFound,
+                          self.dbapi.get_nodes, [n['id'], 99])
+        self.assertRaises(exception.NodeNotFound,
+                          self.dbapi.get_nodes,
+                          [n['uuid'], '12345678-9999-0000-aaaa-123456789012'])
+
     def test_get_nodeinfo_list_defaults(self):
         for i in range(1, 6):
             n = utils.get_test_node(id=i, uuid=ironic_utils.generate_uuid())
@@ -140,6 +161,10 @@ class DbNodeTestCase(base.DbTestCase):
         res = self.dbapi.get_nodeinfo_list(filters={'associated': False})
         self.assertEqual([2], [r[0] for r in res])
 
+        res = self.dbapi.get_nodeinfo_list(
+                filters={'instance_uuid': n1['instance_uuid']})
+        self.assertEqual([1], [r[0] for r in res])
+
         res = self.dbapi.get_nodeinfo_list(filters={'reserved': True})
         self.assertEqual([1], [r[0] for r in res])
 
@@ -152,6 +177,49 @@ class DbNodeTestCase(base.DbTestCase):
         res = self.dbapi.get_node_list(filters={'maintenance': False})
         self.assertEqual([1], [r.id for r in res])
 
+    def test_create_node_sets_partition_key(self):
+        n = self._create_test_node()
+        self.assertEqual(hash_ring.get_partition_key(n['uuid']),
+                         self.dbapi.get_nodeinfo_list(
+                             columns=['partition_key'])[0][0])
+
+    def test_get_nodeinfo_list_with_partitions(self):
+        self.config(hash_partition_exponent=4)
+        hosts = ['host1', 'host2', 'host3']
+        ring = hash_ring.HashRing(hosts, replicas=2)
+        uuids = []
+        for i in range(1, 41):
+            n = self._create_test_node(id=i, driver='driver-one',
+                                       uuid=ironic_utils.generate_uuid())
+            uuids.append(n['uuid'])
+        self._create_test_node(id=41, driver='driver-two',
+                               uuid=ironic_utils.generate_uuid())
+
+        for host in hosts:
+            filters = {'partitions':
+                           {'driver-one': ring.get_owned_partitions(host)}}
+            res = self.dbapi.get_nodeinfo_list(columns=['uuid'],
+                                               filters=filters)
+            expected = [u for u in uuids if host in ring.get_hosts(u)]
+            self.assertEqual(sorted(expected), sorted(r[0] for r in res))
+
+    def test_get_nodeinfo_list_with_partitions_no_key(self):
+        n = self._create_test_node(driver='driver-one')
+        self.dbapi.update_node(n['id'], {'partition_key': None})
+        ring = hash_ring.HashRing(['host1'])
+        owned = ring.get_owned_partitions('host1')
+        res = self.dbapi.get_nodeinfo_list(
+                filters={'partitions': {'driver-one': owned}})
+        self.assertEqual([n['id']], [r[0] for r in res])
+        res = self.dbapi.get_nodeinfo_list(
+                filters={'partitions': {'driver-two': owned}})
+        self.assertEqual([], res)
+
+    def test_get_nodeinfo_list_with_no_partitions(self):
+        self._create_test_node()
+        res = self.dbapi.get_nodeinfo_list(filters={'partitions': {}})
+        self.assertEqual([], res)
+
     def test_get_node_list(self):
         uuids = []
         for i in range(1, 6):
@@ -162,6 +230,69 @@ class DbNodeTestCase(base.DbTestCase):
         res_uuids = [r.uuid for r in res]
         self.assertEqual(uuids.sort(), res_uuids.sort())
 
+    def test_get_node_list_pages_sort_key(self):
+        uuids = self._create_many_test_nodes()
+
+        for sort_dir, expected in (('asc', uuids), ('desc', uuids[::-1])):
+            pages = []
+            marker = None
+            while True:
+                page = self.dbapi.get_node_list(limit=2, marker=marker,
+                                                sort_key='uuid',
+                                                sort_dir=sort_dir)
+                if not page:
+                    break
+                pages.extend(n.uuid for n in page)
+                marker = page[-1]
+            self.assertEqual(expected, pages)
+
+    def test_get_node_uuids(self):
+        uuids = {}
+        for i in range(1, 4):
+            n = utils.get_test_node(id=i, uuid=ironic_utils.generate_uuid())
+            self.dbapi.create_node(n)
+            uuids[i] = n['uuid']
+
+        res = self.dbapi.get_node_uuids([1, 3, 666])
+        self.assertEqual({1: uuids[1], 3: uuids[3]}, res)
+        self.assertEqual({}, self.dbapi.get_node_uuids([]))
+
+    def _get_session_calls(self, func, *args):
+        get_session = sqla_api.get_session
+        with mock.patch.object(sqla_api, 'get_session') as session_mock:
+            # NOTE: no slave database is set up, so read from the master.
+            session_mock.side_effect = lambda **kwargs: get_session()
+            func(*args)
+        return session_mock.call_args_list
+
+    def test_slave_reads(self):
+        self.config(slave_connection='sqlite://', group='database')
+        n = self._create_test_node()
+        self.dbapi.set_slave_reads(True)
+        self.addCleanup(self.dbapi.set_slave_reads, False)
+
+        calls = self._get_session_calls(self.dbapi.get_node_list)
+        self.assertEqual([mock.call(slave_session=True)], calls)
+        # NOTE: the reservations always use the master
+        calls = self._get_session_calls(self.dbapi.reserve_nodes, 'fake-tag',
+                                        [n['id']])
+        self.assertNotIn(mock.call(slave_session=True), calls)
+
+    def test_slave_reads_disabled(self):
+        self.config(slave_connection='sqlite://', group='database')
+        n = self._create_test_node()
+
+        calls = self._get_session_calls(self.dbapi.get_node, n['id'])
+        self.assertEqual([mock.call(slave_session=False)], calls)
+
+    def test_slave_reads_no_slave_connection(self):
+        n = self._create_test_node()
+        self.dbapi.set_slave_reads(True)
+        self.addCleanup(self.dbapi.set_slave_reads, False)
+
+        calls = self._get_session_calls(self.dbapi.get_node, n['id'])
+        self.assertEqual([mock.call(slave_session=False)], calls)
+
     def test_get_node_list_with_filters(self):
         ch1 = utils.get_test_chassis(id=1, uuid=ironic_utils.generate_uuid())
         ch2 = utils.get_test_chassis(id=2, uuid=ironic_utils.generate_uuid())
@@ -324,6 +455,20 @@ class DbNodeTestCase(base.DbTestCase):
         res = self.dbapi.update_node(n['id'], {'extra': {'foo': 'bar'}})
         self.assertIsNone(res['provision_updated_at'])
 
+    def test_update_node_uuid(self):
+        n = self._create_test_node()
+        new_uuid = ironic_utils.generate_uuid()
+
+        res = self.dbapi.update_node(n['uuid'], {'uuid': new_uuid})
+        self.assertEqual(new_uuid, res.uuid)
+        self.assertEqual(n['id'], res.id)
+
+    def test_update_node_unchanged(self):
+        n = self._create_test_node()
+
+        res = self.dbapi.update_node(n['id'], {'extra': n['extra']})
+        self.assertEqual(n['extra'], res.extra)
+
     def test_reserve_one_node(self):
         n = self._create_test_node()
         uuid = n['uuid']
@@ -407,6 +552,59 @@ class DbNodeTestCase(base.DbTestCase):
                           self.dbapi.reserve_nodes,
                           r2, uuids[2:])
 
+    def test_reserve_overlaping_ranges_rolls_back(self):
+        uuids = self._create_many_test_nodes()
+
+        self.dbapi.reserve_nodes('first-reservation', uuids[:3])
+        self.assertRaises(exception.NodeLocked,
+                          self.dbapi.reserve_nodes,
+                          'second-reservation', uuids)
+
+        for uuid in uuids[3:]:
+            self.assertIsNone(self.dbapi.get_node(uuid).reservation)
+
+    def test_reserve_missing_node(self):
+        n = self._create_test_node()
+        missing = ironic_utils.generate_uuid()
+
+        self.assertRaises(exception.NodeNotFound,
+                          self.dbapi.reserve_nodes,
+                          'fake-reservation', [n['uuid'], missing])
+        self.assertIsNone(self.dbapi.get_node(n['uuid']).reservation)
+
+    @mock.patch.object(sqla_api, '_check_node_already_locked')
+    def test_reserve_no_diagnostics(self, check_mock):
+        n = self._create_test_node()
+
+        self.dbapi.reserve_nodes('fake-reservation', [n['uuid']])
+        self.assertFalse(check_mock.called)
+
+    def test_reserve_released_meanwhile(self):
+        n = self._create_test_node()
+        results = [None]
+        reserve_nodes = sqla_api._reserve_nodes
+
+        def _reserve(tag, nodes):
+            # the first attempt conflicts with a reservation which is
+            # released before the conflict is diagnosed
+            return results.pop() if results else reserve_nodes(tag, nodes)
+
+        with mock.patch.object(sqla_api, '_reserve_nodes') as reserve_mock:
+            reserve_mock.side_effect = _reserve
+            res = self.dbapi.reserve_nodes('fake-reservation', [n['uuid']])
+        self.assertEqual(2, reserve_mock.call_count)
+        self.assertEqual('fake-reservation', res[0].reservation)
+
+    @mock.patch.object(sqla_api, '_reserve_nodes')
+    def test_reserve_conflict_not_found(self, reserve_mock):
+        n = self._create_test_node()
+        reserve_mock.return_value = None
+
+        self.assertRaises(exception.TemporaryFailure,
+                          self.dbapi.reserve_nodes,
+                          'fake-reservation', [n['uuid']])
+        self.assertEqual(sqla_api._RESERVE_ATTEMPTS, reserve_mock.call_count)
+
     def test_reserve_non_overlaping_ranges(self):
         uuids = self._create_many_test_nodes()
 
@@ -57,6 +57,24 @@ class DbPortTestCase(base.DbTestCase):
         res_uuids = [r.uuid for r in res]
         self.assertEqual(uuids.sort(), res_uuids.sort())
 
+    def test_get_portinfo_list(self):
+        n2 = self.dbapi.create_node(db_utils.get_test_node(id=2,
+                                    uuid=ironic_utils.generate_uuid()))
+        p1 = self.dbapi.create_port(self.p)
+        p2 = self.dbapi.create_port(db_utils.get_test_port(id=2,
+                                    uuid=ironic_utils.generate_uuid(),
+                                    node_id=n2.id,
+                                    address='52:54:00:cf:2d:32'))
+        res = self.dbapi.get_portinfo_list()
+        self.assertEqual(sorted([p1.id, p2.id]), [r[0] for r in res])
+
+        res = self.dbapi.get_portinfo_list(columns=['uuid', 'address'],
+                                           node_id=n2.uuid)
+        self.assertEqual([(p2.uuid, p2.address)], [tuple(r) for r in res])
+
+        self.assertRaises(exception.NodeNotFound,
+                          self.dbapi.get_portinfo_list, node_id=99)
+
     def test_get_port_by_address(self):
         self.dbapi.create_port(self.p)
 
@@ -91,6 +109,21 @@ class DbPortTestCase(base.DbTestCase):
                           self.dbapi.get_ports_by_node,
                           '12345678-9999-0000-aaaa-123456789012')
 
+    def test_get_ports_by_nodes(self):
+        n2 = self.dbapi.create_node(db_utils.get_test_node(id=2,
+                                    uuid=ironic_utils.generate_uuid()))
+        p1 = self.dbapi.create_port(self.p)
+        p2 = self.dbapi.create_port(db_utils.get_test_port(id=2,
+                                    uuid=ironic_utils.generate_uuid(),
+                                    node_id=n2.id,
+                                    address='52:54:00:cf:2d:32'))
+        res = self.dbapi.get_ports_by_nodes([self.n.id, n2.id])
+        self.assertEqual(sorted([p1.id, p2.id]), [r.id for r in res])
+        res = self.dbapi.get_ports_by_nodes([n2.id])
+        self.assertEqual([p2.id], [r.id for r in res])
+        self.assertEqual([], self.dbapi.get_ports_by_nodes([99]))
+        self.assertEqual([], self.dbapi.get_ports_by_nodes([]))
+
     def test_destroy_port(self):
         self.dbapi.create_port(self.p)
         self.dbapi.destroy_port(self.p['id'])
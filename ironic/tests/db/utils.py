@@ -64,6 +64,7 @@ def get_test_node(**kw):
                                          states.NOSTATE),
         'provision_updated_at': kw.get('provision_updated_at'),
         'last_error': kw.get('last_error'),
+        'deploy_progress': kw.get('deploy_progress'),
         'instance_uuid': kw.get('instance_uuid'),
         'driver': kw.get('driver', 'fake'),
         'driver_info': kw.get('driver_info', fake_info),
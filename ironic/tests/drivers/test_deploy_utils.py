@@ -14,10 +14,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import eventlet
 import fixtures
 import mock
 import os
+import struct
 import tempfile
+import time
 
 from ironic.common import exception
 from ironic.drivers.modules import deploy_utils as utils
@@ -91,8 +94,8 @@ class PhysicalWorkTestCase(tests_base.TestCase):
 
         name_list = ['get_dev', 'get_image_mb', 'discovery', 'login_iscsi',
                      'logout_iscsi', 'delete_iscsi', 'make_partitions',
-                     'is_block_device', 'dd', 'mkswap', 'block_uuid',
-                     'switch_pxe_config', 'notify']
+                     'is_block_device', 'copy_image', 'mkswap',
+                     'block_uuid', 'switch_pxe_config', 'notify']
         parent_mock = self._mock_calls(name_list)
         parent_mock.get_dev.return_value = dev
         parent_mock.get_image_mb.return_value = 1
@@ -107,7 +110,8 @@ class PhysicalWorkTestCase(tests_base.TestCase):
                                                     ephemeral_mb),
                           mock.call.is_block_device(root_part),
                           mock.call.is_block_device(swap_part),
-                          mock.call.dd(image_path, root_part),
+                          mock.call.copy_image(image_path, root_part,
+                                               mock.ANY),
                           mock.call.mkswap(swap_part),
                           mock.call.block_uuid(root_part),
                           mock.call.logout_iscsi(address, port, iqn),
@@ -121,6 +125,37 @@ class PhysicalWorkTestCase(tests_base.TestCase):
 
         self.assertEqual(calls_expected, parent_mock.mock_calls)
 
+    def test_deploy_progress(self):
+        name_list = ['get_dev', 'get_image_mb', 'discovery', 'login_iscsi',
+                     'logout_iscsi', 'delete_iscsi', 'make_partitions',
+                     'is_block_device', 'copy_image', 'mkswap',
+                     'block_uuid', 'switch_pxe_config', 'notify']
+        parent_mock = self._mock_calls(name_list)
+        parent_mock.get_dev.return_value = '/dev/fake'
+        parent_mock.get_image_mb.return_value = 1
+        parent_mock.is_block_device.return_value = True
+
+        def _copy_image(src, dst, callback):
+            callback(1024, 1024)
+
+        parent_mock.copy_image.side_effect = _copy_image
+        callback = mock.Mock()
+        progress = utils.DeployProgress(callback)
+
+        utils.deploy('127.0.0.1', 3306, 'iqn.xyz', 1, '/tmp/xyz/image',
+                     '/tmp/abc/pxeconfig', 128, 64, 0, None,
+                     progress=progress)
+
+        self.assertEqual(['discovery', 'login_iscsi', 'make_partitions',
+                          'copy_image', 'mkswap', 'block_uuid',
+                          'logout_iscsi', 'switch_pxe_config', 'notify'],
+                         [phase['name'] for phase in progress.phases])
+        self.assertEqual(1024, progress.bytes_copied)
+        self.assertEqual(1024, progress.bytes_total)
+        self.assertIsNone(progress.phase)
+        # the end of each phase and the end of the copy are reported
+        self.assertEqual(10, callback.call_count)
+
     def test_deploy_with_ephemeral(self):
         """Check loosely all functions are called with right args."""
         address = '127.0.0.1'
@@ -142,8 +177,9 @@ class PhysicalWorkTestCase(tests_base.TestCase):
 
         name_list = ['get_dev', 'get_image_mb', 'discovery', 'login_iscsi',
                      'logout_iscsi', 'delete_iscsi', 'make_partitions',
-                     'is_block_device', 'dd', 'mkswap', 'block_uuid',
-                     'switch_pxe_config', 'notify', 'mkfs_ephemeral']
+                     'is_block_device', 'copy_image', 'mkswap',
+                     'block_uuid', 'switch_pxe_config', 'notify',
+                     'mkfs_ephemeral']
         parent_mock = self._mock_calls(name_list)
         parent_mock.get_dev.return_value = dev
         parent_mock.get_image_mb.return_value = 1
@@ -159,7 +195,8 @@ class PhysicalWorkTestCase(tests_base.TestCase):
                           mock.call.is_block_device(root_part),
                           mock.call.is_block_device(swap_part),
                           mock.call.is_block_device(ephemeral_part),
-                          mock.call.dd(image_path, root_part),
+                          mock.call.copy_image(image_path, root_part,
+                                               mock.ANY),
                           mock.call.mkswap(swap_part),
                           mock.call.mkfs_ephemeral(ephemeral_part,
                                                    ephemeral_format),
@@ -199,8 +236,8 @@ class PhysicalWorkTestCase(tests_base.TestCase):
 
         name_list = ['get_dev', 'get_image_mb', 'discovery', 'login_iscsi',
                      'logout_iscsi', 'delete_iscsi', 'make_partitions',
-                     'is_block_device', 'dd', 'mkswap', 'block_uuid',
-                     'switch_pxe_config', 'notify']
+                     'is_block_device', 'copy_image', 'mkswap',
+                     'block_uuid', 'switch_pxe_config', 'notify']
         parent_mock = self._mock_calls(name_list)
         parent_mock.get_dev.return_value = dev
         parent_mock.get_image_mb.return_value = 1
@@ -216,7 +253,8 @@ class PhysicalWorkTestCase(tests_base.TestCase):
                           mock.call.is_block_device(root_part),
                           mock.call.is_block_device(swap_part),
                           mock.call.is_block_device(ephemeral_part),
-                          mock.call.dd(image_path, root_part),
+                          mock.call.copy_image(image_path, root_part,
+                                               mock.ANY),
                           mock.call.mkswap(swap_part),
                           mock.call.block_uuid(root_part),
                           mock.call.logout_iscsi(address, port, iqn),
@@ -276,7 +314,7 @@ class PhysicalWorkTestCase(tests_base.TestCase):
                           mock.call.work_on_disk(dev, root_mb, swap_mb,
                                                  ephemeral_mb,
                                                  ephemeral_format, image_path,
-                                                 False),
+                                                 False, mock.ANY),
                           mock.call.logout_iscsi(address, port, iqn),
                           mock.call.delete_iscsi(address, port, iqn)]
 
@@ -304,6 +342,162 @@ class SwitchPxeConfigTestCase(tests_base.TestCase):
         self.assertEqual(pxeconf, _PXECONF_BOOT)
 
 
+class DeployProgressTestCase(tests_base.TestCase):
+
+    def test_measure(self):
+        callback = mock.Mock()
+        progress = utils.DeployProgress(callback)
+
+        with progress.measure('phase'):
+            self.assertEqual('phase', progress.phase)
+        self.assertRaises(exception.InstanceDeployFailure, self._fail,
+                          progress)
+
+        phases = [{'name': 'phase', 'duration': mock.ANY},
+                  {'name': 'failing', 'duration': mock.ANY}]
+        self.assertEqual({'phase': None, 'phases': phases,
+                          'bytes_copied': 0, 'bytes_total': 0},
+                         progress.as_dict())
+        self.assertEqual(2, callback.call_count)
+
+    def _fail(self, progress):
+        with progress.measure('failing'):
+            raise exception.InstanceDeployFailure('fake')
+
+    @mock.patch.object(utils.time, 'time')
+    def test_copy_progress(self, time_mock):
+        self.config(copy_progress_interval=30, group='deploy')
+        time_mock.return_value = 1000
+        callback = mock.Mock()
+        progress = utils.DeployProgress(callback)
+
+        progress.copy_progress(10, 100)
+        self.assertFalse(callback.called)
+        time_mock.return_value = 1030
+        progress.copy_progress(20, 100)
+        progress.copy_progress(30, 100)
+        self.assertEqual(1, callback.call_count)
+        progress.copy_progress(100, 100)
+        self.assertEqual(2, callback.call_count)
+        self.assertEqual(100, progress.bytes_copied)
+
+
+class CopyImageTestCase(tests_base.TestCase):
+
+    def setUp(self):
+        super(CopyImageTestCase, self).setUp()
+        self.config(copy_block_size=1, group='deploy')
+        temp_dir = tempfile.mkdtemp()
+        self.src = os.path.join(temp_dir, 'image')
+        self.dst = os.path.join(temp_dir, 'device')
+        mb = 1024 * 1024
+        # data, a hole, a block of zeros, data and an unaligned end
+        with open(self.src, 'wb') as f:
+            f.write('a' * 4096)
+            f.seek(4 * mb)
+            f.write('\x00' * mb)
+            f.write('b' * 100)
+        self.size = 5 * mb + 100
+        with open(self.dst, 'wb') as f:
+            f.write('x' * (self.size + 10))
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_data_extents(self):
+        fd = os.open(self.src, os.O_RDONLY)
+        try:
+            extents = list(utils._data_extents(fd, self.size))
+        finally:
+            os.close(fd)
+        self.assertEqual(0, extents[0][0])
+        self.assertEqual(self.size, sum(extents[-1]))
+        self.assertTrue(sum(length for start, length in extents)
+                        <= self.size)
+
+    @mock.patch.object(utils, '_data_extents')
+    def test_copy_image_hole_at_end(self, extents_mock):
+        extents_mock.return_value = [(0, 4096)]
+        utils.copy_image(self.src, self.dst)
+        self.assertEqual('a' * 4096 + '\x00' * (self.size - 4096) + 'x' * 10,
+                         self._read(self.dst))
+
+    def test_copy_image(self):
+        callback = mock.Mock()
+
+        stats = utils.copy_image(self.src, self.dst, callback)
+        self.assertEqual(self._read(self.src) + 'x' * 10,
+                         self._read(self.dst))
+        self.assertEqual(self.size, stats['size'])
+        self.assertEqual(4096 + 100, stats['written'])
+        self.assertEqual(self.size - 4096 - 100, stats['zeroed'])
+        callback.assert_called_with(self.size, self.size)
+
+    def test_copy_image_concurrent(self):
+        dst2 = self.dst + '2'
+        with open(dst2, 'wb') as f:
+            f.write('x' * (self.size + 10))
+        sleep = eventlet.patcher.original('time').sleep
+        write = os.write
+        writes = {'current': 0, 'max': 0}
+
+        def slow_write(fd, data):
+            if not isinstance(data, buffer):
+                return write(fd, data)
+            writes['current'] += 1
+            writes['max'] = max(writes['max'], writes['current'])
+            try:
+                # a slow write to an iSCSI device
+                sleep(0.2)
+                return write(fd, data)
+            finally:
+                writes['current'] -= 1
+
+        ticks = []
+
+        def ticker():
+            while True:
+                ticks.append(time.time())
+                eventlet.sleep(0.01)
+
+        with mock.patch.object(os, 'write', side_effect=slow_write):
+            ticker_thread = eventlet.spawn(ticker)
+            copies = [eventlet.spawn(utils.copy_image, self.src, dst)
+                      for dst in (self.dst, dst2)]
+            for copy in copies:
+                copy.wait()
+            ticker_thread.kill()
+
+        for dst in (self.dst, dst2):
+            self.assertEqual(self._read(self.src) + 'x' * 10,
+                             self._read(dst))
+        # both copies wrote at the same time, and the hub kept running
+        self.assertEqual(2, writes['max'])
+        self.assertTrue(max(b - a for a, b in zip(ticks, ticks[1:])) < 0.15)
+
+    @mock.patch('fcntl.ioctl')
+    def test_logical_block_size(self, ioctl_mock):
+        ioctl_mock.return_value = struct.pack('i', 4096)
+        self.assertEqual(4096, utils._logical_block_size(42))
+        ioctl_mock.assert_called_once_with(42, utils._BLKSSZGET, mock.ANY)
+
+    def test_logical_block_size_not_a_device(self):
+        fd = os.open(self.dst, os.O_RDONLY)
+        try:
+            self.assertEqual(512, utils._logical_block_size(fd))
+        finally:
+            os.close(fd)
+
+    @mock.patch.object(utils, 'dd')
+    def test_copy_image_dd(self, dd_mock):
+        self.config(sparse_copy=False, group='deploy')
+
+        stats = utils.copy_image(self.src, self.dst)
+        dd_mock.assert_called_once_with(self.src, self.dst)
+        self.assertEqual(self.size, stats['written'])
+
+
 class OtherFunctionTestCase(tests_base.TestCase):
     def test_get_dev(self):
         expected = '/dev/disk/by-path/ip-1.2.3.4:5678-iscsi-iqn.fake-lun-9'
@@ -0,0 +1,115 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Test class for the master image cache."""
+
+import os
+import tempfile
+import time
+
+from ironic.drivers.modules import image_cache
+from ironic.tests import base
+
+
+class ImageCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(ImageCacheTestCase, self).setUp()
+        self.master_dir = tempfile.mkdtemp()
+        self.cache = image_cache.ImageCache(self.master_dir)
+        self.now = time.time()
+
+    def _create_master(self, name, size_kib, age, in_use=False):
+        path = os.path.join(self.master_dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size_kib * 1024)
+        mtime = self.now - age
+        os.utime(path, (mtime, mtime))
+        if in_use:
+            os.link(path, path + '-link')
+        return path
+
+    def test_clean_up_keeps_images(self):
+        self.config(image_cache_size=1, image_cache_ttl=60, group='pxe')
+        path = self._create_master('image', 64, 60)
+
+        self.cache.clean_up()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(0, self.cache.stats['evictions'])
+
+    def test_clean_up_ttl(self):
+        self.config(image_cache_size=1, image_cache_ttl=1, group='pxe')
+        old = self._create_master('old', 4, 61)
+        new = self._create_master('new', 4, 30)
+
+        self.cache.clean_up()
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(1, self.cache.stats['evictions'])
+
+    def test_clean_up_lru(self):
+        self.config(image_cache_size=1, image_cache_ttl=0, group='pxe')
+        oldest = self._create_master('oldest', 512, 300)
+        older = self._create_master('older', 512, 200)
+        newest = self._create_master('newest', 512, 100)
+
+        self.cache.clean_up()
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(older))
+        self.assertTrue(os.path.exists(newest))
+        self.assertEqual(1, self.cache.stats['evictions'])
+        self.assertTrue(self.cache.stats['size'] <= 1024 * 1024)
+
+    def test_clean_up_keeps_used_and_temporary_files(self):
+        self.config(image_cache_size=0, image_cache_ttl=0, group='pxe')
+        used = self._create_master('used', 4, 100, in_use=True)
+        part = self._create_master('tmpabc.part', 4, 100)
+        lock = self._create_master('image.lock', 0, 100)
+        unused = self._create_master('unused', 4, 100)
+
+        self.cache.clean_up()
+        self.assertTrue(os.path.exists(used))
+        self.assertTrue(os.path.exists(part))
+        self.assertTrue(os.path.exists(lock))
+        self.assertFalse(os.path.exists(unused))
+
+    def test_record_hit(self):
+        path = self._create_master('image', 4, 3600)
+
+        self.cache.record_hit(path)
+        self.cache.record_miss()
+        self.assertTrue(os.stat(path).st_mtime > self.now - 60)
+        self.assertEqual(1, self.cache.stats['hits'])
+        self.assertEqual(1, self.cache.stats['misses'])
+
+    def test_get_cache(self):
+        cache = image_cache.get_cache(self.master_dir)
+        self.assertIs(cache, image_cache.get_cache(self.master_dir))
+        cache.record_miss()
+        self.assertEqual(1, image_cache.get_stats()[self.master_dir]['misses'])
+
+    def test_clean_up_checksums(self):
+        self.config(image_cache_size=0, image_cache_ttl=0, group='pxe')
+        used = self._create_master('used', 4, 100, in_use=True)
+        unused = self._create_master('unused', 4, 100)
+        image_cache.write_checksum(used, 'used-checksum')
+        image_cache.write_checksum(unused, 'unused-checksum')
+        orphan = self._create_master('orphan.md5', 0, 100)
+
+        self.cache.clean_up()
+        self.assertEqual('used-checksum', image_cache.read_checksum(used))
+        self.assertIsNone(image_cache.read_checksum(unused))
+        self.assertFalse(os.path.exists(unused + '.md5'))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertEqual(1, self.cache.stats['evictions'])
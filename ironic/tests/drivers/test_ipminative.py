@@ -32,6 +32,7 @@ from ironic.tests.conductor import utils as mgr_utils
 from ironic.tests.db import base as db_base
 from ironic.tests.db import utils as db_utils
 from oslo.config import cfg
+from pyghmi import exceptions as pyghmi_exception
 
 CONF = cfg.CONF
 
@@ -52,6 +53,8 @@ class IPMINativePrivateMethodTestCase(base.TestCase):
         ipmi_patch = mock.patch('pyghmi.ipmi.command.Command')
         self.ipmi_mock = ipmi_patch.start()
         self.addCleanup(ipmi_patch.stop)
+        self.config(session_keepalive_interval=0, group='ipmi')
+        self.addCleanup(ipminative._session_cache.clear)
 
     def test__parse_driver_info(self):
         # make sure we get back the expected things
@@ -97,29 +100,148 @@ class IPMINativePrivateMethodTestCase(base.TestCase):
         ipmicmd = self.ipmi_mock.return_value
         ipmicmd.set_power.return_value = {'powerstate': 'on'}
 
-        self.config(retry_timeout=400, group='ipmi')
         state = ipminative._power_on(self.info)
-        ipmicmd.set_power.assert_called_once_with('on', 400)
+        ipmicmd.set_power.assert_called_once_with('on')
         self.assertEqual(state, states.POWER_ON)
 
     def test__power_off(self):
         ipmicmd = self.ipmi_mock.return_value
         ipmicmd.set_power.return_value = {'powerstate': 'off'}
 
-        self.config(retry_timeout=500, group='ipmi')
         state = ipminative._power_off(self.info)
-        ipmicmd.set_power.assert_called_once_with('off', 500)
+        ipmicmd.set_power.assert_called_once_with('off')
         self.assertEqual(state, states.POWER_OFF)
 
     def test__reboot(self):
         ipmicmd = self.ipmi_mock.return_value
-        ipmicmd.set_power.return_value = {'powerstate': 'on'}
+        ipmicmd.set_power.return_value = {'pendingpowerstate': 'reset'}
+        ipmicmd.get_power.return_value = {'powerstate': 'on'}
 
-        self.config(retry_timeout=600, group='ipmi')
         state = ipminative._reboot(self.info)
-        ipmicmd.set_power.assert_called_once_with('boot', 600)
+        ipmicmd.set_power.assert_called_once_with('boot')
+        self.assertEqual(state, states.POWER_ON)
+
+    def test__power_on_wait(self):
+        self.config(power_wait_initial_interval=0.01, group='conductor')
+        ipmicmd = self.ipmi_mock.return_value
+        ipmicmd.set_power.return_value = {'pendingpowerstate': 'on'}
+        ipmicmd.get_power.side_effect = [{'powerstate': 'off'},
+                                         {'powerstate': 'on'}]
+
+        state = ipminative._power_on(self.info)
+        ipmicmd.set_power.assert_called_once_with('on')
+        self.assertEqual(2, ipmicmd.get_power.call_count)
         self.assertEqual(state, states.POWER_ON)
 
+    def test__power_off_timeout(self):
+        ipmicmd = self.ipmi_mock.return_value
+        ipmicmd.set_power.return_value = {'pendingpowerstate': 'off'}
+        ipmicmd.get_power.return_value = {'powerstate': 'on'}
+
+        self.config(retry_timeout=0, group='ipmi')
+        self.assertRaises(exception.PowerStateFailure,
+                          ipminative._power_off, self.info)
+        ipmicmd.get_power.assert_called_once_with()
+
+
+class IPMISessionCacheTestCase(base.TestCase):
+    """Test cases for ipminative.IPMISessionCache."""
+
+    def setUp(self):
+        super(IPMISessionCacheTestCase, self).setUp()
+        self.info = {'address': '1.2.3.4', 'username': 'admin',
+                     'password': 'fake', 'uuid': 'fake-uuid'}
+        ipmi_patch = mock.patch('pyghmi.ipmi.command.Command')
+        self.ipmi_mock = ipmi_patch.start()
+        self.addCleanup(ipmi_patch.stop)
+        self.ipmi_mock.side_effect = lambda **kw: mock.Mock()
+        self.config(session_keepalive_interval=0, group='ipmi')
+        self.cache = ipminative.IPMISessionCache()
+        self.addCleanup(self.cache.clear)
+
+    def _get(self, info=None):
+        with self.cache.session(info or self.info) as ipmicmd:
+            return ipmicmd
+
+    def test_session_reused(self):
+        ipmicmd = self._get()
+        self.assertIs(ipmicmd, self._get())
+        self.ipmi_mock.assert_called_once_with(bmc='1.2.3.4', userid='admin',
+                                               password='fake')
+
+    def test_session_per_credentials(self):
+        ipmicmd = self._get()
+        other = self._get(dict(self.info, password='other'))
+        self.assertIsNot(ipmicmd, other)
+        self.assertEqual(2, self.ipmi_mock.call_count)
+
+    def test_session_no_cache(self):
+        self.config(session_idle_timeout=0, group='ipmi')
+        self.assertIsNot(self._get(), self._get())
+        self.assertEqual(2, self.ipmi_mock.call_count)
+
+    def test_session_dropped_on_failure(self):
+        def fail():
+            with self.cache.session(self.info):
+                raise pyghmi_exception.IpmiException('timeout')
+
+        ipmicmd = self._get()
+        self.assertRaises(pyghmi_exception.IpmiException, fail)
+        ipmicmd.ipmi_session.logout.assert_called_once_with()
+        self.assertIsNot(ipmicmd, self._get())
+
+    @mock.patch.object(ipminative.time, 'time')
+    def test_expire(self, mock_time):
+        self.config(session_idle_timeout=60, group='ipmi')
+        mock_time.return_value = 1000
+        ipmicmd = self._get()
+
+        mock_time.return_value = 1059
+        self.cache.expire()
+        self.assertFalse(ipmicmd.ipmi_session.logout.called)
+        mock_time.return_value = 1060
+        self.cache.expire()
+        ipmicmd.ipmi_session.logout.assert_called_once_with()
+        self.assertIsNot(ipmicmd, self._get())
+
+    @mock.patch.object(ipminative.time, 'time')
+    def test_keepalive(self, mock_time):
+        self.config(session_keepalive_interval=20, session_idle_timeout=60,
+                    group='ipmi')
+        mock_time.return_value = 1000
+        ipmicmd = self._get()
+        ipmicmd.raw_command.return_value = {'data': []}
+
+        mock_time.return_value = 1010
+        self.cache.keepalive()
+        self.assertFalse(ipmicmd.raw_command.called)
+        mock_time.return_value = 1020
+        self.cache.keepalive()
+        ipmicmd.raw_command.assert_called_once_with(netfn=6, command=1)
+        self.assertIs(ipmicmd, self._get())
+
+    @mock.patch.object(ipminative.time, 'time')
+    def test_keepalive_failed(self, mock_time):
+        self.config(session_keepalive_interval=20, session_idle_timeout=60,
+                    group='ipmi')
+        mock_time.return_value = 1000
+        ipmicmd = self._get()
+        ipmicmd.raw_command.return_value = {'error': 'timeout'}
+
+        mock_time.return_value = 1030
+        self.cache.keepalive()
+        ipmicmd.ipmi_session.logout.assert_called_once_with()
+        self.assertIsNot(ipmicmd, self._get())
+
+    def test_keepalive_started(self):
+        self.config(session_keepalive_interval=20, group='ipmi')
+        with mock.patch.object(ipminative.loopingcall,
+                               'FixedIntervalLoopingCall') as timer_mock:
+            self._get()
+            self._get()
+        timer_mock.return_value.start.assert_called_once_with(
+                                            interval=20, initial_delay=20)
+
 
 class IPMINativeDriverTestCase(db_base.DbTestCase):
     """Test cases for ipminative.NativeIPMIPower class functions.
@@ -137,6 +259,8 @@ class IPMINativeDriverTestCase(db_base.DbTestCase):
         self.dbapi = db_api.get_instance()
         self.node = self.dbapi.create_node(n)
         self.info = ipminative._parse_driver_info(self.node)
+        self.config(session_keepalive_interval=0, group='ipmi')
+        self.addCleanup(ipminative._session_cache.clear)
 
     def test_get_power_state(self):
         with mock.patch('pyghmi.ipmi.command.Command') as ipmi_mock:
@@ -188,7 +312,7 @@ class IPMINativeDriverTestCase(db_base.DbTestCase):
             ipmicmd = ipmi_mock.return_value
             ipmicmd.set_power.return_value = {'powerstate': 'error'}
 
-            self.config(retry_timeout=500, group='ipmi')
+            self.config(retry_timeout=0, group='ipmi')
             with task_manager.acquire(self.context,
                                      [self.node['uuid']]) as task:
                 self.assertRaises(exception.PowerStateFailure,
@@ -196,7 +320,7 @@ class IPMINativeDriverTestCase(db_base.DbTestCase):
                                   task,
                                   self.node,
                                   states.POWER_ON)
-            ipmicmd.set_power.assert_called_once_with('on', 500)
+            ipmicmd.set_power.assert_called_once_with('on')
 
     def test_set_boot_device_ok(self):
         with mock.patch('pyghmi.ipmi.command.Command') as ipmi_mock:
@@ -232,14 +356,14 @@ class IPMINativeDriverTestCase(db_base.DbTestCase):
             ipmicmd = ipmi_mock.return_value
             ipmicmd.set_power.return_value = {'powerstate': 'error'}
 
-            self.config(retry_timeout=500, group='ipmi')
+            self.config(retry_timeout=0, group='ipmi')
             with task_manager.acquire(self.context,
                                      [self.node['uuid']]) as task:
                 self.assertRaises(exception.PowerStateFailure,
                                   self.driver.power.reboot,
                                   task,
                                   self.node)
-            ipmicmd.set_power.assert_called_once_with('boot', 500)
+            ipmicmd.set_power.assert_called_once_with('boot')
 
     def test_vendor_passthru_validate__set_boot_device_good(self):
         self.driver.vendor.validate(self.node,
@@ -31,6 +31,7 @@ from ironic.common import states
 from ironic.common import utils
 from ironic.conductor import task_manager
 from ironic.db import api as db_api
+from ironic.drivers.modules import ipminative
 from ironic.drivers.modules import ipmitool as ipmi
 from ironic.openstack.common import context
 from ironic.openstack.common import processutils
@@ -240,7 +241,7 @@ class IPMIToolPrivateMethodTestCase(base.TestCase):
             mock_exec.assert_called_once_with(self.info, "power status")
 
     def test__power_on_max_retries(self):
-        self.config(retry_timeout=2, group='ipmi')
+        self.config(retry_timeout=0, group='ipmi')
 
         def side_effect(driver_info, command):
             resp_dict = {"power status": ["Chassis Power is off\n", None],
@@ -253,8 +254,6 @@ class IPMIToolPrivateMethodTestCase(base.TestCase):
 
             expected = [mock.call(self.info, "power status"),
                         mock.call(self.info, "power on"),
-                        mock.call(self.info, "power status"),
-                        mock.call(self.info, "power status"),
                         mock.call(self.info, "power status")]
 
             state = ipmi._power_on(self.info)
@@ -262,6 +261,71 @@ class IPMIToolPrivateMethodTestCase(base.TestCase):
             self.assertEqual(mock_exec.call_args_list, expected)
             self.assertEqual(state, states.ERROR)
 
+    def test__power_off_wait(self):
+        self.config(power_wait_initial_interval=0.01, group='conductor')
+        status = [["Chassis Power is on\n", None],
+                  ["Chassis Power is on\n", None],
+                  ["Chassis Power is off\n", None]]
+
+        def side_effect(driver_info, command):
+            if command == "power status":
+                return status.pop(0)
+            return [None, None]
+
+        with mock.patch.object(ipmi, '_exec_ipmitool',
+                               autospec=True) as mock_exec:
+            mock_exec.side_effect = side_effect
+
+            expected = [mock.call(self.info, "power status"),
+                        mock.call(self.info, "power off"),
+                        mock.call(self.info, "power status"),
+                        mock.call(self.info, "power status")]
+
+            state = ipmi._power_off(self.info)
+
+            self.assertEqual(mock_exec.call_args_list, expected)
+            self.assertEqual(state, states.POWER_OFF)
+
+    def test__use_native_power(self):
+        self.assertFalse(ipmi._use_native_power(self.info))
+        self.config(native_power=True, group='ipmi')
+        self.assertTrue(ipmi._use_native_power(self.info))
+
+        info = dict(self.info, priv_level='OPERATOR')
+        self.assertFalse(ipmi._use_native_power(info))
+        info = dict(self.info, password=None)
+        self.assertFalse(ipmi._use_native_power(info))
+
+    @mock.patch.object(ipminative, '_power_status')
+    @mock.patch.object(ipmi, '_exec_ipmitool')
+    def test__power_status_native(self, mock_exec, mock_status):
+        self.config(native_power=True, group='ipmi')
+        mock_status.return_value = states.POWER_ON
+
+        self.assertEqual(states.POWER_ON, ipmi._power_status(self.info))
+        mock_status.assert_called_once_with(self.info)
+        self.assertFalse(mock_exec.called)
+
+    @mock.patch.object(ipminative, '_power_on')
+    @mock.patch.object(ipmi, '_exec_ipmitool')
+    def test__power_on_native(self, mock_exec, mock_on):
+        self.config(native_power=True, group='ipmi')
+        mock_on.return_value = states.POWER_ON
+
+        self.assertEqual(states.POWER_ON, ipmi._power_on(self.info))
+        mock_on.assert_called_once_with(self.info)
+        self.assertFalse(mock_exec.called)
+
+    @mock.patch.object(ipminative, '_power_off')
+    @mock.patch.object(ipmi, '_exec_ipmitool')
+    def test__power_off_native_fail(self, mock_exec, mock_off):
+        self.config(native_power=True, group='ipmi')
+        mock_off.side_effect = exception.PowerStateFailure(pstate='on')
+
+        self.assertEqual(states.ERROR, ipmi._power_off(self.info))
+        mock_off.assert_called_once_with(self.info)
+        self.assertFalse(mock_exec.called)
+
 
 class IPMIToolDriverTestCase(db_base.DbTestCase):
 
@@ -17,29 +17,34 @@
 
 """Test class for PXE driver."""
 
+import datetime
+import eventlet
 import fixtures
 import mock
 import os
 import tempfile
-import threading
-import time
 
 from oslo.config import cfg
 
 from ironic.common import exception
 from ironic.common.glance_service import base_image_service
+from ironic.common.glance_service import metadata_cache
 from ironic.common.glance_service import service_utils
 from ironic.common import images
+from ironic.common import keystone
 from ironic.common import neutron
 from ironic.common import states
 from ironic.common import utils
 from ironic.conductor import task_manager
 from ironic.conductor import utils as manager_utils
 from ironic.db import api as dbapi
+from ironic.drivers.modules import deploy_utils
+from ironic.drivers.modules import image_cache
 from ironic.drivers.modules import pxe
 from ironic.openstack.common import context
 from ironic.openstack.common import fileutils
 from ironic.openstack.common import jsonutils as json
+from ironic.openstack.common import timeutils
 from ironic.tests import base
 from ironic.tests.conductor import utils as mgr_utils
 from ironic.tests.db import base as db_base
@@ -48,6 +53,8 @@ from ironic.tests.db import utils as db_utils
 
 CONF = cfg.CONF
 
+FETCH_INFO = {'size': 0, 'checksum': None}
+
 INFO_DICT = db_utils.get_test_pxe_info()
 
 
@@ -188,12 +195,20 @@ class PXEValidateParametersTestCase(base.TestCase):
         self.assertEqual(os.stat(dest_path).st_nlink, 2)
 
     def test__unlink_master_image(self):
+        self.config(image_cache_size=0, group='pxe')
         temp_dir = tempfile.mkdtemp()
         orig_path = os.path.join(temp_dir, 'orig_path')
         open(orig_path, 'w').close()
         pxe._unlink_master_image(orig_path)
         self.assertFalse(os.path.exists(orig_path))
 
+    def test__unlink_master_image_cached(self):
+        temp_dir = tempfile.mkdtemp()
+        orig_path = os.path.join(temp_dir, 'orig_path')
+        open(orig_path, 'w').close()
+        pxe._unlink_master_image(orig_path)
+        self.assertTrue(os.path.exists(orig_path))
+
     def test__create_master_image(self):
         temp_dir = tempfile.mkdtemp()
         master_path = os.path.join(temp_dir, 'master_path')
@@ -206,50 +221,89 @@ class PXEValidateParametersTestCase(base.TestCase):
         self.assertFalse(os.path.exists(tmp_path))
         self.assertEqual(os.stat(master_path).st_nlink, 2)
 
-    def test__download_in_progress(self):
+    def _get_images_concurrently(self, master_path, paths):
+        results = {}
+
+        def _get_image(path):
+            try:
+                pxe._get_image(None, path, 'image_uuid', master_path)
+                results[path] = None
+            except Exception as e:
+                results[path] = e
+
+        threads = [eventlet.spawn(_get_image, path) for path in paths]
+        for thread in threads:
+            thread.wait()
+        return results
+
+    def test__get_image_single_flight(self):
         temp_dir = tempfile.mkdtemp()
-        lock_file = os.path.join(temp_dir, 'lock_file')
-        self.assertFalse(pxe._download_in_progress(lock_file))
-        self.assertTrue(os.path.exists(lock_file))
-
-    def test__download_in_progress_wait(self):
-        try:
-            self.config(auth_strategy='keystone')
-        except Exception:
-            opts = [
-                cfg.StrOpt('auth_strategy', default='keystone'),
-                ]
-            CONF.register_opts(opts)
-
-        ctx = context.RequestContext(auth_token=True)
-        uuid = 'node_uuid'
+        master_path = os.path.join(temp_dir, 'master_path')
+        paths = [os.path.join(temp_dir, 'instance_%d' % i) for i in range(3)]
+
+        def _fetch_to_raw(ctx, uuid, tmp_path, image_service):
+            eventlet.sleep(0.01)
+            return FETCH_INFO
+
+        with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
+            fetch_to_raw_mock.side_effect = _fetch_to_raw
+            results = self._get_images_concurrently(master_path, paths)
+
+            fetch_to_raw_mock.assert_called_once_with(None, 'image_uuid',
+                                                      mock.ANY, None)
+        self.assertEqual(dict((path, None) for path in paths), results)
+        self.assertEqual(4, os.stat(os.path.join(master_path,
+                                                 'image_uuid')).st_nlink)
+        self.assertEqual({}, pxe._downloads)
+
+    def test__get_image_single_flight_failure(self):
         temp_dir = tempfile.mkdtemp()
         master_path = os.path.join(temp_dir, 'master_path')
-        instance_path = os.path.join(temp_dir, 'instance_path')
-        os.mkdir(master_path)
-        os.mkdir(instance_path)
-        lock_file = os.path.join(master_path, 'node_uuid.lock')
-        open(lock_file, 'w').close()
-
-        class handler_deploying(threading.Thread):
-            def __init__(self, lock_file):
-                threading.Thread.__init__(self)
-                self.lock_file = lock_file
-
-            def run(self):
-                time.sleep(2)
-                open(os.path.join(master_path, 'node_uuid'), 'w').close()
-                pxe._remove_download_in_progress_lock(self.lock_file)
-
-        handler = handler_deploying(lock_file)
-        handler.start()
-        pxe._get_image(ctx, os.path.join(instance_path, 'node_uuid'),
-                       uuid, master_path)
-        self.assertFalse(os.path.exists(lock_file))
-        self.assertTrue(os.path.exists(os.path.join(instance_path,
-                                                    'node_uuid')))
-        self.assertEqual(os.stat(os.path.join(master_path, 'node_uuid')).
-                             st_nlink, 2)
+        paths = [os.path.join(temp_dir, 'instance_%d' % i) for i in range(2)]
+
+        def _fetch_to_raw(ctx, uuid, tmp_path, image_service):
+            eventlet.sleep(0.01)
+            raise exception.ImageNotFound(image_id=uuid)
+
+        with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
+            fetch_to_raw_mock.side_effect = _fetch_to_raw
+            results = self._get_images_concurrently(master_path, paths)
+
+            self.assertEqual(1, fetch_to_raw_mock.call_count)
+        for path in paths:
+            self.assertIsInstance(results[path], exception.ImageNotFound)
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual([], os.listdir(master_path))
+        self.assertEqual({}, pxe._downloads)
+
+    def test__get_image_wait_timeout(self):
+        self.config(image_download_timeout=1, group='pxe')
+        temp_dir = tempfile.mkdtemp()
+        master_uuid = os.path.join(temp_dir, 'image_uuid')
+        self.useFixture(fixtures.MonkeyPatch(
+                'ironic.drivers.modules.pxe._downloads',
+                {master_uuid: eventlet.event.Event()}))
+
+        with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
+            self.assertRaises(exception.ImageDownloadFailed,
+                              pxe._get_image, None,
+                              os.path.join(temp_dir, 'instance'),
+                              'image_uuid', temp_dir)
+            self.assertFalse(fetch_to_raw_mock.called)
+
+    def test__remove_stale_downloads(self):
+        temp_dir = tempfile.mkdtemp()
+        self.config(tftp_master_path=os.path.join(temp_dir, 'tftp'),
+                    instance_master_path=os.path.join(temp_dir, 'instance'),
+                    group='pxe')
+        os.mkdir(CONF.pxe.tftp_master_path)
+        names = ['image_uuid', 'image_uuid.lock', 'tmpabc.part']
+        for name in names:
+            open(os.path.join(CONF.pxe.tftp_master_path, name), 'w').close()
+
+        pxe._remove_stale_downloads()
+        self.assertEqual(['image_uuid'],
+                         os.listdir(CONF.pxe.tftp_master_path))
 
 
 class PXEPrivateMethodsTestCase(db_base.DbTestCase):
@@ -264,6 +318,8 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
         self.dbapi = dbapi.get_instance()
         self.node = self._create_test_node(**n)
         self.context = context.get_admin_context()
+        metadata_cache.invalidate()
+        self.addCleanup(metadata_cache.invalidate)
 
     def _create_test_node(self, **kwargs):
         n = db_utils.get_test_node(**kwargs)
@@ -305,6 +361,11 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
                                                method='get')
             self.assertEqual(image_info, expected_info)
 
+            # the image metadata is cached
+            image_info = pxe._get_tftp_image_info(self.node, self.context)
+            self.assertEqual(1, show_mock.call_count)
+            self.assertEqual(image_info, expected_info)
+
     def test__build_pxe_config(self):
         self.config(pxe_append_params='test_param', group='pxe')
         # NOTE: right '/' should be removed from url string
@@ -346,6 +407,50 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
         db_key = db_node['driver_info'].get('pxe_deploy_key')
         self.assertEqual(db_key, fake_key)
 
+    @mock.patch.object(pxe, '_templates', {})
+    def test__get_template(self):
+        tmpl_file = tempfile.NamedTemporaryFile(suffix='.template')
+        self.addCleanup(tmpl_file.close)
+        tmpl_file.write('{{ a }}')
+        tmpl_file.flush()
+        os.utime(tmpl_file.name, (1000, 1000))
+
+        template = pxe._get_template(tmpl_file.name)
+        self.assertEqual('1', template.render({'a': 1}))
+        self.assertIs(template, pxe._get_template(tmpl_file.name))
+
+        tmpl_file.seek(0)
+        tmpl_file.write('{{ a }}{{ a }}')
+        tmpl_file.flush()
+        os.utime(tmpl_file.name, (2000, 2000))
+        template = pxe._get_template(tmpl_file.name)
+        self.assertEqual('11', template.render({'a': 1}))
+
+    @mock.patch.object(pxe, '_api_url', (0, None))
+    @mock.patch.object(pxe.time, 'time')
+    @mock.patch.object(keystone, 'get_service_url')
+    def test__get_ironic_api_url_cached(self, url_mock, time_mock):
+        self.config(api_url=None, group='conductor')
+        self.config(api_url_cache_ttl=60, group='pxe')
+        url_mock.side_effect = ['http://url1/', 'http://url2/']
+        time_mock.return_value = 1000
+
+        self.assertEqual('http://url1/', pxe._get_ironic_api_url())
+        time_mock.return_value = 1059
+        self.assertEqual('http://url1/', pxe._get_ironic_api_url())
+        self.assertEqual(1, url_mock.call_count)
+
+        time_mock.return_value = 1060
+        self.assertEqual('http://url2/', pxe._get_ironic_api_url())
+        self.assertEqual(2, url_mock.call_count)
+
+    @mock.patch.object(keystone, 'get_service_url')
+    def test__get_ironic_api_url_conf(self, url_mock):
+        self.config(api_url='http://conf-url/', group='conductor')
+
+        self.assertEqual('http://conf-url/', pxe._get_ironic_api_url())
+        self.assertFalse(url_mock.called)
+
     def test__get_nodes_mac_addresses(self):
         self._create_test_port(node_id=self.node.id,
                                address='aa:bb:cc',
@@ -488,7 +593,7 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
 
         with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
             with mock.patch.object(tempfile, 'mkstemp') as mkstemp_mock:
-                fetch_to_raw_mock.return_value = None
+                fetch_to_raw_mock.return_value = FETCH_INFO
                 mkstemp_mock.return_value = (fd, tmp_master_image)
 
                 pxe._cache_tftp_images(None, self.node, image_info)
@@ -498,7 +603,8 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
                                                           tmp_master_image,
                                                           None)
                 mkstemp_mock.assert_called_once_with(
-                                                dir=CONF.pxe.tftp_master_path)
+                                                dir=CONF.pxe.tftp_master_path,
+                                                suffix='.part')
 
     def test__cache_tftp_images_no_master_path(self):
         temp_dir = tempfile.mkdtemp()
@@ -509,7 +615,7 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
                                         self.node.uuid, 'deploy_kernel')]}
 
         with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
-            fetch_to_raw_mock.return_value = None
+            fetch_to_raw_mock.return_value = FETCH_INFO
 
             pxe._cache_tftp_images(None, self.node, image_info)
 
@@ -524,7 +630,7 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
         self.config(instance_master_path=None, group='pxe')
 
         with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
-            fetch_to_raw_mock.return_value = None
+            fetch_to_raw_mock.return_value = FETCH_INFO
 
             (uuid, image_path) = pxe._cache_instance_image(None, self.node)
 
@@ -551,7 +657,7 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
                 with mock.patch.object(service_utils, 'parse_image_ref') \
                         as parse_image_ref_mock:
                     mkstemp_mock.return_value = (fd, tmp_master_image)
-                    fetch_to_raw_mock.return_value = None
+                    fetch_to_raw_mock.return_value = FETCH_INFO
                     parse_image_ref_mock.return_value = ('image_uuid',
                                                          None,
                                                          None,
@@ -561,7 +667,7 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
                                                                    self.node)
 
                     mkstemp_mock.assert_called_once_with(
-                         dir=CONF.pxe.instance_master_path)
+                         dir=CONF.pxe.instance_master_path, suffix='.part')
                     fetch_to_raw_mock.assert_called_once_with(None,
                                                        'glance://image_uuid',
                                                        tmp_master_image,
@@ -574,24 +680,139 @@ class PXEPrivateMethodsTestCase(db_base.DbTestCase):
                                                   self.node.uuid,
                                                   'disk'))
 
-    def test__get_image_download_in_progress(self):
-        def _create_instance_path(*args):
-            open(master_path, 'w').close()
-            return True
+    def test__get_image_cache_hit(self):
         temp_dir = tempfile.mkdtemp()
-        instance_path = os.path.join(temp_dir, 'instance_path')
-        fileutils.ensure_tree(temp_dir)
-        master_path = os.path.join(temp_dir, self.node.uuid)
-        lock_file = os.path.join(temp_dir, self.node.uuid + '.lock')
+        master_dir = os.path.join(temp_dir, 'master')
+        first_path = os.path.join(temp_dir, 'first')
+        second_path = os.path.join(temp_dir, 'second')
 
-        with mock.patch.object(pxe, '_download_in_progress') \
-                as download_in_progress_mock:
-            download_in_progress_mock.side_effect = _create_instance_path
+        with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
+            fetch_to_raw_mock.return_value = FETCH_INFO
+            pxe._get_image(None, first_path, 'image_uuid', master_dir)
+            pxe._get_image(None, second_path, 'image_uuid', master_dir)
+
+            fetch_to_raw_mock.assert_called_once_with(None, 'image_uuid',
+                                                      mock.ANY, None)
+        self.assertEqual(3, os.stat(first_path).st_nlink)
+        stats = image_cache.get_cache(master_dir).stats
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    @mock.patch.object(metadata_cache, 'show')
+    def test__get_image_cache_hit_checksum(self, show_mock):
+        temp_dir = tempfile.mkdtemp()
+        master_dir = os.path.join(temp_dir, 'master')
+        master_uuid = os.path.join(master_dir, 'image_uuid')
+        show_mock.return_value = {'checksum': 'fake-checksum'}
+
+        with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
+            fetch_to_raw_mock.return_value = {'size': 0,
+                                              'checksum': 'fake-checksum'}
+            pxe._get_image(None, os.path.join(temp_dir, 'first'),
+                           'image_uuid', master_dir, 'fake-service')
+            pxe._get_image(None, os.path.join(temp_dir, 'second'),
+                           'image_uuid', master_dir, 'fake-service')
+
+            self.assertEqual(1, fetch_to_raw_mock.call_count)
+        self.assertEqual('fake-checksum',
+                         image_cache.read_checksum(master_uuid))
+        show_mock.assert_called_once_with('fake-service', 'image_uuid')
+
+    @mock.patch.object(metadata_cache, 'show')
+    def test__get_image_outdated_master(self, show_mock):
+        temp_dir = tempfile.mkdtemp()
+        master_dir = os.path.join(temp_dir, 'master')
+        master_uuid = os.path.join(master_dir, 'image_uuid')
+        first_path = os.path.join(temp_dir, 'first')
+        second_path = os.path.join(temp_dir, 'second')
+        show_mock.return_value = {'checksum': 'new-checksum'}
+
+        with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
+            fetch_to_raw_mock.side_effect = [
+                {'size': 0, 'checksum': 'old-checksum'},
+                {'size': 0, 'checksum': 'new-checksum'}]
+            pxe._get_image(None, first_path, 'image_uuid', master_dir,
+                           'fake-service')
+            pxe._get_image(None, second_path, 'image_uuid', master_dir,
+                           'fake-service')
+
+            self.assertEqual(2, fetch_to_raw_mock.call_count)
+        # the node using the outdated master image keeps it
+        self.assertEqual(1, os.stat(first_path).st_nlink)
+        self.assertEqual(2, os.stat(master_uuid).st_nlink)
+        self.assertEqual('new-checksum',
+                         image_cache.read_checksum(master_uuid))
+
+    def _image_info(self, temp_dir, labels):
+        return dict((label, [label + '_uuid',
+                             os.path.join(temp_dir, self.node.uuid, label)])
+                    for label in labels)
+
+    def test__cache_images_parallel(self):
+        temp_dir = tempfile.mkdtemp()
+        self.config(tftp_root=temp_dir, images_path=temp_dir,
+                    image_download_concurrency=3, group='pxe')
+        image_info = self._image_info(temp_dir, ['deploy_kernel',
+                                                 'deploy_ramdisk',
+                                                 'kernel', 'ramdisk'])
+        running = [0]
+        max_running = [0]
+
+        def _get_image(ctx, path, uuid, master_path=None):
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+            eventlet.sleep(0.01)
+            running[0] -= 1
+
+        with mock.patch.object(pxe, '_get_image') as get_image_mock:
+            get_image_mock.side_effect = _get_image
+            pxe._cache_images(self.node, image_info, None)
+
+            self.assertEqual(5, get_image_mock.call_count)
+            get_image_mock.assert_any_call(
+                None, os.path.join(temp_dir, self.node.uuid, 'disk'),
+                'glance://image_uuid', CONF.pxe.instance_master_path)
+        self.assertEqual(3, max_running[0])
+
+    def test__cache_images_failure(self):
+        temp_dir = tempfile.mkdtemp()
+        self.config(tftp_root=temp_dir, images_path=temp_dir, group='pxe')
+        image_info = self._image_info(temp_dir, ['kernel', 'ramdisk'])
+        done = []
 
-            pxe._get_image(None, instance_path, self.node.uuid, temp_dir)
+        def _get_image(ctx, path, uuid, master_path=None):
+            eventlet.sleep(0)
+            if uuid == 'kernel_uuid':
+                raise exception.ImageNotFound(image_id=uuid)
+            done.append(uuid)
 
-            download_in_progress_mock.assert_called_once_with(lock_file)
-            self.assertTrue(os.path.exists(instance_path))
+        with mock.patch.object(pxe, '_get_image') as get_image_mock:
+            get_image_mock.side_effect = _get_image
+            self.assertRaises(exception.ImageNotFound,
+                              pxe._cache_images, self.node, image_info, None)
+
+        self.assertEqual(sorted(['ramdisk_uuid', 'glance://image_uuid']),
+                         sorted(done))
+
+    def test__get_image_fetch_failure_cleans_up(self):
+        temp_dir = tempfile.mkdtemp()
+        master_dir = os.path.join(temp_dir, 'master')
+        path = os.path.join(temp_dir, 'image')
+
+        def _fetch_to_raw(ctx, uuid, tmp_path, image_service):
+            open(tmp_path, 'w').write('partial')
+            raise exception.ImageNotFound(image_id=uuid)
+
+        with mock.patch.object(images, 'fetch_to_raw') as fetch_to_raw_mock:
+            fetch_to_raw_mock.side_effect = _fetch_to_raw
+            self.assertRaises(exception.ImageNotFound,
+                              pxe._get_image, None, path, 'image_uuid',
+                              master_dir)
+            self.assertEqual([], os.listdir(master_dir))
+
+            self.assertRaises(exception.ImageNotFound,
+                              pxe._get_image, None, path, 'image_uuid')
+            self.assertFalse(os.path.exists(path))
 
 
 class PXEDriverTestCase(db_base.DbTestCase):
@@ -754,8 +975,9 @@ class PXEDriverTestCase(db_base.DbTestCase):
         self.node.provision_state = states.DEPLOYWAIT
         self.node.save(self.context)
 
-        def fake_deploy(**kwargs):
-            pass
+        def fake_deploy(progress, **kwargs):
+            with progress.measure('fake_phase'):
+                pass
 
         self.useFixture(fixtures.MonkeyPatch(
                 'ironic.drivers.modules.deploy_utils.deploy',
@@ -770,6 +992,28 @@ class PXEDriverTestCase(db_base.DbTestCase):
         self.assertEqual(states.POWER_ON, self.node.power_state)
         self.assertIsNone(self.node.last_error)
         self.assertFalse(os.path.exists(token_path))
+        node = self.dbapi.get_node(self.node.uuid)
+        self.assertEqual(['fake_phase'],
+                         [p['name'] for p in node.deploy_progress['phases']])
+
+    def test_continue_deploy_boot_time(self):
+        self.node.provision_state = states.DEPLOYWAIT
+        self.node.provision_updated_at = (timeutils.utcnow() -
+                                          datetime.timedelta(seconds=60))
+        self.node.save(self.context)
+
+        with mock.patch.object(deploy_utils, 'deploy') as deploy_mock:
+            with task_manager.acquire(self.context, self.node.uuid,
+                                      shared=True) as task:
+                task.resources[0].driver.vendor.vendor_passthru(task,
+                        self.node, method='pass_deploy_info',
+                        address='123456', iqn='aaa-bbb', key='fake-56789')
+            self.assertIsInstance(deploy_mock.call_args[1]['progress'],
+                                  deploy_utils.DeployProgress)
+        node = self.dbapi.get_node(self.node.uuid)
+        phase = node.deploy_progress['phases'][0]
+        self.assertEqual('boot_deploy_ramdisk', phase['name'])
+        self.assertTrue(phase['duration'] >= 60)
 
     def test_continue_deploy_fail(self):
         token_path = self._create_token_file()
@@ -925,6 +1169,7 @@ class PXEDriverTestCase(db_base.DbTestCase):
         self.clean_up_config(master=None)
 
     def test_clean_up_master_images_not_in_use(self):
+        self.config(image_cache_size=0, group='pxe')
         self.clean_up_config(master='not_in_use')
 
         master_d_kernel_path = os.path.join(CONF.pxe.tftp_master_path,
@@ -935,6 +1180,17 @@ class PXEDriverTestCase(db_base.DbTestCase):
         self.assertFalse(os.path.exists(master_d_kernel_path))
         self.assertFalse(os.path.exists(master_instance_path))
 
+    def test_clean_up_master_images_cached(self):
+        self.clean_up_config(master='not_in_use')
+
+        master_d_kernel_path = os.path.join(CONF.pxe.tftp_master_path,
+                                            'deploy_kernel_uuid')
+        master_instance_path = os.path.join(CONF.pxe.instance_master_path,
+                                            'image_uuid')
+
+        self.assertTrue(os.path.exists(master_d_kernel_path))
+        self.assertTrue(os.path.exists(master_instance_path))
+
     def test_clean_up_master_images_in_use(self):
         self.clean_up_config(master='in_use')
 
@@ -15,6 +15,7 @@
 
 """Test class for Ironic SSH power driver."""
 
+import eventlet
 import mock
 import paramiko
 
@@ -132,10 +133,199 @@ class SSHValidateParametersTestCase(base.TestCase):
         self.assertEqual(expected_base_cmd, info['cmd_set']['base_cmd'])
 
 
+class SSHConnectionPoolTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SSHConnectionPoolTestCase, self).setUp()
+        self.pool = ssh.SSHConnectionPool()
+        self.addCleanup(self.pool.clear)
+        self.driver_info = {'host': '10.0.0.1', 'port': 22,
+                            'username': 'admin', 'password': 'fake'}
+        p = mock.patch.object(utils, 'ssh_connect')
+        self.ssh_connect_mock = p.start()
+        self.addCleanup(p.stop)
+        self.ssh_connect_mock.side_effect = lambda info: self._fake_client()
+
+    def _fake_client(self, alive=True):
+        client = mock.Mock(spec_set=['get_transport', 'exec_command',
+                                     'close'])
+        client.get_transport.return_value.is_active.return_value = alive
+        return client
+
+    def test_reuse(self):
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        conn.close()
+        conn = self.pool.get(dict(self.driver_info))
+        self.assertEqual(client, conn._ssh_obj)
+        conn.close()
+        self.ssh_connect_mock.assert_called_once_with(self.driver_info)
+        self.assertFalse(client.close.called)
+
+    def test_different_credentials(self):
+        conn = self.pool.get(self.driver_info)
+        conn.close()
+        info = dict(self.driver_info, password='other')
+        conn = self.pool.get(info)
+        conn.close()
+        self.assertEqual(2, self.ssh_connect_mock.call_count)
+
+    def test_broken_connection_not_reused(self):
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        conn.close()
+        client.get_transport.return_value.is_active.return_value = False
+        conn = self.pool.get(self.driver_info)
+        self.assertNotEqual(client, conn._ssh_obj)
+        client.close.assert_called_once_with()
+
+    @mock.patch.object(ssh.time, 'time')
+    def test_failed_health_check(self, time_mock):
+        time_mock.return_value = 1000
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        conn.close()
+        transport = client.get_transport.return_value
+        transport.global_request.side_effect = EOFError()
+        time_mock.return_value = 1010
+        conn = self.pool.get(self.driver_info)
+        self.assertNotEqual(client, conn._ssh_obj)
+        client.close.assert_called_once_with()
+
+    @mock.patch.object(ssh.time, 'time')
+    def test_health_check_round_trip(self, time_mock):
+        time_mock.return_value = 1000
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        conn.close()
+        # the host is not checked when the connection is released
+        transport = client.get_transport.return_value
+        self.assertFalse(transport.global_request.called)
+        time_mock.return_value = 1010
+        conn = self.pool.get(self.driver_info)
+        self.assertEqual(client, conn._ssh_obj)
+        transport.global_request.assert_called_once_with(
+                'keepalive@openssh.com', wait=True)
+
+    @mock.patch.object(ssh.time, 'time')
+    def test_health_check_skipped_when_recently_used(self, time_mock):
+        time_mock.return_value = 1000
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        conn.close()
+        time_mock.return_value = 1001
+        conn = self.pool.get(self.driver_info)
+        self.assertEqual(client, conn._ssh_obj)
+        transport = client.get_transport.return_value
+        self.assertFalse(transport.global_request.called)
+        transport.is_active.assert_called_with()
+
+    @mock.patch.object(ssh.time, 'time')
+    def test_health_check_timeout(self, time_mock):
+        self.config(connection_check_timeout=0.01, group='ssh')
+        time_mock.return_value = 1000
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        transport = client.get_transport.return_value
+        # the host does not answer
+        transport.global_request.side_effect = lambda *a, **k: (
+                                                        eventlet.sleep(1))
+        conn.close()
+        time_mock.return_value = 1010
+        conn = self.pool.get(self.driver_info)
+        self.assertNotEqual(client, conn._ssh_obj)
+        client.close.assert_called_once_with()
+
+    @mock.patch.object(ssh.time, 'time')
+    def test_idle_expiry(self, time_mock):
+        self.config(connection_idle_timeout=60, group='ssh')
+        time_mock.return_value = 1000
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        conn.close()
+        time_mock.return_value = 1061
+        self.pool.expire()
+        client.close.assert_called_once_with()
+        conn = self.pool.get(self.driver_info)
+        self.assertNotEqual(client, conn._ssh_obj)
+
+    def test_idle_expiry_timer(self):
+        self.config(connection_idle_timeout=0, group='ssh')
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        conn.close()
+        self.assertFalse(client.close.called)
+        # the connection is closed without another call to the pool
+        eventlet.sleep(0)
+        client.close.assert_called_once_with()
+        self.assertIsNone(self.pool._expiry)
+
+    def test_clear(self):
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        conn.close()
+        self.pool.clear()
+        client.close.assert_called_once_with()
+        self.assertIsNone(self.pool._expiry)
+        self.assertEqual({}, self.pool._slots)
+
+    def test_max_per_host(self):
+        self.config(connection_pool_size=1, group='ssh')
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        thread = eventlet.spawn(self.pool.get, self.driver_info)
+        eventlet.sleep(0)
+        # the second request waits for the first connection
+        self.assertEqual(1, self.ssh_connect_mock.call_count)
+        conn.close()
+        conn = thread.wait()
+        self.assertEqual(client, conn._ssh_obj)
+        self.assertEqual(1, self.ssh_connect_mock.call_count)
+
+    def test_connect_failure_releases_slot(self):
+        self.config(connection_pool_size=1, group='ssh')
+        self.ssh_connect_mock.side_effect = exception.SSHConnectFailed(
+                                                            host='10.0.0.1')
+        self.assertRaises(exception.SSHConnectFailed,
+                          self.pool.get, self.driver_info)
+        self.ssh_connect_mock.side_effect = None
+        self.ssh_connect_mock.return_value = self._fake_client()
+        self.pool.get(self.driver_info).close()
+
+    def test_no_pooling(self):
+        self.config(connection_pool_size=0, group='ssh')
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        conn.close()
+        client.close.assert_called_once_with()
+        self.pool.get(self.driver_info).close()
+        self.assertEqual(2, self.ssh_connect_mock.call_count)
+
+    def test_reconnect_on_lost_connection(self):
+        conn = self.pool.get(self.driver_info)
+        client = conn._ssh_obj
+        client.exec_command.side_effect = paramiko.SSHException()
+        client.get_transport.return_value.is_active.return_value = False
+        conn.exec_command('ls')
+        client.close.assert_called_once_with()
+        conn._ssh_obj.exec_command.assert_called_once_with('ls')
+        self.assertEqual(2, self.ssh_connect_mock.call_count)
+
+    def test_no_reconnect_on_live_connection(self):
+        conn = self.pool.get(self.driver_info)
+        conn._ssh_obj.exec_command.side_effect = paramiko.SSHException()
+        self.assertRaises(paramiko.SSHException, conn.exec_command, 'ls')
+        self.assertEqual(1, self.ssh_connect_mock.call_count)
+
+
 class SSHPrivateMethodsTestCase(base.TestCase):
 
     def setUp(self):
         super(SSHPrivateMethodsTestCase, self).setUp()
+        ssh._inventory_cache.clear()
+        self.addCleanup(ssh._inventory_cache.clear)
+        ssh._connection_pool.clear()
+        self.addCleanup(ssh._connection_pool.clear)
         self.node = db_utils.get_test_node(
                         driver='fake_ssh',
                         driver_info=INFO_DICT)
@@ -158,7 +348,8 @@ class SSHPrivateMethodsTestCase(base.TestCase):
                 utils, 'ssh_connect') as ssh_connect_mock:
             ssh_connect_mock.return_value = self.sshclient
             client = ssh._get_connection(self.node)
-            self.assertEqual(self.sshclient, client)
+            self.assertIsInstance(client, ssh.PooledSSHConnection)
+            self.assertEqual(self.sshclient, client._ssh_obj)
             driver_info = ssh._parse_driver_info(self.node)
             ssh_connect_mock.assert_called_once_with(driver_info)
 
@@ -190,137 +381,190 @@ class SSHPrivateMethodsTestCase(base.TestCase):
                           ssh_cmd)
         self.exec_ssh_mock.assert_called_once_with(self.sshclient, ssh_cmd)
 
+    def _inventory_output(self, running=True):
+        lines = ['M 52:54:00:cf:2d:31 NodeName',
+                 'M 52:54:00:cf:2d:32 OtherNode',
+                 'R "OtherNode"']
+        if running:
+            lines.append('R "NodeName"')
+        return ('\n'.join(lines), '')
+
     def test__get_power_status_on(self):
         info = ssh._parse_driver_info(self.node)
-        with mock.patch.object(ssh, '_get_hosts_name_for_node') \
-                as get_hosts_name_mock:
-            self.exec_ssh_mock.return_value = (
-                    '"NodeName" {b43c4982-110c-4c29-9325-d5f41b053513}', '')
-            get_hosts_name_mock.return_value = "NodeName"
-
-            pstate = ssh._get_power_status(self.sshclient, info)
-
-            ssh_cmd = "%s %s" % (info['cmd_set']['base_cmd'],
-                                 info['cmd_set']['list_running'])
-            self.assertEqual(pstate, states.POWER_ON)
-            self.exec_ssh_mock.assert_called_once_with(
-                    self.sshclient, ssh_cmd)
-            get_hosts_name_mock.assert_called_once_with(self.sshclient,
-                                                        info)
+        info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
+        self.exec_ssh_mock.return_value = self._inventory_output()
+
+        pstate = ssh._get_power_status(self.sshclient, info)
+
+        ssh_cmd = ssh._get_inventory_cmd(info['cmd_set'])
+        self.assertEqual(pstate, states.POWER_ON)
+        self.exec_ssh_mock.assert_called_once_with(self.sshclient, ssh_cmd)
 
     def test__get_power_status_off(self):
         info = ssh._parse_driver_info(self.node)
-        with mock.patch.object(ssh, '_get_hosts_name_for_node') \
-                as get_hosts_name_mock:
-            self.exec_ssh_mock.return_value = (
-                    '"NodeName" {b43c4982-110c-4c29-9325-d5f41b053513}', '')
-            get_hosts_name_mock.return_value = "NotNodeName"
-
-            pstate = ssh._get_power_status(self.sshclient, info)
-
-            ssh_cmd = "%s %s" % (info['cmd_set']['base_cmd'],
-                                 info['cmd_set']['list_running'])
-            self.assertEqual(pstate, states.POWER_OFF)
-            self.exec_ssh_mock.assert_called_once_with(self.sshclient,
-                    ssh_cmd)
-            get_hosts_name_mock.assert_called_once_with(self.sshclient,
-                                                        info)
+        info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
+        self.exec_ssh_mock.return_value = self._inventory_output(
+                                                            running=False)
+
+        pstate = ssh._get_power_status(self.sshclient, info)
+
+        ssh_cmd = ssh._get_inventory_cmd(info['cmd_set'])
+        self.assertEqual(pstate, states.POWER_OFF)
+        self.exec_ssh_mock.assert_called_once_with(self.sshclient, ssh_cmd)
 
     def test__get_power_status_error(self):
         info = ssh._parse_driver_info(self.node)
+        info['macs'] = ["11:11:11:11:11:11", "22:22:22:22:22:22"]
+        self.exec_ssh_mock.return_value = self._inventory_output()
 
-        with mock.patch.object(ssh, '_get_hosts_name_for_node') \
-                as get_hosts_name_mock:
-            self.exec_ssh_mock.return_value = (
-                    '"NodeName" {b43c4982-110c-4c29-9325-d5f41b053513}', '')
-            info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
-            get_hosts_name_mock.return_value = None
-            self.assertRaises(exception.NodeNotFound,
-                              ssh._get_power_status,
-                              self.sshclient,
-                              info)
-
-            ssh_cmd = "%s %s" % (info['cmd_set']['base_cmd'],
-                                 info['cmd_set']['list_running'])
+        self.assertRaises(exception.NodeNotFound,
+                          ssh._get_power_status,
+                          self.sshclient,
+                          info)
 
-            self.exec_ssh_mock.assert_called_once_with(
-                    self.sshclient, ssh_cmd)
-            get_hosts_name_mock.assert_called_once_with(self.sshclient,
-                                                        info)
+        ssh_cmd = ssh._get_inventory_cmd(info['cmd_set'])
+        self.exec_ssh_mock.assert_called_once_with(self.sshclient, ssh_cmd)
 
     def test__get_power_status_exception(self):
         info = ssh._parse_driver_info(self.node)
+        info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
         self.exec_ssh_mock.side_effect = processutils.ProcessExecutionError
 
         self.assertRaises(exception.SSHCommandFailed,
                           ssh._get_power_status,
                           self.sshclient,
                           info)
-        ssh_cmd = "%s %s" % (info['cmd_set']['base_cmd'],
-                             info['cmd_set']['list_running'])
+        ssh_cmd = ssh._get_inventory_cmd(info['cmd_set'])
+        self.exec_ssh_mock.assert_called_once_with(self.sshclient, ssh_cmd)
+
+    def test__get_power_status_cached(self):
+        info = ssh._parse_driver_info(self.node)
+        info['macs'] = ["52:54:00:cf:2d:31"]
+        other_info = dict(info, macs=["52:54:00:cf:2d:32"])
+        self.exec_ssh_mock.return_value = self._inventory_output(
+                                                            running=False)
+
+        # the nodes of a host share one inventory command
+        self.assertEqual(states.POWER_OFF,
+                         ssh._get_power_status(self.sshclient, info))
+        self.assertEqual(states.POWER_ON,
+                         ssh._get_power_status(self.sshclient, other_info))
+        self.assertEqual(1, self.exec_ssh_mock.call_count)
+
+        # it is read again after a power state change
+        ssh._require_fresh_inventory(info)
+        self.exec_ssh_mock.return_value = self._inventory_output()
+        self.assertEqual(states.POWER_ON,
+                         ssh._get_power_status(self.sshclient, info))
+        self.assertEqual(2, self.exec_ssh_mock.call_count)
+
+        # and that read is reused by the other nodes
+        ssh._require_fresh_inventory(other_info)
+        other_info['inventory_after'] -= 1
+        self.assertEqual(states.POWER_ON,
+                         ssh._get_power_status(self.sshclient, other_info))
+        self.assertEqual(2, self.exec_ssh_mock.call_count)
+
+    def test__wait_for_power_state_shares_inventory(self):
+        info = ssh._parse_driver_info(self.node)
+        info['macs'] = ["52:54:00:cf:2d:31"]
+        other_info = dict(info, macs=["52:54:00:cf:2d:32"])
+        self.exec_ssh_mock.return_value = self._inventory_output()
+        ssh._require_fresh_inventory(info)
+        ssh._require_fresh_inventory(other_info)
+
+        waits = [eventlet.spawn(ssh._wait_for_power_state, self.sshclient,
+                                i, states.POWER_ON)
+                 for i in (info, other_info)]
+        self.assertEqual([states.POWER_ON, states.POWER_ON],
+                         [w.wait() for w in waits])
+        # the waits polled the host with a single inventory read
         self.exec_ssh_mock.assert_called_once_with(
-                self.sshclient, ssh_cmd)
+                self.sshclient, ssh._get_inventory_cmd(info['cmd_set']))
+
+    @mock.patch.object(ssh.time, 'time')
+    def test__get_power_status_cache_expired(self, time_mock):
+        self.config(inventory_cache_ttl=10, group='ssh')
+        info = ssh._parse_driver_info(self.node)
+        info['macs'] = ["52:54:00:cf:2d:31"]
+        self.exec_ssh_mock.return_value = self._inventory_output()
+
+        time_mock.return_value = 100
+        ssh._get_power_status(self.sshclient, info)
+        time_mock.return_value = 109
+        ssh._get_power_status(self.sshclient, info)
+        self.assertEqual(1, self.exec_ssh_mock.call_count)
+        time_mock.return_value = 110
+        ssh._get_power_status(self.sshclient, info)
+        self.assertEqual(2, self.exec_ssh_mock.call_count)
+
+    def test__get_power_status_no_cache(self):
+        self.config(inventory_cache_ttl=0, group='ssh')
+        info = ssh._parse_driver_info(self.node)
+        info['macs'] = ["52:54:00:cf:2d:31"]
+        self.exec_ssh_mock.return_value = self._inventory_output()
+        ssh._get_power_status(self.sshclient, info)
+        ssh._get_power_status(self.sshclient, info)
+        self.assertEqual(2, self.exec_ssh_mock.call_count)
 
     def test__get_hosts_name_for_node_match(self):
         info = ssh._parse_driver_info(self.node)
         info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
-        ssh_cmd = "%s %s" % (info['cmd_set']['base_cmd'],
-                             info['cmd_set']['list_all'])
-
-        cmd_to_exec = "%s %s" % (info['cmd_set']['base_cmd'],
-                                 info['cmd_set']['get_node_macs'])
-        cmd_to_exec = cmd_to_exec.replace('{_NodeName_}', 'NodeName')
-        self.exec_ssh_mock.side_effect = [('NodeName', ''),
-                                          ('52:54:00:cf:2d:31', '')]
-        expected = [mock.call(self.sshclient, ssh_cmd),
-                    mock.call(self.sshclient, cmd_to_exec)]
+        ssh_cmd = ssh._get_inventory_cmd(info['cmd_set'])
+        self.exec_ssh_mock.return_value = self._inventory_output()
 
         found_name = ssh._get_hosts_name_for_node(self.sshclient, info)
 
         self.assertEqual(found_name, 'NodeName')
-        self.assertEqual(self.exec_ssh_mock.call_args_list, expected)
+        self.exec_ssh_mock.assert_called_once_with(self.sshclient, ssh_cmd)
 
     def test__get_hosts_name_for_node_no_match(self):
         info = ssh._parse_driver_info(self.node)
         info['macs'] = ["11:11:11:11:11:11", "22:22:22:22:22:22"]
-        self.exec_ssh_mock.side_effect = [('NodeName', ''),
-                                          ('52:54:00:cf:2d:31', '')]
-
-        ssh_cmd = "%s %s" % (info['cmd_set']['base_cmd'],
-                             info['cmd_set']['list_all'])
-
-        cmd_to_exec = "%s %s" % (info['cmd_set']['base_cmd'],
-                                 info['cmd_set']['get_node_macs'])
-
-        cmd_to_exec = cmd_to_exec.replace('{_NodeName_}', 'NodeName')
-        expected = [mock.call(self.sshclient, ssh_cmd),
-                    mock.call(self.sshclient, cmd_to_exec)]
+        ssh_cmd = ssh._get_inventory_cmd(info['cmd_set'])
+        self.exec_ssh_mock.return_value = self._inventory_output()
 
         found_name = ssh._get_hosts_name_for_node(self.sshclient, info)
 
         self.assertIsNone(found_name)
-        self.assertEqual(self.exec_ssh_mock.call_args_list, expected)
+        self.exec_ssh_mock.assert_called_once_with(self.sshclient, ssh_cmd)
 
     def test__get_hosts_name_for_node_exception(self):
         info = ssh._parse_driver_info(self.node)
         info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
-        ssh_cmd = "%s %s" % (info['cmd_set']['base_cmd'],
-                             info['cmd_set']['list_all'])
-
-        cmd_to_exec = "%s %s" % (info['cmd_set']['base_cmd'],
-                                 info['cmd_set']['get_node_macs'])
-        cmd_to_exec = cmd_to_exec.replace('{_NodeName_}', 'NodeName')
-
-        self.exec_ssh_mock.side_effect = [('NodeName', ''),
-                                          processutils.ProcessExecutionError]
-        expected = [mock.call(self.sshclient, ssh_cmd),
-                    mock.call(self.sshclient, cmd_to_exec)]
+        ssh_cmd = ssh._get_inventory_cmd(info['cmd_set'])
+        self.exec_ssh_mock.side_effect = processutils.ProcessExecutionError
 
         self.assertRaises(exception.SSHCommandFailed,
                           ssh._get_hosts_name_for_node,
                           self.sshclient,
                           info)
-        self.assertEqual(expected, self.exec_ssh_mock.call_args_list)
+        self.exec_ssh_mock.assert_called_once_with(self.sshclient, ssh_cmd)
+
+    def test__get_inventory_cmd(self):
+        cmd = ssh._get_inventory_cmd(ssh._get_command_sets('vbox'))
+        self.assertIn('/usr/bin/VBoxManage list runningvms', cmd)
+        self.assertIn('/usr/bin/VBoxManage list vms', cmd)
+        self.assertIn('showvminfo --machinereadable "$vm"', cmd)
+        # vmware checks the power state of each VM in the loop
+        cmd = ssh._get_inventory_cmd(ssh._get_command_sets('vmware'))
+        self.assertIn('vmsvc/power.getstate "$vm"', cmd)
+        self.assertNotIn('{_NodeName_}', cmd)
+
+    def test__host_inventory_parse(self):
+        inventory = ssh._HostInventory.parse([
+                'R "vm one" {b43c4982-110c-4c29-9325-d5f41b053513}',
+                'R 42',
+                'M 52:54:00:CF:2D:31 vm one',
+                'M 525400cf2d32 42',
+                'M  vm-without-mac',
+                ''])
+        self.assertEqual('vm one', inventory.get_name(['52-54-00-cf-2d-31']))
+        self.assertEqual('42', inventory.get_name(['', '52:54:00:cf:2d:32']))
+        self.assertIsNone(inventory.get_name(['52:54:00:cf:2d:33']))
+        self.assertTrue(inventory.is_running('vm one'))
+        self.assertTrue(inventory.is_running('42'))
+        self.assertFalse(inventory.is_running('vm-without-mac'))
 
     def test__power_on_good(self):
         info = ssh._parse_driver_info(self.node)
@@ -352,6 +596,7 @@ class SSHPrivateMethodsTestCase(base.TestCase):
     def test__power_on_fail(self):
         info = ssh._parse_driver_info(self.node)
         info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
+        self.config(power_wait_timeout=0, group='ssh')
         with mock.patch.object(ssh, '_get_power_status') \
                 as get_power_status_mock:
             with mock.patch.object(ssh, '_get_hosts_name_for_node') \
@@ -375,6 +620,28 @@ class SSHPrivateMethodsTestCase(base.TestCase):
                 self.exec_ssh_mock.assert_called_once_with(self.sshclient,
                                                            cmd_to_exec)
 
+    def test__power_on_wait(self):
+        self.config(power_wait_initial_interval=0.01, group='conductor')
+        info = ssh._parse_driver_info(self.node)
+        info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
+        with mock.patch.object(ssh, '_get_power_status') \
+                as get_power_status_mock:
+            with mock.patch.object(ssh, '_get_hosts_name_for_node') \
+                    as get_hosts_name_mock:
+                get_power_status_mock.side_effect = [states.POWER_OFF,
+                                                     states.POWER_OFF,
+                                                     states.POWER_ON]
+                get_hosts_name_mock.return_value = "NodeName"
+
+                with mock.patch.object(ssh, '_require_fresh_inventory') \
+                        as fresh_mock:
+                    current_state = ssh._power_on(self.sshclient, info)
+
+                self.assertEqual(states.POWER_ON, current_state)
+                self.assertEqual(3, get_power_status_mock.call_count)
+                # once after the command, then after each status query
+                self.assertEqual(3, fresh_mock.call_count)
+
     def test__power_on_exception(self):
         info = ssh._parse_driver_info(self.node)
         info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
@@ -432,6 +699,7 @@ class SSHPrivateMethodsTestCase(base.TestCase):
     def test__power_off_fail(self):
         info = ssh._parse_driver_info(self.node)
         info['macs'] = ["11:11:11:11:11:11", "52:54:00:cf:2d:31"]
+        self.config(power_wait_timeout=0, group='ssh')
         with mock.patch.object(ssh, '_get_power_status') \
                 as get_power_status_mock:
             with mock.patch.object(ssh, '_get_hosts_name_for_node') \
@@ -553,6 +821,10 @@ class SSHDriverTestCase(db_base.DbTestCase):
 
     def setUp(self):
         super(SSHDriverTestCase, self).setUp()
+        ssh._inventory_cache.clear()
+        self.addCleanup(ssh._inventory_cache.clear)
+        ssh._connection_pool.clear()
+        self.addCleanup(ssh._connection_pool.clear)
         self.context = context.get_admin_context()
         mgr_utils.mock_the_extension_manager(driver="fake_ssh")
         self.driver = driver_factory.get_driver("fake_ssh")
@@ -15,13 +15,17 @@
 
 
 import datetime
+import errno
 import filecmp
 import os
 import tempfile
+
+import mock
 import testtools
 
 from ironic.common import exception
 from ironic.common.glance_service import base_image_service
+from ironic.common.glance_service import metadata_cache
 from ironic.common.glance_service import service_utils
 from ironic.common import image_service as service
 from ironic.openstack.common import context
@@ -613,6 +617,145 @@ def _create_failing_glance_client(info):
     return MyGlanceStubClient()
 
 
+class TestCopyFile(base.TestCase):
+
+    def setUp(self):
+        super(TestCopyFile, self).setUp()
+        tmpdir = tempfile.mkdtemp()
+        self.src_path = os.path.join(tmpdir, 'src')
+        self.dst_path = os.path.join(tmpdir, 'dst')
+        self.content = os.urandom(10 * 1024)
+        with open(self.src_path, 'wb') as f:
+            f.write(self.content)
+
+    def _copy(self):
+        with open(self.src_path, 'rb') as src:
+            with open(self.dst_path, 'wb') as dst:
+                dst.write('header')
+                result = base_image_service._copy_file(src, dst)
+                dst.write('footer')
+        with open(self.dst_path, 'rb') as f:
+            self.assertEqual('header' + self.content + 'footer', f.read())
+        return result
+
+    def test_copy_file_sendfile(self):
+        self.assertEqual((len(self.content), 'sendfile'), self._copy())
+
+    @mock.patch.object(base_image_service, '_sendfile')
+    def test_copy_file_no_sendfile(self, sendfile_mock):
+        sendfile_mock.side_effect = OSError(errno.ENOSYS, 'fake')
+        self.assertEqual((len(self.content), 'copy'), self._copy())
+
+    @mock.patch.object(base_image_service, '_sendfile')
+    def test_copy_file_sendfile_failure(self, sendfile_mock):
+        sendfile_mock.side_effect = [4096, OSError(errno.EIO, 'fake')]
+        self.assertRaises(OSError, self._copy)
+
+    @mock.patch.object(base_image_service.eventlet, 'sleep')
+    def test_copy_file_yields(self, sleep_mock):
+        with mock.patch.object(base_image_service, '_sendfile',
+                               wraps=base_image_service._sendfile) \
+                as sendfile_mock:
+            self._copy()
+        self.assertTrue(sleep_mock.called)
+        for args, kwargs in sendfile_mock.call_args_list:
+            self.assertEqual(base_image_service._COPY_CHUNK_SIZE, args[2])
+
+    def test_copy_file_no_fileno(self):
+        writer = mock.Mock(spec=['write'])
+        with open(self.src_path, 'rb') as src:
+            result = base_image_service._copy_file(src, writer)
+        self.assertEqual((len(self.content), 'copy'), result)
+        writer.write.assert_called_once_with(self.content)
+
+
+class TestImageMetadataCache(base.TestCase):
+
+    def setUp(self):
+        super(TestImageMetadataCache, self).setUp()
+        self.cache = metadata_cache.ImageMetadataCache()
+        self.service = mock.Mock()
+        self.meta = {'id': 'image_uuid', 'status': 'active',
+                     'updated_at': datetime.datetime(2014, 1, 1),
+                     'properties': {'kernel_id': 'kernel_uuid'}}
+        self.service.show.return_value = self.meta
+
+    def test_show_cached(self):
+        self.assertEqual(self.meta,
+                         self.cache.show(self.service, 'glance://image_uuid'))
+        meta = self.cache.show(self.service, 'image_uuid')
+        self.assertEqual(self.meta, meta)
+        self.service.show.assert_called_once_with('glance://image_uuid')
+        # callers can not modify the cached metadata
+        meta['properties']['kernel_id'] = 'other'
+        meta = self.cache.show(self.service, 'image_uuid')
+        self.assertEqual('kernel_uuid', meta['properties']['kernel_id'])
+
+    def test_show_disabled(self):
+        self.config(metadata_cache_ttl=0, group='glance')
+        self.cache.show(self.service, 'image_uuid')
+        self.cache.show(self.service, 'image_uuid')
+        self.assertEqual(2, self.service.show.call_count)
+
+    def test_show_not_active(self):
+        self.meta['status'] = 'saving'
+        self.cache.show(self.service, 'image_uuid')
+        self.cache.show(self.service, 'image_uuid')
+        self.assertEqual(2, self.service.show.call_count)
+
+    @mock.patch.object(metadata_cache.time, 'time')
+    def test_show_expired(self, time_mock):
+        self.config(metadata_cache_ttl=10, group='glance')
+        time_mock.return_value = 1000
+        self.cache.show(self.service, 'image_uuid')
+        time_mock.return_value = 1010
+        self.cache.show(self.service, 'image_uuid')
+        self.assertEqual(2, self.service.show.call_count)
+
+    @mock.patch.object(metadata_cache.time, 'time')
+    def test_show_outdated(self, time_mock):
+        self.config(metadata_cache_ttl=10, group='glance')
+        time_mock.return_value = 1000
+        self.cache.show(self.service, 'image_uuid')
+        time_mock.return_value = 1010
+        self.service.show.return_value = dict(
+            self.meta, updated_at=datetime.datetime(2013, 1, 1),
+            properties={})
+        self.assertEqual(self.meta, self.cache.show(self.service,
+                                                    'image_uuid'))
+
+    @mock.patch.object(metadata_cache.time, 'time')
+    def test_show_not_found(self, time_mock):
+        self.config(metadata_cache_negative_ttl=10, group='glance')
+        time_mock.return_value = 1000
+        self.service.show.side_effect = exception.ImageNotFound(
+            image_id='image_uuid')
+        for i in range(2):
+            self.assertRaises(exception.ImageNotFound, self.cache.show,
+                              self.service, 'image_uuid')
+        self.assertEqual(1, self.service.show.call_count)
+
+        time_mock.return_value = 1010
+        self.service.show.side_effect = None
+        self.assertEqual(self.meta, self.cache.show(self.service,
+                                                    'image_uuid'))
+
+    def test_show_size(self):
+        self.config(metadata_cache_size=2, group='glance')
+        for image_id in ('a', 'b', 'c'):
+            self.cache.show(self.service, image_id)
+        self.assertEqual(2, len(self.cache._entries))
+        self.assertNotIn('a', self.cache._entries)
+
+    def test_invalidate(self):
+        self.cache.show(self.service, 'image_uuid')
+        self.cache.show(self.service, 'other_uuid')
+        self.cache.invalidate('glance://image_uuid')
+        self.assertEqual(['other_uuid'], list(self.cache._entries))
+        self.cache.invalidate()
+        self.assertEqual({}, self.cache._entries)
+
+
 class TestGlanceUrl(base.TestCase):
 
     def test_generate_glance_http_url(self):
@@ -13,11 +13,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
+import mock
 from oslo.config import cfg
+from testtools import content
 
 from ironic.common import exception
 from ironic.common import hash_ring as hash
+from ironic.common import utils
+from ironic.db import api as dbapi
 from ironic.tests import base
+from ironic.tests.db import base as db_base
 
 CONF = cfg.CONF
 
@@ -117,3 +124,195 @@ class HashRingTestCase(base.TestCase):
         self.assertRaises(exception.Invalid,
                           ring.get_hosts,
                           None)
+
+    def test_create_ring_no_hosts(self):
+        self.assertRaises(exception.Invalid,
+                          hash.HashRing,
+                          [])
+
+    def _walk_ring(self, ring, data, ignore_hosts):
+        # reference implementation: walk the partitions one at a time
+        host_ids = []
+        ignore_host_ids = [ring.hosts.index(h)
+                           for h in ignore_hosts if h in ring.hosts]
+        partition = ring._get_partition(data)
+        for replica in range(ring.replicas):
+            if len(host_ids + ignore_host_ids) == len(ring.hosts):
+                break
+            while ring.part2host[partition] in host_ids + ignore_host_ids:
+                partition = (partition + 1) % len(ring.part2host)
+            host_ids.append(ring.part2host[partition])
+        return [ring.hosts[h] for h in host_ids]
+
+    def test_successor_tables_match_ring_walk(self):
+        hosts = ['foo', 'bar', 'baz', 'qux', 'quux']
+        # 2 ** 3 partitions: the last partitions wrap before seeing all hosts
+        CONF.set_override('hash_partition_exponent', 3)
+        uuids = [utils.generate_uuid() for i in range(200)]
+        for replicas in (1, 2, 3, 5):
+            ring = hash.HashRing(hosts, replicas=replicas)
+            for ignore_hosts in ([], ['foo'], ['bar', 'qux'], hosts):
+                for uuid in uuids:
+                    self.assertEqual(
+                        self._walk_ring(ring, uuid, ignore_hosts),
+                        ring.get_hosts(uuid, ignore_hosts=ignore_hosts))
+
+    def test_more_hosts_than_partitions(self):
+        hosts = ['host%d' % i for i in range(10)]
+        CONF.set_override('hash_partition_exponent', 2)
+        ring = hash.HashRing(hosts, replicas=3)
+        for i in range(50):
+            uuid = utils.generate_uuid()
+            self.assertEqual(self._walk_ring(ring, uuid, []),
+                             ring.get_hosts(uuid))
+
+    def test_get_hosts_bulk(self):
+        hosts = ['foo', 'bar', 'baz']
+        ring = hash.HashRing(hosts, replicas=2)
+        uuids = [utils.generate_uuid() for i in range(100)]
+        expected = dict((u, ring.get_hosts(u)) for u in uuids)
+        self.assertEqual(expected, ring.get_hosts_bulk(uuids))
+
+    def test_get_hosts_bulk_ignore_hosts(self):
+        hosts = ['foo', 'bar', 'baz']
+        ring = hash.HashRing(hosts, replicas=2)
+        self.assertEqual({'fake': ['foo', 'baz'],
+                          'fake-again': ['baz', 'foo']},
+                         ring.get_hosts_bulk(['fake', 'fake-again'],
+                                             ignore_hosts=['bar']))
+
+    def test_get_partition_key(self):
+        CONF.set_override('hash_partition_exponent', 4)
+        ring = hash.HashRing(['foo'])
+        key = hash.get_partition_key('fake')
+        self.assertEqual(ring._get_partition('fake'), key >> 28)
+
+    def test_get_owned_partitions(self):
+        hosts = ['foo', 'bar', 'baz', 'qux', 'quux']
+        CONF.set_override('hash_partition_exponent', 3)
+        for replicas in (1, 2, 3):
+            ring = hash.HashRing(hosts, replicas=replicas)
+            for host in hosts:
+                owned = ring.get_owned_partitions(host)
+                for p in range(len(ring.part2host)):
+                    expected = host in ring._get_successors(p)[:replicas]
+                    actual = (p in owned.tail or
+                              (p < owned.tail_start and
+                               p % owned.modulus in owned.residues))
+                    self.assertEqual(expected, actual)
+
+    def test_get_hosts_bulk_invalid_data(self):
+        hosts = ['foo', 'bar']
+        ring = hash.HashRing(hosts)
+        self.assertRaises(exception.Invalid,
+                          ring.get_hosts_bulk,
+                          ['fake', None])
+
+
+class HashRingBenchmarkTestCase(base.TestCase):
+    """Microbenchmark of ring construction and lookups.
+
+    The measured rates are attached to the test result as details, eg.
+    they are shown by `testr last --subunit | subunit2pyunit`.
+    """
+
+    def _rate(self, count, func, *args):
+        start = time.time()
+        func(*args)
+        elapsed = max(time.time() - start, 1e-6)
+        return count / elapsed
+
+    def test_ring_sizes_and_lookup_rates(self):
+        hosts = ['host%d' % i for i in range(20)]
+        uuids = [utils.generate_uuid() for i in range(5000)]
+        results = []
+        for exponent in (8, 12, 16):
+            CONF.set_override('hash_partition_exponent', exponent)
+            start = time.time()
+            ring = hash.HashRing(hosts, replicas=2)
+            build_time = time.time() - start
+            self.assertEqual(2 ** exponent, len(ring.part2host))
+
+            single = self._rate(len(uuids),
+                                lambda: [ring.get_hosts(u) for u in uuids])
+            ignoring = self._rate(len(uuids),
+                                  lambda: [ring.get_hosts(u, ['host0'])
+                                           for u in uuids])
+            bulk = self._rate(len(uuids), ring.get_hosts_bulk, uuids)
+            results.append('2^%d partitions: built in %.4fs, '
+                           '%d lookups/s, %d lookups/s ignoring a host, '
+                           '%d bulk lookups/s'
+                           % (exponent, build_time, single, ignoring, bulk))
+        self.addDetail('hash_ring_rates',
+                       content.text_content('\n'.join(results)))
+
+
+class HashRingManagerTestCase(db_base.DbTestCase):
+
+    def setUp(self):
+        super(HashRingManagerTestCase, self).setUp()
+        self.ring_manager = hash.HashRingManager()
+        self.dbapi = dbapi.get_instance()
+
+    def register_conductors(self):
+        self.dbapi.register_conductor({
+            'hostname': 'host1',
+            'drivers': ['driver1', 'driver2'],
+        })
+        self.dbapi.register_conductor({
+            'hostname': 'host2',
+            'drivers': ['driver1'],
+        })
+
+    def test_hash_ring_manager_get_ring_success(self):
+        self.register_conductors()
+        ring = self.ring_manager['driver1']
+        self.assertEqual(sorted(['host1', 'host2']), sorted(ring.hosts))
+
+    def test_hash_ring_manager_driver_not_found(self):
+        self.register_conductors()
+        self.assertRaises(exception.DriverNotFound,
+                          self.ring_manager.__getitem__,
+                          'driver3')
+
+    def test_hash_ring_manager_no_refresh(self):
+        # If a new conductor is registered after the ring manager is
+        # initialized, it won't be seen until the check interval passes.
+        self.assertRaises(exception.DriverNotFound,
+                          self.ring_manager.__getitem__,
+                          'driver1')
+        self.register_conductors()
+        self.assertRaises(exception.DriverNotFound,
+                          self.ring_manager.__getitem__,
+                          'driver1')
+
+    def test_hash_ring_manager_shared(self):
+        self.register_conductors()
+        ring = self.ring_manager['driver1']
+        self.assertIs(ring, hash.HashRingManager()['driver1'])
+
+    def test_hash_ring_manager_reset(self):
+        self.ring_manager.ring
+        self.register_conductors()
+        hash.HashRingManager.reset()
+        self.assertEqual(2, len(self.ring_manager['driver1'].hosts))
+
+    @mock.patch.object(hash, 'HashRing')
+    def test_hash_ring_manager_rebuild_only_on_change(self, mock_ring):
+        self.config(hash_ring_check_interval=0)
+        initial = hash.HashRingManager.stats()
+        self.register_conductors()
+        self.ring_manager.ring
+        self.ring_manager.ring
+        self.assertEqual(2, mock_ring.call_count)
+        stats = hash.HashRingManager.stats()
+        self.assertEqual(initial['rebuilds'] + 1, stats['rebuilds'])
+        self.assertEqual(initial['checks'] + 2, stats['checks'])
+
+        self.dbapi.register_conductor({'hostname': 'host3',
+                                       'drivers': ['driver3']})
+        self.ring_manager.ring
+        self.assertEqual(5, mock_ring.call_count)
+        stats = hash.HashRingManager.stats()
+        self.assertEqual(initial['rebuilds'] + 2, stats['rebuilds'])
+        self.assertEqual(initial['checks'] + 3, stats['checks'])
@@ -17,16 +17,23 @@
 #    under the License.
 
 import contextlib
+import hashlib
+import os
+import tempfile
+
 import fixtures
+import mock
 
 from ironic.common import exception
+from ironic.common.glance_service import base_image_service
+from ironic.common.glance_service import metadata_cache
 from ironic.common import images
 from ironic.openstack.common import excutils
 from ironic.tests import base
 
 
 class IronicImagesTestCase(base.TestCase):
-    def test_fetch_raw_image(self):
+    def test_image_to_raw(self):
 
         def fake_execute(*cmd, **kwargs):
             self.executes.append(cmd)
@@ -72,8 +79,6 @@ class IronicImagesTestCase(base.TestCase):
                 'ironic.common.utils.execute', fake_execute))
         self.useFixture(fixtures.MonkeyPatch('os.rename', fake_rename))
         self.useFixture(fixtures.MonkeyPatch('os.unlink', fake_unlink))
-        self.useFixture(fixtures.MonkeyPatch(
-                'ironic.common.images.fetch', lambda *_: None))
         self.useFixture(fixtures.MonkeyPatch(
                 'ironic.common.images.qemu_img_info', fake_qemu_img_info))
         self.useFixture(fixtures.MonkeyPatch(
@@ -83,7 +88,6 @@ class IronicImagesTestCase(base.TestCase):
                 'ironic.openstack.common.fileutils.delete_if_exists',
                 fake_del_if_exists))
 
-        context = 'opaque context'
         image_id = '4'
 
         target = 't.qcow2'
@@ -92,21 +96,286 @@ class IronicImagesTestCase(base.TestCase):
                               't.qcow2.part', 't.qcow2.converted'),
                              ('rm', 't.qcow2.part'),
                              ('mv', 't.qcow2.converted', 't.qcow2')]
-        images.fetch_to_raw(context, image_id, target)
+        images.image_to_raw(image_id, target, target + '.part')
         self.assertEqual(self.executes, expected_commands)
 
         target = 't.raw'
         self.executes = []
         expected_commands = [('mv', 't.raw.part', 't.raw')]
-        images.fetch_to_raw(context, image_id, target)
+        images.image_to_raw(image_id, target, target + '.part')
         self.assertEqual(self.executes, expected_commands)
 
         target = 'backing.qcow2'
         self.executes = []
         expected_commands = [('rm', '-f', 'backing.qcow2.part')]
         self.assertRaises(exception.ImageUnacceptable,
-                          images.fetch_to_raw,
-                          context, image_id, target)
+                          images.image_to_raw,
+                          image_id, target, target + '.part')
         self.assertEqual(self.executes, expected_commands)
 
         del self.executes
+
+
+class FakeImageService(object):
+    def __init__(self, chunks, checksum=None):
+        self.chunks = chunks
+        self.checksum = checksum
+
+    def show(self, image_id):
+        return {'id': image_id, 'checksum': self.checksum}
+
+    def download(self, image_id, data):
+        for chunk in self.chunks:
+            data.write(chunk)
+
+
+class ImageWriterTestCase(base.TestCase):
+    def setUp(self):
+        super(ImageWriterTestCase, self).setUp()
+        self.path = os.path.join(tempfile.mkdtemp(), 'image')
+
+    def test_detect_format(self):
+        self.assertEqual('qcow2', images.detect_format('QFI\xfb\x00\x00'))
+        self.assertEqual('vdi', images.detect_format(
+                         '\x00' * 0x40 + '\x7f\x10\xda\xbe'))
+        self.assertEqual('raw', images.detect_format('\xeb\x63\x90'))
+        self.assertEqual('raw', images.detect_format(''))
+
+    def test_write_raw_sparse(self):
+        block = images._SPARSE_BLOCK_SIZE
+        chunks = ['\xeb' * 100, '\x00' * (block - 100),
+                  '\x00' * block, 'x' * block, '\x00' * block]
+        writer = images.ImageWriter(self.path, sparse=True)
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.close()
+
+        self.assertEqual('raw', writer.file_format)
+        self.assertEqual(self.path + '.part', writer.file_path)
+        self.assertEqual(4 * block, writer.size)
+        self.assertEqual(hashlib.md5(''.join(chunks)).hexdigest(),
+                         writer.checksum)
+        with open(writer.file_path, 'rb') as f:
+            self.assertEqual(''.join(chunks), f.read())
+        self.assertTrue(os.stat(writer.file_path).st_blocks * 512 <
+                        4 * block)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_write_qcow2(self):
+        chunks = ['QFI\xfb', '\x00' * 1024]
+        writer = images.ImageWriter(self.path, sparse=True)
+        for chunk in chunks:
+            writer.write(chunk)
+        writer.close()
+
+        self.assertEqual('qcow2', writer.file_format)
+        self.assertEqual(self.path + '.part', writer.file_path)
+        self.assertFalse(os.path.exists(self.path))
+        with open(self.path + '.part', 'rb') as f:
+            self.assertEqual(''.join(chunks), f.read())
+
+    def test_write_small_image(self):
+        writer = images.ImageWriter(self.path)
+        writer.write('abc')
+        writer.close()
+
+        with open(self.path + '.part', 'rb') as f:
+            self.assertEqual('abc', f.read())
+
+    def _copy_local_image(self, writer, content, data=None):
+        src_path = self.path + '.src'
+        with open(src_path, 'wb') as f:
+            f.write(content)
+        with mock.patch.object(base_image_service, '_COPY_CHUNK_SIZE',
+                               images._HEADER_SIZE):
+            with open(src_path, 'rb') as src:
+                result = base_image_service._copy_file(src, data or writer)
+        writer.write('end')
+        writer.close()
+        with open(self.path + '.part', 'rb') as f:
+            self.assertEqual(content + 'end', f.read())
+        self.assertEqual(len(content) + 3, writer.size)
+        self.assertEqual(hashlib.md5(content + 'end').hexdigest(),
+                         writer.checksum)
+        return result
+
+    def test_copy_local_image_sendfile(self):
+        content = 'QFI\xfb' + os.urandom(3 * images._HEADER_SIZE)
+        writer = images.ImageWriter(self.path, sparse=True)
+        self.assertEqual((len(content), 'sendfile'),
+                         self._copy_local_image(writer, content))
+        self.assertEqual('qcow2', writer.file_format)
+
+    def test_copy_local_image_sparse(self):
+        content = '\xeb' + '\x00' * (3 * images._HEADER_SIZE)
+        writer = images.ImageWriter(self.path, sparse=True)
+        self.assertEqual((len(content), 'copy'),
+                         self._copy_local_image(writer, content))
+
+    def test_copy_local_image_resumed(self):
+        content = 'QFI\xfb' + os.urandom(3 * images._HEADER_SIZE)
+        writer = images.ImageWriter(self.path)
+        writer.write(content[:images._HEADER_SIZE + 10])
+        resumed_writer = images._ResumedWriter(writer)
+        self.assertEqual((len(content), 'sendfile'),
+                         self._copy_local_image(writer, content,
+                                                resumed_writer))
+        self.assertEqual(0, resumed_writer.skip)
+
+
+class FetchTestCase(base.TestCase):
+    def setUp(self):
+        super(FetchTestCase, self).setUp()
+        self.path = os.path.join(tempfile.mkdtemp(), 'image')
+        self.chunks = ['a' * 1024, 'b' * 1024, 'c' * 1024]
+        self.checksum = hashlib.md5(''.join(self.chunks)).hexdigest()
+        metadata_cache.invalidate()
+        self.addCleanup(metadata_cache.invalidate)
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_fetch(self):
+        service = FakeImageService(self.chunks, self.checksum)
+
+        result = images.fetch('context', 'image', self.path, service)
+        self.assertEqual({'size': 3072, 'checksum': self.checksum}, result)
+        self.assertEqual(''.join(self.chunks), self._read())
+
+    def test_fetch_checksum_mismatch(self):
+        service = FakeImageService(self.chunks, 'bad-checksum')
+
+        self.assertRaises(exception.ImageDownloadFailed, images.fetch,
+                          'context', 'image', self.path, service)
+        self.assertFalse(os.path.exists(self.path))
+
+    def _failing_service(self, failures):
+        service = FakeImageService(self.chunks, self.checksum)
+        attempts = []
+
+        def _download(image_id, data):
+            attempts.append(image_id)
+            for i, chunk in enumerate(self.chunks):
+                if len(attempts) <= failures and i == len(attempts):
+                    raise IOError('connection reset')
+                data.write(chunk)
+
+        service.download = _download
+        return service, attempts
+
+    def test_fetch_resume(self):
+        self.config(glance_num_retries=2, group='glance')
+        service, attempts = self._failing_service(2)
+
+        result = images.fetch('context', 'image', self.path, service)
+        self.assertEqual(3, len(attempts))
+        self.assertEqual({'size': 3072, 'checksum': self.checksum}, result)
+        self.assertEqual(''.join(self.chunks), self._read())
+
+    def test_fetch_resume_no_retries(self):
+        self.config(glance_num_retries=0, group='glance')
+        service, attempts = self._failing_service(1)
+
+        self.assertRaises(IOError, images.fetch, 'context', 'image',
+                          self.path, service)
+        self.assertEqual(1, len(attempts))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_fetch_write_failure(self):
+        self.config(glance_num_retries=2, group='glance')
+        service = FakeImageService(self.chunks, self.checksum)
+
+        with mock.patch.object(images.FileWriter, 'write') as write_mock:
+            write_mock.side_effect = IOError('no space left on device')
+            self.assertRaises(IOError, images.fetch, 'context', 'image',
+                              self.path, service)
+            self.assertEqual(1, write_mock.call_count)
+
+
+class FetchToRawTestCase(base.TestCase):
+    def setUp(self):
+        super(FetchToRawTestCase, self).setUp()
+        self.path = os.path.join(tempfile.mkdtemp(), 'image')
+        metadata_cache.invalidate()
+        self.addCleanup(metadata_cache.invalidate)
+
+    @mock.patch.object(images, 'image_to_raw')
+    @mock.patch.object(images, 'qemu_img_info')
+    def test_fetch_to_raw_raw(self, info_mock, to_raw_mock):
+        info_mock.return_value.file_format = 'raw'
+        service = FakeImageService(['\xeb' * 1024, 'x' * 1024])
+
+        result = images.fetch_to_raw('context', 'image', self.path, service)
+        self.assertEqual({'size': 2048,
+                          'checksum': hashlib.md5('\xeb' * 1024 +
+                                                  'x' * 1024).hexdigest()},
+                         result)
+        info_mock.assert_called_once_with(self.path + '.part')
+        self.assertFalse(to_raw_mock.called)
+        self.assertFalse(os.path.exists(self.path + '.part'))
+        self.assertTrue(os.path.exists(self.path))
+
+    @mock.patch.object(images, 'qemu_img_info')
+    def test_fetch_to_raw_partial_image_not_at_path(self, info_mock):
+        info_mock.return_value.file_format = 'raw'
+        service = FakeImageService([])
+        seen = []
+
+        def _download(image_id, data):
+            data.write('\xeb' * 1024 * 1024)
+            # e.g. the conductor is killed here
+            seen.append(os.path.exists(self.path))
+            data.write('x' * 1024)
+
+        service.download = _download
+        service.checksum = hashlib.md5('\xeb' * 1024 * 1024 +
+                                       'x' * 1024).hexdigest()
+        images.fetch_to_raw('context', 'image', self.path, service)
+        self.assertEqual([False], seen)
+        self.assertTrue(os.path.exists(self.path))
+
+    @mock.patch.object(images, 'image_to_raw')
+    @mock.patch.object(images, 'qemu_img_info')
+    def test_fetch_to_raw_qcow2(self, info_mock, to_raw_mock):
+        service = FakeImageService(['QFI\xfb' + '\x00' * 1024])
+
+        images.fetch_to_raw('context', 'image', self.path, service)
+        self.assertFalse(info_mock.called)
+        to_raw_mock.assert_called_once_with('image', self.path,
+                                            self.path + '.part')
+        self.assertTrue(os.path.exists(self.path + '.part'))
+        self.assertFalse(os.path.exists(self.path))
+
+    @mock.patch.object(images, 'image_to_raw')
+    @mock.patch.object(images, 'qemu_img_info')
+    def test_fetch_to_raw_undetected_format(self, info_mock, to_raw_mock):
+        info_mock.return_value.file_format = 'dmg'
+        service = FakeImageService(['\xeb' * 1024])
+
+        images.fetch_to_raw('context', 'image', self.path, service)
+        to_raw_mock.assert_called_once_with('image', self.path,
+                                            self.path + '.part')
+        self.assertTrue(os.path.exists(self.path + '.part'))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_fetch_to_raw_download_failure(self):
+        service = FakeImageService([])
+
+        def _download(image_id, data):
+            data.write('\xeb' * 1024)
+            raise exception.ImageNotFound(image_id=image_id)
+
+        service.download = _download
+        self.assertRaises(exception.ImageNotFound, images.fetch_to_raw,
+                          'context', 'image', self.path, service)
+        self.assertFalse(os.path.exists(self.path))
+
+    @mock.patch.object(images, 'qemu_img_info')
+    def test_fetch_to_raw_checksum_mismatch(self, info_mock):
+        service = FakeImageService(['\xeb' * 1024], 'bad-checksum')
+
+        self.assertRaises(exception.ImageDownloadFailed, images.fetch_to_raw,
+                          'context', 'image', self.path, service)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(info_mock.called)
@@ -336,6 +336,11 @@ class GenericUtilsTestCase(base.TestCase):
         self.assertEqual(utils.safe_rstrip(value, '/'), rstripped_value)
         self.assertEqual(utils.safe_rstrip(not_rstripped, '/'), not_rstripped)
 
+    def test_unique(self):
+        self.assertEqual([], utils.unique([]))
+        self.assertEqual([3, 1, 2], utils.unique([3, 1, 3, 2, 1]))
+        self.assertEqual(['b', 'a'], utils.unique(('b', 'a', 'b')))
+
     def test_safe_rstrip_not_raises_exceptions(self):
         # Supplying an integer should normally raise an exception because it
         # does not save the rstrip() method.